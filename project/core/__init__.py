@@ -4,6 +4,9 @@ REDIS_KEYS = dict(
     last_fetched = 'last_fetched_%s',
     best_scored  = 'best_scored_%s',
     public_tags = 'public_tags_%s_%%d',
+    tag_stats = 'tag_stats_%s_%%d',
+    public_tags_inputs = 'public_tags_inputs_%s',
+    public_tags_signature = 'public_tags_signature_%s',
 )
 
 for key in REDIS_KEYS.keys():
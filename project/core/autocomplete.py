@@ -0,0 +1,227 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+"""
+A prefix index in redis, to autocomplete accounts and repositories without
+the search engine.
+For each model we have:
+    - a sorted set with all scores at 0, so sorted by value, with members
+      "term\\x00id", queried with ZRANGEBYLEX (redis >= 2.8.9)
+    - for each short prefix (up to AUTOCOMPLETE_PREFIX_LENGTH characters) of
+      the terms, a sorted set with the ids of the objects having a term
+      starting with it, with their score as score, so the best ones can be
+      read directly
+    - a hash with, for each id, the data to return (json with label, url and
+      score)
+    - a hash with, for each id, the terms indexed for it (json), to remove
+      them when the object changes
+Terms are the slug, the project and the name, and each word in them.
+"""
+
+import re
+
+from django.conf import settings
+from django.utils import simplejson
+
+from redisco import connection
+
+from core.core_utils import slugify
+
+KEYS = dict(
+    terms = 'autocomplete:%s',
+    data = 'autocomplete:%s:data',
+    object_terms = 'autocomplete:%s:object_terms',
+    prefix = 'autocomplete:%s:prefix:%s',
+)
+
+RE_WORDS = re.compile(r'[^a-z0-9]+')
+MIN_WORD_LENGTH = 2
+
+
+def normalize(value):
+    """
+    Return the given string lowercased, in ascii
+    """
+    if not value:
+        return ''
+    return slugify(value).strip('-')
+
+
+def get_terms(obj):
+    """
+    Return the terms to index for the given object
+    """
+    values = [obj.slug, obj.name]
+    if obj.model_name == 'repository':
+        values.append(obj.project)
+
+    terms = set()
+    for value in values:
+        value = normalize(value)
+        if not value:
+            continue
+        terms.add(value)
+        terms.update(word for word in RE_WORDS.split(value) if len(word) >= MIN_WORD_LENGTH)
+    return terms
+
+
+def get_data(obj):
+    """
+    Return the data to return for the given object when found
+    """
+    return dict(
+        id = obj.id,
+        label = obj.project if obj.model_name == 'repository' else obj.slug,
+        name = obj.name,
+        backend = obj.backend,
+        url = obj.get_absolute_url(),
+        score = obj.score or 0,
+    )
+
+
+def _member(term, obj_id):
+    return '%s\x00%d' % (term, obj_id)
+
+
+def _prefix_length():
+    return getattr(settings, 'AUTOCOMPLETE_PREFIX_LENGTH', 3)
+
+
+def get_prefixes(terms):
+    """
+    Return the short prefixes of the given terms
+    """
+    length = _prefix_length()
+    return set(term[:index] for term in terms for index in xrange(1, min(len(term), length) + 1))
+
+
+def index_objects(model_name, objects):
+    """
+    Update the index for the given objects (removed if deleted)
+    """
+    if not objects:
+        return
+    object_terms_key = KEYS['object_terms'] % model_name
+
+    old_terms = connection.hmget(object_terms_key, [obj.id for obj in objects])
+
+    pipeline = connection.pipeline()
+    for obj, old in zip(objects, old_terms):
+        old = set(simplejson.loads(old)) if old else set()
+        if obj.deleted:
+            new = set()
+        else:
+            new = get_terms(obj)
+
+        removed = old - new
+        if removed:
+            pipeline.zrem(KEYS['terms'] % model_name, *[_member(term, obj.id) for term in removed])
+        added = new - old
+        if added:
+            pipeline.zadd(KEYS['terms'] % model_name, **dict((_member(term, obj.id), 0) for term in added))
+
+        # the score may have changed, so all the prefixes are updated
+        new_prefixes = get_prefixes(new)
+        for prefix in get_prefixes(old) - new_prefixes:
+            pipeline.zrem(KEYS['prefix'] % (model_name, prefix), obj.id)
+        for prefix in new_prefixes:
+            pipeline.zadd(KEYS['prefix'] % (model_name, prefix), **{str(obj.id): obj.score or 0})
+
+        if new:
+            pipeline.hset(object_terms_key, obj.id, simplejson.dumps(list(new)))
+            pipeline.hset(KEYS['data'] % model_name, obj.id, simplejson.dumps(get_data(obj)))
+        else:
+            pipeline.hdel(object_terms_key, obj.id)
+            pipeline.hdel(KEYS['data'] % model_name, obj.id)
+    pipeline.execute()
+
+
+def index_object(obj):
+    """
+    Update the index for the given object
+    """
+    index_objects(obj.model_name, [obj])
+
+
+def index_range(model, start, end, batch_size=500):
+    """
+    Update the index for all objects of the given model with a pk in the
+    range [start, end[. Return the number of indexed objects
+    """
+    fields = ['slug', 'name', 'backend', 'score', 'deleted']
+    if model.model_name == 'repository':
+        fields.append('project')
+    queryset = model.objects.filter(deleted=False).only(*fields).order_by('pk')
+
+    nb = 0
+    while start < end:
+        objects = list(queryset.filter(pk__gte=start, pk__lt=end)[:batch_size])
+        if not objects:
+            break
+        index_objects(model.model_name, objects)
+        nb += len(objects)
+        start = objects[-1].pk + 1
+    return nb
+
+
+def _search_ids(model_name, prefix, limit):
+    """
+    Return the ids of, at max, `limit` objects having a term starting with the
+    given (normalized) prefix, the ones with the best score first (less than
+    `limit` if the read candidates are not enough, see below)
+    """
+    prefix_length = _prefix_length()
+    prefix_key = KEYS['prefix'] % (model_name, prefix[:prefix_length])
+
+    # short prefix: the best ones are directly in its sorted set
+    if len(prefix) <= prefix_length:
+        return connection.zrevrange(prefix_key, 0, limit - 1)
+
+    # few terms with this prefix: read them all, and sort the objects by score
+    max_candidates = getattr(settings, 'AUTOCOMPLETE_MAX_CANDIDATES', 200)
+    terms_key = KEYS['terms'] % model_name
+    start, end = '[%s' % prefix, '[%s\xff' % prefix
+    if connection.execute_command('ZLEXCOUNT', terms_key, start, end) <= max_candidates:
+        ids = set(member.rsplit('\x00', 1)[1]
+                  for member in connection.execute_command('ZRANGEBYLEX', terms_key, start, end))
+        if not ids:
+            return []
+        pipeline = connection.pipeline()
+        for obj_id in ids:
+            pipeline.zscore(prefix_key, obj_id)
+        scores = dict(zip(ids, pipeline.execute()))
+        return sorted(ids, key=lambda obj_id: scores[obj_id] or 0, reverse=True)[:limit]
+
+    # many ones: walk the objects of the short prefix, the best ones first,
+    # and keep the ones with a term starting with the full prefix (reading at
+    # most AUTOCOMPLETE_MAX_PAGES pages of candidates)
+    ids = []
+    object_terms_key = KEYS['object_terms'] % model_name
+    max_index = max_candidates * getattr(settings, 'AUTOCOMPLETE_MAX_PAGES', 5)
+    index = 0
+    while len(ids) < limit and index < max_index:
+        candidates = connection.zrevrange(prefix_key, index, index + max_candidates - 1)
+        if not candidates:
+            break
+        for obj_id, terms in zip(candidates, connection.hmget(object_terms_key, candidates)):
+            if terms and any(term.startswith(prefix) for term in simplejson.loads(terms)):
+                ids.append(obj_id)
+                if len(ids) >= limit:
+                    break
+        index += max_candidates
+    return ids
+
+
+def search(model_name, prefix, limit=10):
+    """
+    Return the data of, at max, `limit` objects having a term starting with
+    the given prefix, the ones with the best score first
+    """
+    prefix = normalize(prefix)
+    if not prefix:
+        return []
+
+    ids = _search_ids(model_name, prefix, limit)
+    if not ids:
+        return []
+
+    return [simplejson.loads(data) for data in connection.hmget(KEYS['data'] % model_name, ids) if data]
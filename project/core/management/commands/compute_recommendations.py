@@ -0,0 +1,170 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+import sys
+from datetime import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import recommendations
+from core.models import Repository
+from tagging.models import PublicTaggedRepository, Tag
+
+
+class Command(BaseCommand):
+    """
+    Compute the recommendations (see core.recommendations) from the public
+    tags of all repositories, with a sparse repositories x tags matrix:
+        - similar repositories: cosine similarity of the (weighted) tags of
+          the repositories, with rare tags counting more than frequent ones
+          (idf). Forks are never recommended, and for the same similarity the
+          best scored repositories come first. Tags used by too many
+          repositories (`--max-frequency`) are ignored: they say nearly
+          nothing about the similarity, and would make the products of
+          the matrices nearly dense.
+        - co-occurring tags: number of repositories having both tags
+    Only the `--size` best ones are saved for each repository or tag.
+    NumPy and SciPy are needed (only by this command).
+    """
+    help = 'Compute the similar repositories and the co-occurring tags'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--size', type='int', dest='size', default=10,
+            help='Number of similar repositories (or tags) saved for each one (default: 10)'),
+        make_option('--block-size', type='int', dest='block_size', default=500,
+            help='Number of repositories compared to all others at once (default: 500)'),
+        make_option('--max-frequency', type='float', dest='max_frequency', default=0.05,
+            help='Ignore, for the similar repositories, the tags used by more than this ratio of repositories (default: 0.05)'),
+        make_option('--min-similarity', type='float', dest='min_similarity', default=0.1,
+            help='Minimum similarity of two repositories (default: 0.1)'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only compute, do not save the recommendations'),
+    )
+
+    def log(self, message):
+        sys.stderr.write('[%s] %s\n' % (datetime.utcnow(), message))
+
+    def load(self):
+        """
+        Return the ids of the repositories with public tags, their score and
+        fork status, the slugs of the tags, and the matrix of the weights
+        """
+        repositories, tags = {}, {}
+        rows, cols, weights = [], [], []
+        for repository_id, tag_id, weight in PublicTaggedRepository.objects.filter(
+                content_object__deleted=False).values_list('content_object', 'tag', 'weight').iterator():
+            rows.append(repositories.setdefault(repository_id, len(repositories)))
+            cols.append(tags.setdefault(tag_id, len(tags)))
+            weights.append(weight or 1)
+
+        repositories_ids = [None] * len(repositories)
+        for repository_id, index in repositories.iteritems():
+            repositories_ids[index] = repository_id
+        tags_ids = [None] * len(tags)
+        for tag_id, index in tags.iteritems():
+            tags_ids[index] = tag_id
+
+        infos = {}
+        for index in xrange(0, len(repositories_ids), 1000):
+            infos.update((values[0], values[1:]) for values in Repository.objects.filter(
+                id__in=repositories_ids[index:index + 1000]).values_list('id', 'score', 'is_fork'))
+        scores = self.numpy.array([infos[repository_id][0] or 0 for repository_id in repositories_ids])
+        forks = self.numpy.array([bool(infos[repository_id][1]) for repository_id in repositories_ids])
+
+        slugs = dict(Tag.objects.filter(id__in=tags_ids).values_list('id', 'slug'))
+        tags_slugs = [slugs[tag_id] for tag_id in tags_ids]
+
+        matrix = self.sparse.csr_matrix((weights, (rows, cols)),
+            shape=(len(repositories_ids), len(tags_ids)), dtype=self.numpy.float64)
+
+        return repositories_ids, scores, forks, tags_slugs, matrix
+
+    def get_similar(self, repositories_ids, scores, forks, matrix, size, block_size, min_similarity, max_frequency):
+        """
+        Return, for each repository, the list of (id, similarity) of the
+        `size` most similar (not fork) repositories
+        """
+        numpy, sparse = self.numpy, self.sparse
+
+        # idf: a tag used by many repositories says less about them
+        nb_repositories = matrix.shape[0]
+        frequencies = numpy.bincount(matrix.indices, minlength=matrix.shape[1])
+        idf = numpy.log(float(nb_repositories) / numpy.maximum(frequencies, 1)) + 1
+        idf[frequencies > max_frequency * nb_repositories] = 0
+        weighted = matrix * sparse.diags(idf, 0)
+        weighted.eliminate_zeros()
+
+        # normalize rows to have the cosine similarity with a dot product
+        norms = numpy.sqrt(numpy.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        weighted = sparse.diags(1 / numpy.maximum(norms, 1e-12), 0) * weighted
+        weighted = weighted.tocsr()
+
+        candidates = numpy.flatnonzero(~forks)
+        candidates_matrix = weighted[candidates].T.tocsc()
+
+        similar = {}
+        for start in xrange(0, nb_repositories, block_size):
+            block = (weighted[start:start + block_size] * candidates_matrix).tocsr()
+            for row in xrange(block.shape[0]):
+                index = start + row
+                values = block.data[block.indptr[row]:block.indptr[row + 1]]
+                columns = candidates[block.indices[block.indptr[row]:block.indptr[row + 1]]]
+                keep = (columns != index) & (values >= min_similarity)
+                values, columns = values[keep], columns[keep]
+                # best similarity first, then best score
+                order = numpy.lexsort((-scores[columns], -values))[:size]
+                similar[repositories_ids[index]] = [
+                    (repositories_ids[column], round(value, 6))
+                    for column, value in zip(columns[order], values[order])]
+            self.log('%d/%d repositories compared' % (min(start + block_size, nb_repositories), nb_repositories))
+
+        return similar
+
+    def get_cooccurring(self, tags_slugs, matrix, size):
+        """
+        Return, for each tag, the list of (slug, number of repositories) of
+        the `size` tags used the most often with it
+        """
+        numpy = self.numpy
+
+        binary = matrix.copy()
+        binary.data[:] = 1
+        cooccurrences = (binary.T * binary).tocsr()
+
+        cooccurring = {}
+        for index in xrange(cooccurrences.shape[0]):
+            values = cooccurrences.data[cooccurrences.indptr[index]:cooccurrences.indptr[index + 1]]
+            columns = cooccurrences.indices[cooccurrences.indptr[index]:cooccurrences.indptr[index + 1]]
+            keep = columns != index
+            values, columns = values[keep], columns[keep]
+            order = numpy.argsort(-values, kind='mergesort')[:size]
+            cooccurring[tags_slugs[index]] = [
+                (tags_slugs[column], int(value)) for column, value in zip(columns[order], values[order])]
+
+        return cooccurring
+
+    def handle(self, *args, **options):
+        try:
+            import numpy
+            from scipy import sparse
+        except ImportError:
+            raise CommandError('NumPy and SciPy are needed to compute the recommendations')
+        self.numpy, self.sparse = numpy, sparse
+
+        repositories_ids, scores, forks, tags_slugs, matrix = self.load()
+        self.log('%d repositories, %d tags, %d public tags' % (matrix.shape[0], matrix.shape[1], matrix.nnz))
+        if not matrix.nnz:
+            return
+
+        similar = self.get_similar(repositories_ids, scores, forks, matrix,
+            options['size'], options['block_size'], options['min_similarity'], options['max_frequency'])
+        cooccurring = self.get_cooccurring(tags_slugs, matrix, options['size'])
+
+        if options['dry_run']:
+            nb_similar = sum(1 for repository_similar in similar.itervalues() if repository_similar)
+            self.stdout.write('%d repositories with similar ones, %d tags\n' % (nb_similar, len(cooccurring)))
+            return
+
+        recommendations.save('similar', similar)
+        recommendations.save('cooccurring', cooccurring)
+        self.log('recommendations saved')
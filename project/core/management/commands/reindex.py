@@ -0,0 +1,168 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+import sys
+from datetime import datetime
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection as db_connection
+from django.db.models import Max, Min
+
+from haystack import site
+from redisco import connection
+
+from core import autocomplete
+from core.models import Account, Repository
+from core.search_commit import index_written, bump_index_generation, COMMIT_NEEDED
+from core.search_documents import SearchDocumentsBuilder
+
+MODELS = dict(
+    account = Account,
+    repository = Repository,
+)
+
+CHECKPOINT_KEY = 'reindex:%s'
+
+
+def close_connections():
+    """
+    Close the database and redis connections of the parent process before
+    creating the processes, so they do not inherit (and share) them. The
+    parent reopens them when needed
+    """
+    db_connection.close()
+    connection.connection_pool.disconnect()
+
+
+def init_process():
+    """
+    Each process must use its own database and redis connections, not the
+    ones of the parent process. Only forget the database one if any: closing
+    it would also end the session of the parent on the server
+    """
+    db_connection.connection = None
+
+
+def index_chunk(args):
+    """
+    Index all the objects of the given model with a pk in the range [start,
+    end[, sending them by batches of `batch_size` objects to the search
+    engine (see core.search_documents), then save the chunk as done in the
+    checkpoint. The autocomplete index is also updated if asked.
+    Return the chunk, the number of indexed objects, and an error (or None)
+    """
+    model_name, start, end, batch_size, with_autocomplete = args
+
+    try:
+        builder = SearchDocumentsBuilder(MODELS[model_name])
+        nb = builder.update_range(start, end, batch_size)
+        if with_autocomplete:
+            autocomplete.index_range(MODELS[model_name], start, end, batch_size)
+    except Exception, e:
+        return start, 0, '%s' % e
+
+    connection.hset(CHECKPOINT_KEY % model_name, start, nb)
+    return start, nb, None
+
+
+class Command(BaseCommand):
+    """
+    Reindex all objects of the given models (all if none given) in the search
+    engine. The pk range is split in chunks, indexed by many processes, each
+    sending batches of documents. Indexed chunks are saved in redis, so an
+    interrupted run can be resumed with the --resume option.
+    """
+    args = '[account] [repository]'
+    help = 'Reindex accounts and/or repositories in the search engine'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes', default=4,
+            help='Number of processes (default: 4)'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=10000,
+            help='Number of pks by chunk, the unit of work of a process (default: 10000)'),
+        make_option('--batch-size', type='int', dest='batch_size', default=500,
+            help='Number of documents sent to the search engine at once (default: 500)'),
+        make_option('--resume', action='store_true', dest='resume', default=False,
+            help='Skip the chunks indexed by a previous run'),
+        make_option('--autocomplete', action='store_true', dest='autocomplete', default=False,
+            help='Also update the autocomplete index'),
+        make_option('--no-commit', action='store_false', dest='commit', default=True,
+            help='Do not commit the search engine at the end'),
+    )
+
+    def handle(self, *args, **options):
+        for model_name in args:
+            if model_name not in MODELS:
+                raise CommandError('Invalid model "%s", should be one of: %s' % (model_name, ', '.join(MODELS)))
+        for model_name in (args or sorted(MODELS)):
+            self.reindex(model_name, **options)
+
+    def log(self, message):
+        sys.stderr.write('[%s] %s\n' % (datetime.utcnow(), message))
+
+    def get_chunks(self, model_name, chunk_size, resume):
+        """
+        Return the list of chunks (start, end) to index, starting a new
+        checkpoint if not resuming. When resuming, the chunk size of the
+        previous run is used
+        """
+        key = CHECKPOINT_KEY % model_name
+        done = connection.hgetall(key) if resume else {}
+        if done:
+            chunk_size = int(done.pop('chunk_size', chunk_size))
+        else:
+            connection.delete(key)
+            connection.hset(key, 'chunk_size', chunk_size)
+
+        model = MODELS[model_name]
+        bounds = model.objects.aggregate(min=Min('pk'), max=Max('pk'))
+        if bounds['min'] is None:
+            return []
+
+        first = bounds['min'] - bounds['min'] % chunk_size
+        return [(start, start + chunk_size)
+            for start in xrange(first, bounds['max'] + 1, chunk_size)
+                if str(start) not in done]
+
+    def reindex(self, model_name, processes, chunk_size, batch_size, resume, commit, autocomplete, **options):
+        chunks = self.get_chunks(model_name, chunk_size, resume)
+        self.log('%s: %d chunks to index' % (model_name, len(chunks)))
+        if not chunks:
+            return
+
+        tasks = [(model_name, start, end, batch_size, autocomplete) for start, end in chunks]
+
+        start_time = datetime.utcnow()
+        nb_docs = nb_chunks = nb_errors = 0
+
+        close_connections()
+        pool = Pool(processes, init_process)
+        try:
+            for start, nb, error in pool.imap_unordered(index_chunk, tasks):
+                nb_chunks += 1
+                if error:
+                    nb_errors += 1
+                    self.log('%s: ERROR in chunk starting at %d: %s' % (model_name, start, error))
+                    continue
+                nb_docs += nb
+                duration = datetime.utcnow() - start_time
+                seconds = duration.days * 86400 + duration.seconds + duration.microseconds / 1000000.0
+                self.log('%s: chunk %d/%d done, %d documents in %s (%.1f docs/sec)' % (
+                    model_name, nb_chunks, len(chunks), nb_docs, duration, nb_docs / (seconds or 1)))
+        finally:
+            pool.close()
+            pool.join()
+
+        if commit and COMMIT_NEEDED:
+            site.get_index(MODELS[model_name]).backend.conn.commit()
+            bump_index_generation(model_name)
+        elif nb_docs:
+            # let the `search_commit` worker do it (if needed)
+            index_written(model_name, nb_docs)
+
+        if nb_errors:
+            self.log('%s: %d chunks in error, run again with --resume to index them' % (model_name, nb_errors))
+        else:
+            connection.delete(CHECKPOINT_KEY % model_name)
+            self.log('%s: done' % model_name)
@@ -0,0 +1,46 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from core.models import Repository
+from core.readme import make_readme_digest
+
+
+class Command(BaseCommand):
+    """
+    Compute the readme digest (see core.readme) of all repositories with a
+    readme, for the ones fetched before the digest existed (or after a change
+    in the way digests are computed).
+    The column must exist in the database:
+        ALTER TABLE core_repository ADD COLUMN readme_digest text NULL;
+    Run the `reindex` command after this one to update the search engine.
+    """
+    help = 'Compute the readme digest of all repositories'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=500,
+            help='Number of repositories loaded at once (default: 500)'),
+        make_option('--missing', action='store_true', dest='missing', default=False,
+            help='Only for repositories without digest'),
+    )
+
+    def handle(self, *args, **options):
+        queryset = Repository.objects.filter(readme_modified__isnull=False
+            ).only('id', 'readme', 'readme_html').order_by('pk')
+        if options['missing']:
+            queryset = queryset.filter(readme_digest__isnull=True)
+
+        start, nb = 0, 0
+        while True:
+            repositories = list(queryset.filter(pk__gte=start)[:options['batch_size']])
+            if not repositories:
+                break
+            for repository in repositories:
+                # an update, not a save, to not touch the other fields
+                Repository.objects.filter(pk=repository.pk).update(
+                    readme_digest=make_readme_digest(repository.readme, repository.readme_html))
+            nb += len(repositories)
+            start = repositories[-1].pk + 1
+            self.stdout.write('%d repositories updated\n' % nb)
@@ -50,6 +50,8 @@ class SyncableModelManager(models.Manager):
     def update_external(self, print_delta=0, start=0, select_related=None):
         """
         Update search index and cached_templates for all objects
+        (see the `reindex` management command for a faster way to reindex
+        all objects)
         """
         qs = self.all()
         if select_related:
@@ -85,6 +87,7 @@ class AccountManager(SyncableModelManager):
 
         account = self.get_or_new(backend.name, original_login)
         account.access_token = access_token
+        user_changed = account.user_id != social_auth_user.user.id
         account.user = social_auth_user.user
         account.deleted = False
 
@@ -93,6 +96,11 @@ class AccountManager(SyncableModelManager):
         else:
             account.save()
 
+        if user_changed:
+            # the owner's user is stored in the search documents of repositories
+            for repository in account.own_repositories.all():
+                repository.update_related_data(async=True)
+
         token = None
         if access_token:
             token = account.get_default_token()
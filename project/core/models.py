@@ -6,7 +6,8 @@ import math
 import sys
 import traceback
 
-from django.db import models, transaction, IntegrityError, DatabaseError
+from django.db import models, connection, transaction, IntegrityError, DatabaseError
+from django.db.models import Count
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.utils import simplejson
@@ -30,9 +31,14 @@ from core.managers import (AccountManager, RepositoryManager,
 from core.core_utils import slugify
 from core.exceptions import BackendNotFoundError, BackendRequestNotModified, BackendSuspendedTokenError, MultipleBackendError
 from core import messages as offline_messages
-
-from tagging.models import PublicTaggedAccount, PublicTaggedRepository, PrivateTaggedAccount, PrivateTaggedRepository, all_official_tags
-from tagging.words import get_tags_for_repository
+from core.search_commit import index_written
+from core.autocomplete import index_object as update_autocomplete
+from core.readme import make_readme_digest
+from core import relatives
+from core import recommendations
+
+from tagging.models import PublicTaggedAccount, PublicTaggedRepository, PrivateTaggedAccount, PrivateTaggedRepository, all_official_tags, official_tags_generation
+from tagging.words import get_tags_for_repository, text_types
 from tagging.managers import TaggableManager
 from notes.models import Note
 
@@ -193,7 +199,9 @@ class SyncableModel(TimeStampedModel):
     def update_related_data(self, async=False):
         """
         Update data related to this object, as score,
-        search index, public tags
+        search index, public tags.
+        If not `async`, return True if the public tags were computed, False if
+        their inputs didn't change (see `find_public_tags_if_changed`)
         """
         if async:
             self_str = self.simple_str()
@@ -204,8 +212,25 @@ class SyncableModel(TimeStampedModel):
             return
 
         self.update_score()
+        relatives.update_object(self)
         self.update_search_index()
+        update_autocomplete(self)
+        return self.find_public_tags_if_changed()
+
+    def find_public_tags_if_changed(self):
+        """
+        Call `find_public_tags` only if the data used to compute the public
+        tags (see `public_tags_inputs`) changed since the last time. A digest
+        of this data is kept, for each object, in a redis hash.
+        Return True if the public tags were computed
+        """
+        inputs_hash = Hash(self.get_redis_key('public_tags_inputs'))
+        digest = md5_constructor(repr(self.public_tags_inputs())).hexdigest()
+        if inputs_hash[self.id] == digest:
+            return False
         self.find_public_tags()
+        inputs_hash[self.id] = digest
+        return True
 
     def fetch_needed(self):
         """
@@ -641,14 +666,26 @@ class SyncableModel(TimeStampedModel):
         if save:
             self.save()
 
-    def update_search_index(self, search_index=None):
+    def update_search_index(self, search_index=None, async=False):
         """
-        Update the search index for the current object
+        Update the search index for the current object.
+        If `async`, the update is only queued, and skipped if a full update of
+        the related data (which updates the search index) is already queued
         """
 
         if not settings.INDEX_ACTIVATED:
             return
 
+        if async:
+            self_str = self.simple_str()
+            if self_str in Set(settings.WORKER_UPDATE_RELATED_DATA_SET_KEY):
+                return
+            to_update_set = Set(settings.WORKER_UPDATE_SEARCH_INDEX_SET_KEY)
+            if self_str not in to_update_set:
+                to_update_set.add(self_str)
+                List(settings.WORKER_UPDATE_SEARCH_INDEX_KEY).append(self_str)
+            return
+
         if self.deleted:
             return
 
@@ -656,6 +693,7 @@ class SyncableModel(TimeStampedModel):
             if not search_index:
                 search_index = self.get_search_index()
             search_index.backend.update(search_index, [self], commit=False)
+            index_written(self.model_name)
         except Exception, e:
             sys.stderr.write('ERROR in update_search_index for %s : %s' % (self.simple_str(), e))
 
@@ -669,6 +707,7 @@ class SyncableModel(TimeStampedModel):
 
         try:
             self.get_search_index().backend.remove(self, commit=False)
+            index_written(self.model_name)
         except:
             pass
 
@@ -809,6 +848,8 @@ class SyncableModel(TimeStampedModel):
 
         # add the entry
         getattr(self, self_entries_name).add(obj)
+        relatives.add(self, self_entries_name, obj)
+        relatives.add(obj, reverse_entries_name, self)
 
         # update the count if we can
         if update_self_count:
@@ -818,6 +859,11 @@ class SyncableModel(TimeStampedModel):
         if not is_new:
             obj.update_count(reverse_entries_name, async=True)
 
+        # the relation is stored in the other object's search document (only
+        # this document changes, and a saved object is already fully updated)
+        if not to_save:
+            obj.update_search_index(async=True)
+
         return obj
 
     def remove_related_account_entry(self, account, self_entries_name, reverse_entries_name, update_self_count=True):
@@ -854,6 +900,8 @@ class SyncableModel(TimeStampedModel):
         """
         # remove from the list
         getattr(self, self_entries_name).remove(obj)
+        relatives.remove(self, self_entries_name, obj)
+        relatives.remove(obj, reverse_entries_name, self)
 
         # update the count if we can
         if update_self_count:
@@ -862,6 +910,10 @@ class SyncableModel(TimeStampedModel):
         # update the reverse count for the other object
         obj.update_count(reverse_entries_name, async=True)
 
+        # the relation is stored in the other object's search document (only
+        # this document changes)
+        obj.update_search_index(async=True)
+
         return obj
 
     def fake_delete(self, to_update):
@@ -876,6 +928,7 @@ class SyncableModel(TimeStampedModel):
         ))
         self.update(**to_update)
         self.remove_from_search_index()
+        update_autocomplete(self)
         SortedSet(self.get_redis_key('last_fetched')).remove(self.id)
         SortedSet(self.get_redis_key('best_scored')).remove(self.id)
 
@@ -953,29 +1006,80 @@ class SyncableModel(TimeStampedModel):
         """
         return self._get_url('edit_note')
 
+    def get_tag_stats(self):
+        """
+        Return the statistics of the private tags of this object, as a dict
+        with the number of taggers (`taggers`), and the number of tags of each
+        type (see `count_tags`; `all` for all tags). Kept in a redis hash,
+        built the first time it's needed, then updated on each change of the
+        private tags of the object (see core.signals).
+        """
+        if not hasattr(self, '_tag_stats'):
+            stats = Hash(self.get_redis_key('tag_stats') % self.id).hgetall()
+            if stats:
+                self._tag_stats = dict((key, int(value)) for key, value in stats.items())
+            else:
+                self.update_tag_stats()
+        return self._tag_stats
+
+    def update_tag_stats(self):
+        """
+        Compute the statistics of the private tags of this object (see
+        `get_tag_stats`) with two aggregated queries, and save them
+        """
+        tagged_items = self.private_tags_class.objects.filter(content_object=self)
+        stats = dict(taggers=0, all=0, places=0, projects=0, starred=0, tags=0)
+        stats['check-later'] = 0
+
+        for tag in tagged_items.values('tag__name', 'tag__slug').annotate(count=Count('id')).order_by():
+            stats['all'] += tag['count']
+            if tag['tag__name'].startswith('@'):
+                stats['places'] += tag['count']
+            elif tag['tag__name'].startswith('#'):
+                stats['projects'] += tag['count']
+            elif tag['tag__slug'] in ('starred', 'check-later'):
+                stats[tag['tag__slug']] += tag['count']
+            else:
+                stats['tags'] += tag['count']
+
+        if stats['all']:
+            stats['taggers'] = tagged_items.aggregate(taggers=Count('owner', distinct=True))['taggers']
+
+        Hash(self.get_redis_key('tag_stats') % self.id).hmset(stats)
+        self._tag_stats = stats
+
     def count_taggers(self):
         """
         Return the number of users with at least one tag on this object
         """
-        # TODO : must be a better way (group by ?)
-        return len(set(self.private_tags_class.objects.filter(content_object=self).values_list('owner', flat=True)))
+        return self.get_tag_stats()['taggers']
 
     def count_tags(self, tags_type=None):
         """
+        Return the number of private tags on this object, of the given type
+        (places, projects, starred, check-later, tags), or all if no type
         """
-        queryset = self.private_tags
-        if tags_type == 'places':
-            queryset = queryset.filter(name__startswith='@')
-        elif tags_type == 'projects':
-            queryset = queryset.filter(name__startswith='#')
-        elif tags_type == 'starred':
-            queryset = queryset.filter(slug='starred')
-        elif tags_type == 'check-later':
-            queryset = queryset.filter(slug='check-later')
-        elif tags_type == 'tags':
-            queryset = queryset.exclude(name__startswith='#').exclude(name__startswith='@').exclude(slug='check-later').exclude(slug='starred')
+        return self.get_tag_stats().get(tags_type or 'all', 0)
 
-        return queryset.count()
+
+# public tags of an account (see Account.find_public_tags): tags of its
+# repositories, with weights divided by 2 for forks and by 3 for repositories
+# owned by someone else (params: the account id, twice)
+FIND_ACCOUNT_PUBLIC_TAGS_SQL = """
+    SELECT tag.slug, SUM(
+        COALESCE(NULLIF(tagged.weight, 0), 1)
+        / (CASE WHEN repository.is_fork THEN 2.0 ELSE 1.0 END)
+        / (CASE WHEN repository.owner_id = %%s THEN 1.0 ELSE 3.0 END)
+    ) AS total
+    FROM %(link)s AS link
+        INNER JOIN %(repository)s AS repository ON repository.id = link.%(link_repository)s
+        INNER JOIN %(tagged)s AS tagged ON tagged.content_object_id = repository.id
+        INNER JOIN %(tag)s AS tag ON tag.id = tagged.tag_id
+    WHERE link.%(link_account)s = %%s
+    GROUP BY tag.slug
+    ORDER BY total DESC, tag.slug
+    LIMIT 5
+"""
 
 
 class Account(SyncableModel):
@@ -1221,6 +1325,22 @@ class Account(SyncableModel):
             self._followers_ids = self.followers.values_list('id', flat=True)
         return self._followers_ids
 
+    def repositories_ids(self):
+        """
+        Return the followed repositories as a list of ids
+        """
+        if not hasattr(self, '_repositories_ids'):
+            self._repositories_ids = self.repositories.values_list('id', flat=True)
+        return self._repositories_ids
+
+    def contributing_ids(self):
+        """
+        Return the contributed repositories as a list of ids
+        """
+        if not hasattr(self, '_contributing_ids'):
+            self._contributing_ids = self.contributing.values_list('id', flat=True)
+        return self._contributing_ids
+
     def prepare_score(self):
         """
         Compute the current score for this account
@@ -1272,27 +1392,44 @@ class Account(SyncableModel):
         score = super(Account, self).score_to_boost(force_compute=force_compute)
         return math.log10(max(score*100, 5) / 2.0) - 0.3
 
-    def find_public_tags(self):
+    def public_tags_inputs(self):
         """
-        Update the public tags for this accounts.
+        Return the data used to compute the public tags (see
+        `find_public_tags`): for each repository of the account, its fork and
+        owner status, and the signature of its public tags
         """
-        tags = {}
-        # we use values for a big memory optimization on accounts with a lot of repositories
-        rep_tagged_items = PublicTaggedRepository.objects.filter(content_object__followers=self).values('content_object__is_fork', 'content_object__owner__id', 'tag__slug', 'weight')
-        for tagged_item in rep_tagged_items:
-            divider = 1.0
-            slug = tagged_item['tag__slug']
-            if tagged_item['content_object__is_fork']:
-                divider = 2
-            if tagged_item['content_object__owner__id'] != self.id:
-                divider = divider * 3
-            if slug not in tags:
-                tags[slug] = 0
-            tags[slug] += (tagged_item['weight'] or 1) / divider
-
-        tags = sorted(tags.iteritems(), key=lambda t: t[1], reverse=True)
+        repositories = sorted(Account.repositories.through.objects.filter(account=self).values_list(
+            'repository_id', 'repository__is_fork', 'repository__owner_id'))
+        if not repositories:
+            return []
+        signatures = Hash(REDIS_KEYS['public_tags_signature']['repository']).hmget(
+            [repository[0] for repository in repositories])
+        return [(repository_id, bool(is_fork), owner_id == self.id, signature)
+            for (repository_id, is_fork, owner_id), signature in zip(repositories, signatures)]
 
-        self.public_tags.set(tags[:5])
+    def find_public_tags(self):
+        """
+        Update the public tags for this accounts.
+        The weight of a tag is the sum of its weights on the repositories of
+        the account, divided by 2 for forks and by 3 for repositories not
+        owned by the account. It's computed by the database, which only
+        returns the 5 best tags.
+        """
+        quote = connection.ops.quote_name
+        through = Account.repositories.through
+
+        cursor = connection.cursor()
+        cursor.execute(FIND_ACCOUNT_PUBLIC_TAGS_SQL % dict(
+            link = quote(through._meta.db_table),
+            link_account = quote(through._meta.get_field('account').column),
+            link_repository = quote(through._meta.get_field('repository').column),
+            repository = quote(Repository._meta.db_table),
+            tagged = quote(PublicTaggedRepository._meta.db_table),
+            tag = quote(PublicTaggedRepository.tag_model()._meta.db_table),
+        ), [self.id, self.id])
+        tags = cursor.fetchall()
+
+        self.public_tags.set(tags)
 
         # force cache update
         self.all_public_tags(force_cache=True)
@@ -1307,9 +1444,9 @@ class Account(SyncableModel):
         Else simply returns tags.
         in both cases, sort is by weight (desc) and slug (asc)
         """
-        if not hasattr(self, '_all_public_tags'):
+        if not hasattr(self, '_all_user_tags'):
             self._all_user_tags = {}
-        if with_weight not in self._all_user_tags:
+        if force_cache or with_weight not in self._all_user_tags:
             if with_weight:
                 result = self.publictaggedaccount_set.select_related('tag').all()
             else:
@@ -1426,6 +1563,8 @@ class Account(SyncableModel):
         Set the account as deleted and remove if from every automatic
         lists (not from ones created by users : tags, notes...)
         """
+        relatives.remove_object(self)
+
         to_update = {}
         now = datetime.utcnow()
 
@@ -1565,6 +1704,8 @@ class Repository(SyncableModel):
     default_branch = models.CharField(max_length=255, blank=True, null=True)
     readme = models.TextField(blank=True, null=True)
     readme_html = models.TextField(blank=True, null=True)
+    # the words of the readme, used for search and tags (see core.readme)
+    readme_digest = models.TextField(blank=True, null=True)
     readme_type = models.CharField(max_length=10, blank=True, null=True)
     readme_modified = models.DateTimeField(blank=True, null=True)
 
@@ -1725,6 +1866,7 @@ class Repository(SyncableModel):
 
         if not (self.is_fork and self.official_fork_of):
             if self.parent_fork_id:
+                relatives.remove(self.parent_fork, 'forks', self)
                 self.parent_fork = None
                 self.save()
             return False
@@ -1751,6 +1893,7 @@ class Repository(SyncableModel):
             if not self.parent_fork_id:
                 self.parent_fork = parent_fork
             self.save()
+            relatives.add(self.parent_fork, 'forks', self)
             if not parent_is_new:
                 self.parent_fork.update_count('forks', async=True)
 
@@ -1873,6 +2016,7 @@ class Repository(SyncableModel):
         self.readme = raw
         self.readme_html = html
         self.readme_type = 'html'
+        self.readme_digest = make_readme_digest(raw, html)
 
         self.readme_modified = datetime.utcnow()
         self.save()
@@ -1893,7 +2037,7 @@ class Repository(SyncableModel):
             parts['infos'] += 0.3
         if self.description:
             parts['infos'] += 0.3
-        if self.readme:
+        if self.readme_digest:
             parts['infos'] += 0.3
 
         if backend.supports('repository_created_date'):
@@ -1948,6 +2092,14 @@ class Repository(SyncableModel):
         score = super(Repository, self).score_to_boost(force_compute=force_compute)
         return math.log1p(max(score*100, 5) / 5.0) - 0.6
 
+    def public_tags_inputs(self):
+        """
+        Return the data used to compute the public tags (see
+        `find_public_tags`): the texts of the repository, and the generation
+        of the official tags
+        """
+        return [getattr(self, text_type) for text_type in sorted(text_types)] + [official_tags_generation()]
+
     def find_public_tags(self, known_tags=None):
         """
         Update the public tags for this repository.
@@ -1958,6 +2110,9 @@ class Repository(SyncableModel):
         tags = sorted(rep_tags.iteritems(), key=lambda t: t[1], reverse=True)
         self.public_tags.set(tags[:5])
 
+        # used by the accounts to know if their public tags must be computed
+        Hash(self.get_redis_key('public_tags_signature'))[self.id] = md5_constructor(repr(tags[:5])).hexdigest()
+
         # force cache update
         self.all_public_tags(force_cache=True)
 
@@ -1971,17 +2126,22 @@ class Repository(SyncableModel):
         Else simply returns tags.
         in both cases, sort is by weight (desc) and slug (asc)
         """
-        if with_weight:
-            return self.publictaggedrepository_set.select_related('tag').all()
-        else:
-            cache_key = self.get_redis_key('public_tags') % self.id
-            tags = None
-            if not force_cache:
-                tags = cache.get(cache_key)
-            if tags is None:
-                tags = self.public_tags.order_by('-public_repository_tags__weight', 'slug')
-                cache.set(cache_key, tags, 2678400)
-            return tags
+        if not hasattr(self, '_all_user_tags'):
+            self._all_user_tags = {}
+        if force_cache or with_weight not in self._all_user_tags:
+            if with_weight:
+                result = self.publictaggedrepository_set.select_related('tag').all()
+            else:
+                cache_key = self.get_redis_key('public_tags') % self.id
+                tags = None
+                if not force_cache:
+                    tags = cache.get(cache_key)
+                if tags is None:
+                    tags = self.public_tags.order_by('-public_repository_tags__weight', 'slug')
+                    cache.set(cache_key, tags, 2678400)
+                result = tags
+            self._all_user_tags[with_weight] = result
+        return self._all_user_tags[with_weight]
 
     def all_private_tags(self, user):
         """
@@ -1991,6 +2151,19 @@ class Repository(SyncableModel):
         """
         return self.private_tags.filter(private_repository_tags__owner=user).order_by('-private_repository_tags__weight', 'slug').distinct()
 
+    def get_similar(self, limit=None):
+        """
+        Return the repositories similar to this one (computed offline by the
+        `compute_recommendations` command), the most similar first
+        """
+        if not hasattr(self, '_similar'):
+            self._similar = {}
+        if limit not in self._similar:
+            ids = recommendations.get_similar_ids(self.id, limit)
+            repositories = Repository.objects.filter(deleted=False).select_related('owner').in_bulk(ids)
+            self._similar[limit] = [repositories[obj_id] for obj_id in ids if obj_id in repositories]
+        return self._similar[limit]
+
     def links_with_user(self, user):
         """
         Return informations about some links between this repository and the given user
@@ -2117,6 +2290,8 @@ class Repository(SyncableModel):
         Set the repository as deleted and remove if from every automatic
         lists (not from ones created by users : tags, notes...)
         """
+        relatives.remove_object(self)
+
         to_update = {}
         now = datetime.utcnow()
 
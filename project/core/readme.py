@@ -0,0 +1,86 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+"""
+Compute a digest of a readme: a short list of its meaningful words, used
+instead of the full readme to index a repository, compute its score and
+extract its tags. Markup, code blocks, images (badges), urls and
+boilerplate lines (license, install commands) are removed, and each word is
+only kept once (case insensitive), until README_DIGEST_MAX_LENGTH is
+reached.
+"""
+
+import re
+
+from django.conf import settings
+from django.utils.html import strip_tags
+from django.utils.text import unescape_entities
+
+RE_CODE_BLOCKS = re.compile(r'^\s*(```|~~~).*?^\s*\1[^\n]*$', re.M | re.S)
+RE_IMAGES = (
+    # markdown: ![alt](url) and [![alt](url)](url)
+    re.compile(r'\[?!\[[^\]]*\]\([^)]*\)(\]\([^)]*\))?'),
+    # markdown references: ![alt][ref]
+    re.compile(r'!\[[^\]]*\]\[[^\]]*\]'),
+    # rest: .. image:: url (and its options), .. |name| image:: url
+    re.compile(r'^\.\. (\|[^|]+\| )?(image|figure)::.*(\n[ \t]+:.*)*', re.M),
+    # textile: !url!:url
+    re.compile(r'!\S+!(:\S+)?'),
+    # html
+    re.compile(r'<img[^>]*>', re.I),
+)
+RE_LINK_TARGETS = (
+    # markdown: [text](url) => text
+    re.compile(r'\]\([^)]*\)'),
+    # markdown references: [ref]: url
+    re.compile(r'^\s*\[[^\]]+\]:\s*\S+.*$', re.M),
+    # rest: `text <url>`_ => text
+    re.compile(r'<[a-z]+://[^>]*>', re.I),
+)
+RE_URLS = re.compile(r'([a-z]+://|www\.)\S+|\S+@\S+\.\S+', re.I)
+RE_BOILERPLATE = re.compile(r'''
+    copyright | \(c\) | all\ rights\ reserved | licen[cs]ed?\ under | permission\ is\ hereby
+    | warranty | \bmit\ licen[cs]e | apache\ licen[cs]e
+    | ^\s*[$>#]?\s*(sudo\s+)?(pip|easy_install|npm|gem|bower|cabal|cpan|go\ get|git\ clone|python\ setup\.py|make\ install|\./configure|brew|apt-get)\b
+''', re.I | re.X)
+RE_WORDS = re.compile(r'[^\W\d_][\w\-\.\+#]*[\w\+#]', re.U)
+
+
+def clean_readme(raw, html=None):
+    """
+    Return the text of the readme, without markup, images, urls and
+    boilerplate lines
+    """
+    text = raw or strip_tags(html or '')
+    if not text:
+        return ''
+    text = RE_CODE_BLOCKS.sub(' ', text)
+    for regex in RE_IMAGES:
+        text = regex.sub(' ', text)
+    for regex in RE_LINK_TARGETS:
+        text = regex.sub(' ', text)
+    text = unescape_entities(strip_tags(text))
+    text = RE_URLS.sub(' ', text)
+    return '\n'.join(line for line in text.splitlines() if not RE_BOILERPLATE.search(line))
+
+
+def make_readme_digest(raw, html=None, max_length=None):
+    """
+    Return the digest of the given readme (raw text, or html if no raw text):
+    each word of the cleaned text once, in the order they appear, the whole
+    not longer than `max_length` (README_DIGEST_MAX_LENGTH by default)
+    """
+    if max_length is None:
+        max_length = getattr(settings, 'README_DIGEST_MAX_LENGTH', 2000)
+
+    words, seen, length = [], set(), 0
+    for word in RE_WORDS.findall(clean_readme(raw, html)):
+        word = word.strip('-.')
+        lower = word.lower()
+        if len(word) < 2 or lower in seen:
+            continue
+        length += len(word) + 1
+        if length > max_length + 1:
+            break
+        seen.add(lower)
+        words.append(word)
+    return u' '.join(words)
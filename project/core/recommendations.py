@@ -0,0 +1,70 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+"""
+Recommendations computed offline from the public tags (see the
+`compute_recommendations` command), and stored in redis:
+    - for each repository, a sorted set with the ids of the most similar
+      repositories, with the similarity as score
+    - for each tag, a sorted set with the slugs of the tags used the most
+      often with it on the same repositories, with the number of
+      repositories as score
+    - for each kind of list, a set of the ids (or slugs) having one, to
+      remove the lists that are not computed anymore
+Displaying them only needs one lookup.
+"""
+
+from redisco import connection
+
+KEYS = dict(
+    similar = 'recommendations:similar:%d',
+    similar_all = 'recommendations:similar',
+    cooccurring = 'recommendations:cooccurring:%s',
+    cooccurring_all = 'recommendations:cooccurring',
+)
+
+
+def get_similar_ids(repository_id, limit=None):
+    """
+    Return the ids of the repositories similar to the one with the given id,
+    the most similar first
+    """
+    return [int(obj_id) for obj_id in connection.zrevrange(
+        KEYS['similar'] % repository_id, 0, -1 if limit is None else limit - 1)]
+
+
+def get_cooccurring_slugs(slug, limit=None):
+    """
+    Return the slugs of the tags the most often used with the given one, the
+    most used first
+    """
+    return connection.zrevrange(KEYS['cooccurring'] % slug, 0, -1 if limit is None else limit - 1)
+
+
+def save(name, lists, batch_size=1000):
+    """
+    Replace all the lists of the given kind ("similar" or "cooccurring") by
+    the given ones (a dict with, for each id/slug, a list of (member, score)),
+    and delete the ones not in `lists` anymore
+    """
+    key, all_key = KEYS[name], KEYS['%s_all' % name]
+
+    pipeline = connection.pipeline()
+    for index, (obj, members) in enumerate(lists.iteritems()):
+        pipeline.delete(key % obj)
+        if members:
+            pipeline.zadd(key % obj, **dict((str(member), score) for member, score in members))
+        if index % batch_size == batch_size - 1:
+            pipeline.execute()
+    pipeline.execute()
+
+    computed = set(str(obj) for obj, members in lists.iteritems() if members)
+    obsolete = [obj for obj in connection.smembers(all_key) if obj not in computed]
+    pipeline = connection.pipeline()
+    for index in xrange(0, len(obsolete), batch_size):
+        pipeline.delete(*[key % (int(obj) if name == 'similar' else obj)
+                          for obj in obsolete[index:index + batch_size]])
+    pipeline.delete(all_key)
+    computed = list(computed)
+    for index in xrange(0, len(computed), batch_size):
+        pipeline.sadd(all_key, *computed[index:index + batch_size])
+    pipeline.execute()
@@ -0,0 +1,235 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+"""
+Lists of relatives of objects (followers, following, repositories,
+contributing, contributors, forks) kept in redis, in sorted sets with the
+score of each relative, to display the default pages of these lists (sorted
+by score, without search query) without joining the many to many tables.
+For each object and relation we have:
+    - a sorted set with the ids of all (not deleted) relatives
+    - for relations to repositories, a sorted set without the forks
+A set is created the first time the list is displayed (the "built" set of
+the model keeps which ones exist), then updated when a relation is added or
+removed, when the score of a relative changes, and when an object is
+deleted.
+"""
+
+from redisco import connection
+
+KEYS = dict(
+    relatives = 'relatives:%s:%d:%s',
+    noforks = 'relatives:%s:%d:%s:noforks',
+    built = 'relatives:%s:built',
+)
+
+# for each model and relation: the model of the relatives, and the name of
+# the reverse relation (None for forks: it's the `parent_fork` field)
+RELATIONS = dict(
+    account = dict(
+        following = ('account', 'followers'),
+        followers = ('account', 'following'),
+        repositories = ('repository', 'followers'),
+        contributing = ('repository', 'contributors'),
+    ),
+    repository = dict(
+        followers = ('account', 'repositories'),
+        contributors = ('account', 'contributing'),
+        forks = ('repository', None),
+    ),
+)
+
+
+def _built_member(obj_id, relation):
+    return '%d:%s' % (obj_id, relation)
+
+
+def is_built(model_name, obj_id, relation):
+    """
+    Return True if the sorted sets for the given relation of the given object
+    exist
+    """
+    return connection.sismember(KEYS['built'] % model_name, _built_member(obj_id, relation))
+
+
+def build(obj, relation):
+    """
+    Create the sorted sets for the given relation of the given object, from
+    the database
+    """
+    relatives_model = RELATIONS[obj.model_name][relation][0]
+    fields = ['id', 'score']
+    if relatives_model == 'repository':
+        fields.append('is_fork')
+
+    key = KEYS['relatives'] % (obj.model_name, obj.id, relation)
+    noforks_key = KEYS['noforks'] % (obj.model_name, obj.id, relation)
+
+    pipeline = connection.pipeline()
+    pipeline.delete(key, noforks_key)
+    batch, noforks_batch = {}, {}
+    for values in getattr(obj, relation).filter(deleted=False).values_list(*fields).iterator():
+        batch[str(values[0])] = values[1] or 0
+        if relatives_model == 'repository' and not values[2]:
+            noforks_batch[str(values[0])] = values[1] or 0
+        if len(batch) >= 1000:
+            pipeline.zadd(key, **batch)
+            batch = {}
+        if len(noforks_batch) >= 1000:
+            pipeline.zadd(noforks_key, **noforks_batch)
+            noforks_batch = {}
+    if batch:
+        pipeline.zadd(key, **batch)
+    if noforks_batch:
+        pipeline.zadd(noforks_key, **noforks_batch)
+    pipeline.sadd(KEYS['built'] % obj.model_name, _built_member(obj.id, relation))
+    pipeline.execute()
+
+
+def add(obj, relation, relative):
+    """
+    Add the `relative` object in the given relation of `obj`, if the sorted
+    sets for this relation exist
+    """
+    if not obj.id or not is_built(obj.model_name, obj.id, relation):
+        return
+    pipeline = connection.pipeline()
+    _add_to_pipeline(pipeline, obj.model_name, obj.id, relation, relative)
+    pipeline.execute()
+
+
+def _add_to_pipeline(pipeline, model_name, obj_id, relation, relative):
+    """
+    Add (or update the score of) the `relative` object in the given relation
+    of the object with the given model and id
+    """
+    score = relative.score or 0
+    pipeline.zadd(KEYS['relatives'] % (model_name, obj_id, relation), **{str(relative.id): score})
+    if relative.model_name == 'repository':
+        noforks_key = KEYS['noforks'] % (model_name, obj_id, relation)
+        if relative.is_fork:
+            pipeline.zrem(noforks_key, relative.id)
+        else:
+            pipeline.zadd(noforks_key, **{str(relative.id): score})
+
+
+def remove(obj, relation, relative):
+    """
+    Remove the `relative` object from the given relation of `obj`
+    """
+    pipeline = connection.pipeline()
+    pipeline.zrem(KEYS['relatives'] % (obj.model_name, obj.id, relation), relative.id)
+    pipeline.zrem(KEYS['noforks'] % (obj.model_name, obj.id, relation), relative.id)
+    pipeline.execute()
+
+
+def get_memberships(obj):
+    """
+    Return a list of (model name, id, relation) for all the relations of other
+    objects in which the given object is.
+    The `*_ids` methods of the object are used, so if they are already
+    prefetched (see core.search_documents), no query is done
+    """
+    memberships = []
+    for relation, (relatives_model, reverse) in RELATIONS[obj.model_name].items():
+        if reverse is None:
+            continue
+        for relative_id in getattr(obj, '%s_ids' % relation)():
+            memberships.append((relatives_model, relative_id, reverse))
+    if obj.model_name == 'repository' and obj.parent_fork_id:
+        memberships.append(('repository', obj.parent_fork_id, 'forks'))
+    return memberships
+
+
+def update_object(obj):
+    """
+    Update the score (and the "fork" status) of the given object in all the
+    existing sorted sets in which it is
+    """
+    if obj.deleted:
+        return
+    memberships = get_memberships(obj)
+    if not memberships:
+        return
+
+    pipeline = connection.pipeline()
+    for model_name, relative_id, relation in memberships:
+        pipeline.sismember(KEYS['built'] % model_name, _built_member(relative_id, relation))
+    built = pipeline.execute()
+
+    pipeline = connection.pipeline()
+    for (model_name, relative_id, relation), is_built in zip(memberships, built):
+        if is_built:
+            _add_to_pipeline(pipeline, model_name, relative_id, relation, obj)
+    pipeline.execute()
+
+
+def remove_object(obj):
+    """
+    Remove the given object from all the sorted sets in which it is, and
+    delete its own sorted sets. Must be called before removing its relations
+    in the database.
+    """
+    pipeline = connection.pipeline()
+    for model_name, relative_id, relation in get_memberships(obj):
+        pipeline.zrem(KEYS['relatives'] % (model_name, relative_id, relation), obj.id)
+        pipeline.zrem(KEYS['noforks'] % (model_name, relative_id, relation), obj.id)
+    for relation in RELATIONS[obj.model_name]:
+        pipeline.delete(KEYS['relatives'] % (obj.model_name, obj.id, relation),
+                        KEYS['noforks'] % (obj.model_name, obj.id, relation))
+        pipeline.srem(KEYS['built'] % obj.model_name, _built_member(obj.id, relation))
+    pipeline.execute()
+
+
+class RelativesList(object):
+    """
+    A lazy list of the relatives of an object, sorted by score (best first),
+    read from the sorted sets (created if needed). Only the objects of the
+    asked slices are loaded from the database, with `in_bulk` on the given
+    queryset.
+    """
+
+    def __init__(self, obj, relation, queryset, noforks=False):
+        super(RelativesList, self).__init__()
+        self.obj = obj
+        self.relation = relation
+        self.queryset = queryset
+        self.key = KEYS['noforks' if noforks else 'relatives'] % (obj.model_name, obj.id, relation)
+        self._count = None
+        if not is_built(obj.model_name, obj.id, relation):
+            build(obj, relation)
+
+    def count(self):
+        if self._count is None:
+            self._count = connection.zcard(self.key)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __nonzero__(self):
+        return self.count() > 0
+
+    def get_objects(self, start, stop):
+        """
+        Return the objects between the `start` and `stop` positions
+        """
+        if stop is not None and stop <= start:
+            return []
+        ids = [int(obj_id) for obj_id in connection.zrevrange(self.key, start, -1 if stop is None else stop - 1)]
+        if not ids:
+            return []
+        objects = self.queryset.in_bulk(ids)
+        return [objects[obj_id] for obj_id in ids if obj_id in objects]
+
+    def __iter__(self):
+        return iter(self.get_objects(0, None))
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            if k.step is not None:
+                return self.get_objects(0, None)[k]
+            return self.get_objects(k.start or 0, k.stop)
+        objects = self.get_objects(k, k + 1)
+        if not objects:
+            raise IndexError
+        return objects[0]
@@ -0,0 +1,141 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+"""
+Coordination of the commits of the search engine: writes to the index are
+done without commit and reported here, and the `search_commit` worker
+commits when there is enough pending writes or when the oldest one is too
+old (see SEARCH_COMMIT_* settings)
+"""
+
+import time
+
+from django.conf import settings
+from django.utils import simplejson
+
+from redisco import connection
+
+# number of commit stats to keep
+MAX_STATS = 1000
+
+# other engines (see search.embedded_backend) commit on each write
+COMMIT_NEEDED = settings.HAYSTACK_SEARCH_ENGINE == 'solr'
+
+
+def add_pending_writes(model_name, nb=1, first=None):
+    """
+    Tell the coordinator that `nb` documents of the given model were written
+    without commit. `first` is the time of the oldest write, default to now
+    """
+    key = settings.WORKER_SEARCH_COMMIT_KEY
+    pipeline = connection.pipeline()
+    pipeline.hincrby(key, 'count', nb)
+    pipeline.hincrby(key, 'model:%s' % model_name, nb)
+    pipeline.hsetnx(key, 'first', first or time.time())
+    pipeline.execute()
+
+
+def index_written(model_name, nb=1):
+    """
+    To call after `nb` documents of the given model were written in the
+    index: if the search engine needs a commit, the writes are reported to
+    the coordinator, else they are already visible
+    """
+    if COMMIT_NEEDED:
+        add_pending_writes(model_name, nb)
+    else:
+        bump_index_generation(model_name)
+
+
+def _parse_pending_writes(data):
+    """
+    Return the number of pending writes, the time of the oldest one (or None
+    if no pending writes), and a dict with the number of writes by model
+    """
+    if not data or 'first' not in data:
+        return 0, None, {}
+    models = dict((name[6:], int(nb)) for name, nb in data.items() if name.startswith('model:'))
+    return int(data.get('count', 0)), float(data['first']), models
+
+
+def get_pending_writes():
+    """
+    Return the pending writes (see `_parse_pending_writes`)
+    """
+    return _parse_pending_writes(connection.hgetall(settings.WORKER_SEARCH_COMMIT_KEY))
+
+
+def take_pending_writes():
+    """
+    Atomically get and reset the pending writes, to be done just before a
+    commit. Return the same as `get_pending_writes`
+    """
+    key = settings.WORKER_SEARCH_COMMIT_KEY
+    pipeline = connection.pipeline()
+    pipeline.hgetall(key)
+    pipeline.delete(key)
+    return _parse_pending_writes(pipeline.execute()[0])
+
+
+def get_index_generation(model_name):
+    """
+    Return the current generation of the index for the given model. It
+    changes each time new documents of this model are visible in the index
+    """
+    return int(connection.get(settings.SEARCH_INDEX_GENERATION_KEY % model_name) or 0)
+
+
+def bump_index_generation(*model_names):
+    """
+    Change the generation of the index for the given models, to be called
+    after a commit
+    """
+    pipeline = connection.pipeline()
+    for model_name in model_names:
+        pipeline.incr(settings.SEARCH_INDEX_GENERATION_KEY % model_name)
+    pipeline.execute()
+
+
+def commit_needed(count, first, now=None):
+    """
+    Return True if pending writes must be committed now
+    """
+    if not count:
+        return False
+    if count >= settings.SEARCH_COMMIT_MAX_PENDING:
+        return True
+    return (now or time.time()) - first >= settings.SEARCH_COMMIT_MAX_DELAY
+
+
+def save_stats(count, lag, duration, soft):
+    """
+    Save stats about a commit: number of documents, the index-to-visible lag
+    (time between the oldest write and the end of the commit) and the
+    duration of the commit, all in seconds
+    """
+    key = settings.WORKER_SEARCH_COMMIT_STATS_KEY
+    pipeline = connection.pipeline()
+    pipeline.lpush(key, simplejson.dumps(dict(
+        date = time.time(),
+        count = count,
+        lag = round(lag, 3),
+        duration = round(duration, 3),
+        soft = soft,
+    )))
+    pipeline.ltrim(key, 0, MAX_STATS - 1)
+    pipeline.execute()
+
+
+def get_stats(limit=100):
+    """
+    Return the stats of the last commits (most recent first), and a dict
+    with averages and maximums of the lag and the duration
+    """
+    stats = [simplejson.loads(entry) for entry in
+        connection.lrange(settings.WORKER_SEARCH_COMMIT_STATS_KEY, 0, limit - 1)]
+    summary = {}
+    if stats:
+        for name in ('count', 'lag', 'duration'):
+            values = [entry[name] for entry in stats]
+            summary['avg_%s' % name] = sum(values) / float(len(values))
+            summary['max_%s' % name] = max(values)
+    return stats, summary
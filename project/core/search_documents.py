@@ -0,0 +1,129 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+"""
+Build the search documents of many objects at once: everything the search
+indexes (and their templates) need (owners, relations, public tags) is
+fetched with a few queries for all objects and cached on them, so
+preparing each document doesn't run any query.
+"""
+
+from haystack import site
+
+from core.models import Account, Repository
+
+
+class SearchDocumentsBuilder(object):
+    """
+    Prepare and send to the search engine the documents for objects of the
+    given model
+    """
+    select_related = dict(
+        account = (),
+        repository = ('owner',),
+    )
+
+    def __init__(self, model):
+        super(SearchDocumentsBuilder, self).__init__()
+        self.model = model
+        self.model_name = model._meta.module_name
+        self.search_index = site.get_index(model)
+
+    def get_objects(self, start=None, end=None, ids=None, limit=None):
+        """
+        Return the not deleted objects with a pk in the range [start, end[, or
+        in the given ids (`limit` objects at max), with all their data
+        prefetched
+        """
+        queryset = self.model.objects.filter(deleted=False).order_by('pk')
+        if start is not None:
+            queryset = queryset.filter(pk__gte=start)
+        if end is not None:
+            queryset = queryset.filter(pk__lt=end)
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids)
+        if self.select_related[self.model_name]:
+            queryset = queryset.select_related(*self.select_related[self.model_name])
+        # no `defer` here (even if the full readme is not indexed): deferred
+        # instances are of a proxy class, and haystack would use its name to
+        # build the ids of the documents
+        if limit:
+            queryset = queryset[:limit]
+        objects = list(queryset)
+        self.prefetch(objects)
+        return objects
+
+    def _group_ids(self, through, from_field, to_field, ids):
+        """
+        Return a dict with, for each of the given ids, the list of ids linked
+        to it in the `through` table
+        """
+        result = dict((obj_id, []) for obj_id in ids)
+        links = through.objects.filter(**{'%s__in' % from_field: ids}).values_list(
+            '%s_id' % from_field, '%s_id' % to_field)
+        for from_id, to_id in links:
+            result[from_id].append(to_id)
+        return result
+
+    def _set_ids(self, objects, attribute, through, from_field, to_field):
+        """
+        Cache on each object, in `attribute`, the list of ids linked to it
+        """
+        ids = self._group_ids(through, from_field, to_field, [obj.id for obj in objects])
+        for obj in objects:
+            setattr(obj, attribute, ids[obj.id])
+
+    def prefetch(self, objects):
+        """
+        Fetch the data of all the given objects, in bulk
+        """
+        if not objects:
+            return
+
+        if self.model_name == 'account':
+            self._set_ids(objects, '_following_ids', Account.following.through, 'from_account', 'to_account')
+            self._set_ids(objects, '_followers_ids', Account.following.through, 'to_account', 'from_account')
+            self._set_ids(objects, '_repositories_ids', Account.repositories.through, 'account', 'repository')
+            self._set_ids(objects, '_contributing_ids', Repository.contributors.through, 'account', 'repository')
+
+        else:
+            self._set_ids(objects, '_followers_ids', Account.repositories.through, 'repository', 'account')
+            self._set_ids(objects, '_contributors_ids', Repository.contributors.through, 'repository', 'account')
+
+        # public tags, in the same order as in `all_public_tags`
+        tags = dict((obj.id, []) for obj in objects)
+        tagged_items = self.model.public_tags_class.objects.filter(content_object__in=tags.keys()
+            ).select_related('tag').order_by('-weight', 'tag__slug')
+        for tagged_item in tagged_items:
+            tags[tagged_item.content_object_id].append(tagged_item.tag)
+        for obj in objects:
+            obj._all_user_tags = {False: tags[obj.id]}
+
+    def update(self, objects, commit=False):
+        """
+        Send the documents of the given objects (already prefetched) to the
+        search engine. Return the number of sent documents
+        """
+        if objects:
+            self.search_index.backend.update(self.search_index, objects, commit=commit)
+        return len(objects)
+
+    def update_range(self, start, end, batch_size=500, commit=False):
+        """
+        Send the documents of the objects with a pk in the range [start, end[,
+        by batches of `batch_size` objects. Return the number of sent documents
+        """
+        nb = 0
+        batch_start = start
+        while batch_start < end:
+            objects = self.get_objects(start=batch_start, end=end, limit=batch_size)
+            if not objects:
+                break
+            nb += self.update(objects, commit=commit)
+            batch_start = objects[-1].pk + 1
+        return nb
+
+    def update_ids(self, ids, commit=False):
+        """
+        Send the documents of the objects with the given ids
+        """
+        return self.update(self.get_objects(ids=ids), commit=commit)
@@ -21,6 +21,7 @@ class CoreIndex(SearchIndex):
     modified = DateTimeField(model_attr='modified')
     internal_score = IntegerField()
     get_absolute_url = CharField(model_attr='get_absolute_url', indexed=False)
+    public_tags = MultiValueField(null=True)
 
     def get_updated_field(self):
         """
@@ -41,6 +42,12 @@ class CoreIndex(SearchIndex):
     def prepare_internal_score(self, obj):
         return obj.score or 0
 
+    def prepare_public_tags(self, obj):
+        """
+        Slugs of the public tags, used for facets
+        """
+        return [tag.slug for tag in obj.all_public_tags()]
+
     def prepare(self, obj):
         """
         Use the object's score to calculate the boost
@@ -54,10 +61,27 @@ class AccountIndex(CoreIndex):
     Search index for Account objects
     """
     all_public_tags = CharField(null=True)
+    user_id = IntegerField(model_attr='user_id', null=True)
+    following_ids = MultiValueField(null=True)
+    followers_ids = MultiValueField(null=True)
+    repositories_ids = MultiValueField(null=True)
+    contributing_ids = MultiValueField(null=True)
 
     def prepare_all_public_tags(self, obj):
         return ' '.join([tag.slug for tag in obj.all_public_tags()])
 
+    def prepare_following_ids(self, obj):
+        return list(obj.following_ids())
+
+    def prepare_followers_ids(self, obj):
+        return list(obj.followers_ids())
+
+    def prepare_repositories_ids(self, obj):
+        return list(obj.repositories_ids())
+
+    def prepare_contributing_ids(self, obj):
+        return list(obj.contributing_ids())
+
 site.register(Account, AccountIndex)
 
 class RepositoryIndex(CoreIndex):
@@ -66,12 +90,16 @@ class RepositoryIndex(CoreIndex):
     """
     project = CharField(model_attr='project', boost=2.5)
     description = CharField(model_attr='description', null=True)
-    readme = CharField(model_attr='readme', null=True, boost=0.5)
+    readme = CharField(model_attr='readme_digest', null=True, boost=0.5)
     owner_slug_sort = CharField(null=True)
     official_modified_sort = DateTimeField(model_attr='official_modified', null=True)
     owner_id = IntegerField(model_attr='owner_id', null=True)
     is_fork = BooleanField(model_attr='is_fork', null=True)
     owner_internal_score = IntegerField()
+    owner_user_id = IntegerField(null=True)
+    parent_fork_id = IntegerField(model_attr='parent_fork_id', null=True)
+    followers_ids = MultiValueField(null=True)
+    contributors_ids = MultiValueField(null=True)
 
     def prepare_owner_slug_sort(self, obj):
         if obj.owner_id:
@@ -83,4 +111,15 @@ class RepositoryIndex(CoreIndex):
             return obj.owner.score
         return 0
 
+    def prepare_owner_user_id(self, obj):
+        if obj.owner_id:
+            return obj.owner.user_id
+        return None
+
+    def prepare_followers_ids(self, obj):
+        return list(obj.followers_ids())
+
+    def prepare_contributors_ids(self, obj):
+        return list(obj.contributors_ids())
+
 site.register(Repository, RepositoryIndex)
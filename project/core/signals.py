@@ -1,14 +1,17 @@
 # Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
 
 from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
 from django.contrib import messages
 
 from social_auth.signals import pre_update
 from django_globals import globals
 
 from core.backends import BACKENDS_BY_AUTH
-from core.models import Account
+from core.models import Account, Repository
 from core.exceptions import BackendError
+from tagging.models import PrivateTaggedAccount, PrivateTaggedRepository
+from tagging.signals import tags_set
 
 @receiver(pre_update, sender=None, dispatch_uid='core.signals.CreateAccountOnSocialAccount')
 def CreateAccountOnSocialAccount(sender, user, response, details, **kwargs):
@@ -39,3 +42,32 @@ def CreateAccountOnSocialAccount(sender, user, response, details, **kwargs):
 
     return False
 
+
+@receiver(post_save, sender=PrivateTaggedAccount, dispatch_uid='core.signals.UpdateTagStatsOnAccountTagSave')
+@receiver(post_delete, sender=PrivateTaggedAccount, dispatch_uid='core.signals.UpdateTagStatsOnAccountTagDelete')
+def UpdateTagStatsOnAccountTag(sender, instance, **kwargs):
+    """
+    Update the statistics of the private tags of the tagged account (no need
+    to load it, only its id is used)
+    """
+    Account(id=instance.content_object_id).update_tag_stats()
+
+
+@receiver(post_save, sender=PrivateTaggedRepository, dispatch_uid='core.signals.UpdateTagStatsOnRepositoryTagSave')
+@receiver(post_delete, sender=PrivateTaggedRepository, dispatch_uid='core.signals.UpdateTagStatsOnRepositoryTagDelete')
+def UpdateTagStatsOnRepositoryTag(sender, instance, **kwargs):
+    """
+    Update the statistics of the private tags of the tagged repository (no
+    need to load it, only its id is used)
+    """
+    Repository(id=instance.content_object_id).update_tag_stats()
+
+
+@receiver(tags_set, sender=PrivateTaggedAccount, dispatch_uid='core.signals.UpdateTagStatsOnAccountTagsSet')
+@receiver(tags_set, sender=PrivateTaggedRepository, dispatch_uid='core.signals.UpdateTagStatsOnRepositoryTagsSet')
+def UpdateTagStatsOnTagsSet(sender, instance, **kwargs):
+    """
+    Update the statistics of the private tags of the object whose tags were
+    set
+    """
+    instance.update_tag_stats()
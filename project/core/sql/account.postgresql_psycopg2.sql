@@ -0,0 +1,14 @@
+-- Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+-- Indexes for hot queries on accounts, installed by syncdb (or "manage.py sqlcustom core")
+-- Note: the lookup by (backend, slug_lower) is covered by the unique_together constraint
+
+-- lists of non-deleted accounts, sorted by score or by name
+CREATE INDEX core_account_not_deleted_score ON core_account (score DESC, id DESC) WHERE NOT deleted;
+CREATE INDEX core_account_not_deleted_slug_sort ON core_account (slug_sort, id) WHERE NOT deleted;
+
+-- accounts of a user
+CREATE INDEX core_account_user_backend ON core_account (user_id, backend) WHERE user_id IS NOT NULL;
+
+-- reverse joins on many to many tables (the unique constraint only covers the direct way)
+CREATE INDEX core_account_following_reverse ON core_account_following (to_account_id, from_account_id);
+CREATE INDEX core_account_repositories_reverse ON core_account_repositories (repository_id, account_id);
@@ -0,0 +1,16 @@
+-- Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+-- Indexes for hot queries on repositories, installed by syncdb (or "manage.py sqlcustom core")
+
+-- RepositoryManager.get_or_new
+CREATE INDEX core_repository_identifiers ON core_repository (backend, slug_lower, official_owner_lower);
+
+-- lists of non-deleted repositories, sorted by score or by name
+CREATE INDEX core_repository_not_deleted_score ON core_repository (score DESC, id DESC) WHERE NOT deleted;
+CREATE INDEX core_repository_not_deleted_slug_sort ON core_repository (slug_sort, id) WHERE NOT deleted;
+
+-- repositories of an owner, and forks of a repository, sorted by score
+CREATE INDEX core_repository_owner_score ON core_repository (owner_id, score DESC) WHERE owner_id IS NOT NULL;
+CREATE INDEX core_repository_parent_fork_score ON core_repository (parent_fork_id, score DESC) WHERE parent_fork_id IS NOT NULL;
+
+-- reverse join on the contributors many to many table (the unique constraint only covers the direct way)
+CREATE INDEX core_repository_contributors_reverse ON core_repository_contributors (account_id, repository_id);
@@ -0,0 +1,143 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+import sys
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import unittest
+
+from core.models import Account, Repository
+
+IS_POSTGRESQL = connection.settings_dict['ENGINE'].endswith('postgresql_psycopg2')
+
+
+@unittest.skipUnless(IS_POSTGRESQL, 'Query plans are only checked with postgresql')
+class QueryPlanTest(TestCase):
+    """
+    Seed a large synthetic dataset and check that the hot queries don't use
+    a sequential scan on the big tables (see the indexes in core/sql and
+    tagging/sql). The runtime of each query is written on stderr.
+    """
+    nb_accounts = 20000
+    nb_repositories = 50000
+    nb_links = 100000
+
+    big_tables = (
+        'core_account',
+        'core_repository',
+        'core_account_following',
+        'core_account_repositories',
+        'core_repository_contributors',
+    )
+
+    def seed(self, model, count, values):
+        """
+        Insert `count` rows in the table of the given model. `values` is a
+        dict with sql expressions (using `i`, from 1 to `count`) for some
+        columns, other not null columns are filled with a default value
+        """
+        defaults = dict(
+            BooleanField = 'false',
+            DateTimeField = 'now()',
+            IntegerField = '0',
+            PositiveIntegerField = '0',
+        )
+        values = dict(values)
+        for field in model._meta.local_fields:
+            if field.primary_key or field.null or field.column in values:
+                continue
+            values[field.column] = defaults.get(field.get_internal_type(), "'x'")
+
+        columns = values.keys()
+        connection.cursor().execute('INSERT INTO %s (%s) SELECT %s FROM generate_series(1, %d) AS i' % (
+            model._meta.db_table,
+            ', '.join(columns),
+            ', '.join(values[column] for column in columns),
+            count,
+        ))
+
+    def link(self, table, columns, first, second):
+        """
+        Fill a many to many `table` with `nb_links` distinct pairs of ids, from
+        the sql expressions `first` and `second`
+        """
+        connection.cursor().execute('INSERT INTO %s (%s) SELECT DISTINCT %s, %s FROM generate_series(1, %d) AS i' % (
+            table, ', '.join(columns), first, second, self.nb_links))
+
+    def setUp(self):
+        self.seed(Account, self.nb_accounts, dict(
+            backend = "'github'",
+            status = "'ok'",
+            slug = "'user' || i",
+            slug_lower = "'user' || i",
+            slug_sort = "'user' || i",
+            deleted = 'mod(i, 10) = 0',
+            score = 'mod(i * 7919, 1000)',
+        ))
+        self.seed(Repository, self.nb_repositories, dict(
+            backend = "'github'",
+            status = "'ok'",
+            slug = "'repo' || i",
+            slug_lower = "'repo' || i",
+            slug_sort = "'repo' || i",
+            project = "'user' || (mod(i, %d) + 1) || '/repo' || i" % self.nb_accounts,
+            project_sort = "'user' || (mod(i, %d) + 1) || '/repo' || i" % self.nb_accounts,
+            official_owner = "'user' || (mod(i, %d) + 1)" % self.nb_accounts,
+            official_owner_lower = "'user' || (mod(i, %d) + 1)" % self.nb_accounts,
+            owner_id = '(SELECT MIN(id) FROM core_account) + mod(i, %d)' % self.nb_accounts,
+            deleted = 'mod(i, 10) = 0',
+            score = 'mod(i * 7919, 1000)',
+        ))
+
+        account = '(SELECT MIN(id) FROM core_account) + mod(i * 7, %d)' % self.nb_accounts
+        other_account = '(SELECT MIN(id) FROM core_account) + mod(i * 13 + 1, %d)' % self.nb_accounts
+        repository = '(SELECT MIN(id) FROM core_repository) + mod(i * 11, %d)' % self.nb_repositories
+        self.link('core_account_following', ('from_account_id', 'to_account_id'), account, other_account)
+        self.link('core_account_repositories', ('account_id', 'repository_id'), account, repository)
+        self.link('core_repository_contributors', ('repository_id', 'account_id'), repository, account)
+
+        connection.cursor().execute('ANALYZE')
+
+        self.account = Account.objects.filter(slug_lower='user42')[0]
+        self.repository = Repository.objects.filter(slug_lower='repo42')[0]
+
+    def hot_queries(self):
+        """
+        Return the querysets to check, by name
+        """
+        return dict(
+            account_get_for_slug = Account.objects.filter(backend='github', slug_lower='user42'),
+            repository_get_or_new = Repository.objects.filter(backend='github', slug_lower='repo42', official_owner_lower='user43'),
+            account_following = Account.objects.filter(followers=self.account),
+            account_followers = Account.objects.filter(following=self.account),
+            account_repositories = Repository.objects.filter(followers=self.account),
+            account_contributing = Repository.objects.filter(contributors=self.account),
+            account_own_repositories = Repository.objects.filter(owner=self.account).order_by('-score'),
+            repository_followers = Account.objects.filter(repositories=self.repository),
+            repository_contributors = Account.objects.filter(contributing=self.repository),
+            account_best = Account.for_list.order_by('-score')[:20],
+            repository_best = Repository.for_list.order_by('-score')[:20],
+            account_by_name = Account.for_list.order_by('slug_sort')[:20],
+            repository_by_name = Repository.for_list.order_by('slug_sort')[:20],
+        )
+
+    def explain(self, queryset):
+        """
+        Return the plan (and runtime) of the given queryset
+        """
+        sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def test_hot_queries_use_indexes(self):
+        failures = []
+        for name, queryset in sorted(self.hot_queries().items()):
+            plan = self.explain(queryset)
+            runtime = plan.splitlines()[-1].strip()
+            sys.stderr.write('%s: %s\n' % (name, runtime))
+            for table in self.big_tables:
+                if 'Seq Scan on %s ' % table in plan:
+                    failures.append('%s uses a sequential scan on %s:\n%s' % (name, table, plan))
+
+        self.assertFalse(failures, '\n\n'.join(failures))
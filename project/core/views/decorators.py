@@ -62,8 +62,12 @@ def check_repository(function=None):
     def _dec(view_func):
         @wraps(view_func)
         def _view(request, backend, project, *args, **kwargs):
+            queryset = Repository.objects.select_related('owner', 'parent_fork', 'parent_fork_owner')
+            if view_func.__name__ != 'readme':
+                # the full readme is only needed on its own page
+                queryset = queryset.defer('readme', 'readme_html')
             try:
-                repository = Repository.objects.select_related('owner').select_related('owner', 'parent_fork', 'parent_fork_owner').get(backend=backend, project=project)
+                repository = queryset.get(backend=backend, project=project)
             except:
                 raise Http404
             else:
@@ -4,6 +4,8 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect
 from django.conf import settings
+from django.db.models import Q, Count
+from django.core.cache import cache
 
 from notes.models import Note
 
@@ -14,36 +16,39 @@ from utils.sort import prepare_sort
 from utils.views import paginate
 from search.views import parse_keywords, make_query, RepositorySearchView
 from tagging.flags import split_tags_and_flags
+from tagging.models import private_tags_version
 
 def _get_sorted_user_tags(user, only=None):
     """
     Return all tags for the user, sorted by usage (desc) and name (asc)
     The result is a dict with two entries : `repository` and `account`,
-    grouping tags for each category. Each list is a list of tuple, with
-    the tag's slug in first, then the tag's name and finally the list of
-    tagged objects (only names)
+    grouping tags for each category. Each list is a list of dicts, with
+    the tag's slug, name, and the number of tagged objects.
+    Counts are done by the database, and the result is cached for each user
+    until its private tags change (see tagging.models.private_tags_changed).
+    The tagged objects of a tag are listed, with pagination, by the `tags`
+    view.
     """
     result = {}
-    types = dict(account='slug', repository='project')
+    types = ('account', 'repository')
+    version = private_tags_version(user.id)
 
     for obj_type in types:
         if only and obj_type != only:
             continue
 
-        tagged_items = getattr(user, 'tagging_privatetagged%s_items' % obj_type).values_list('tag__slug', 'tag__name', 'content_object__%s' % types[obj_type])
+        cache_key = 'dashboard_tags:%d:%s:%d' % (user.id, obj_type, version)
+        tags = cache.get(cache_key)
 
-        tags = {}
-        if not tagged_items:
-            result[obj_type] = []
-            continue
-
-        for tag_slug, tag_name, obj in tagged_items:
-            if tag_slug not in tags:
-                tags[tag_slug] = dict(slug=tag_slug, name=tag_name, objects=[])
-            tags[tag_slug]['objects'].append(obj)
+        if tags is None:
+            tags = getattr(user, 'tagging_privatetagged%s_items' % obj_type).values(
+                'tag__slug', 'tag__name').annotate(count=Count('id')).order_by()
+            tags = [dict(slug=tag['tag__slug'], name=tag['tag__name'], count=tag['count']) for tag in tags]
+            tags = sorted(tags, key=lambda tag: (-tag['count'], tag['slug']), reverse=False)
+            tags = split_tags_and_flags(tags, obj_type, True) if tags else []
+            cache.set(cache_key, tags, settings.USER_TAGS_CACHE_TIMEOUT)
 
-        tags = sorted(tags.values(), key=lambda tag: (-len(tag['objects']), tag['slug']), reverse=False)
-        result[obj_type] = split_tags_and_flags(tags, obj_type, True) if tags else []
+        result[obj_type] = tags
 
     return result
 
@@ -170,7 +175,8 @@ def tags(request, obj_type=None):
 
     objects = objects.order_by(sort['db_sort']).distinct()
 
-    page = paginate(request, objects, per_page)
+    # the template only checks if there is objects, no need for a full count
+    page = paginate(request, objects, per_page, keyset=True, approximate_count=1)
 
     context = dict(
         tags = get_tags,
@@ -291,10 +297,155 @@ def followers(request):
     return render(request, 'dashboard/followers.html', context)
 
 
-def _filter_repositories(request, param, extra):
+def _distinct_repositories_sql(scope, accounts_ids):
+    """
+    Return the sql (and its params) of a query returning, for each
+    backend/slug of the repositories in the `scope` queryset, the id of the
+    only one to display : one owned by the user if any, else the oldest
+    non-fork, else the oldest one.
+    Use the postgresql's "DISTINCT ON" clause.
+    """
+    scope_sql, scope_params = scope.values('id').query.get_compiler(using=scope.db).as_sql()
+
+    owned, owned_params = 'FALSE', []
+    if accounts_ids:
+        owned = 'r.owner_id IN (%s)' % ', '.join(['%s'] * len(accounts_ids))
+        owned_params = list(accounts_ids)
+
+    sql = """
+        SELECT DISTINCT ON (r.backend, r.slug) r.id
+        FROM %(table)s r
+        WHERE r.id IN (%(scope)s)
+        ORDER BY r.backend, r.slug, (%(owned)s) DESC, COALESCE(r.is_fork, FALSE),
+                 r.official_created ASC NULLS LAST, r.id
+    """ % dict(
+        table = Repository._meta.db_table,
+        scope = scope_sql,
+        owned = owned,
+    )
+
+    return sql, list(scope_params) + owned_params
+
+
+def _add_distinct_others(repositories, base):
+    """
+    For each repository kept by the distinct sql query, set `distinct_others`
+    with the other ones of the same backend/slug in the `base` queryset, and
+    `current_user_account_id_list` with the user's accounts linked to one of
+    them (including the kept one). Only repositories of the current page are
+    concerned.
+    """
+    if not repositories:
+        return
+
+    groups = Q()
+    for repository in repositories:
+        groups |= Q(backend=repository.backend, slug=repository.slug)
+
+    by_slug = {}
+    for repository in base.filter(groups):
+        by_slug.setdefault((repository.backend, repository.slug), []).append(repository)
+
+    sort_lambda = lambda r:r.official_created
+    for repository in repositories:
+        group = by_slug.get((repository.backend, repository.slug), [])
+        others = dict((r.id, r) for r in group if r.id != repository.id)
+        if others:
+            repository.distinct_others = sorted(others.values(), key=sort_lambda)
+        repository.current_user_account_id_list = set(r.current_user_account_id for r in group)
+
+
+def _repositories_in_order(ids, base):
+    """
+    Return the repositories of the `base` queryset with the given ids, once
+    each and in the same order, with the `current_user_account_id_list` of
+    all their rows (one for each user's account linked to it)
+    """
+    by_id = {}
+    for repository in base.filter(id__in=ids):
+        if repository.id not in by_id:
+            by_id[repository.id] = repository
+            repository.current_user_account_id_list = set()
+        by_id[repository.id].current_user_account_id_list.add(repository.current_user_account_id)
+    return [by_id[obj_id] for obj_id in ids if obj_id in by_id]
+
+
+def _distinct_search_page(ids, search_queryset, base, accounts_ids):
+    """
+    Return the distinct repositories (see `_distinct_repositories_sql`) for
+    a page of sorted search hits (`ids`). A backend/slug is only displayed on
+    the page of its first matching repository in the order of the search
+    engine, so a page may have less entries, but never one already displayed
+    on another page. The entry is still chosen by the database between the
+    matching repositories of its backend/slug
+    """
+    if not ids:
+        return []
+
+    page_groups = dict((obj_id, (backend, slug)) for obj_id, backend, slug
+        in Repository.objects.filter(id__in=ids).values_list('id', 'backend', 'slug'))
+    if not page_groups:
+        return []
+    groups = Q()
+    for backend, slug in set(page_groups.values()):
+        groups |= Q(backend=backend, slug=slug)
+
+    # all the repositories of these backend/slug in the user's list...
+    members, by_group = {}, {}
+    for obj_id, backend, slug in base.filter(groups).values_list('id', 'backend', 'slug'):
+        if obj_id not in members:
+            members[obj_id] = (backend, slug)
+            by_group.setdefault((backend, slug), []).append(obj_id)
+
+    # ... and the matching ones, in the order of the search engine (a group
+    # is never split, to keep the relative order of its repositories)
+    chunks, chunk = [], []
+    for group_ids in by_group.itervalues():
+        if chunk and len(chunk) + len(group_ids) > settings.SOLR_MAX_IN:
+            chunks.append(chunk)
+            chunk = []
+        chunk.extend(group_ids)
+    if chunk:
+        chunks.append(chunk)
+    matching = {}
+    for chunk in chunks:
+        for result in search_queryset.filter(django_id__in=chunk)[:len(chunk)]:
+            matching.setdefault(members[int(result.pk)], []).append(int(result.pk))
+
+    kept = []
+    for obj_id in ids:
+        group = page_groups.get(obj_id)
+        if group and group not in kept and matching.get(group, [None])[0] == obj_id:
+            kept.append(group)
+    if not kept:
+        return []
+
+    scope = base.filter(id__in=sum([matching[kept_group] for kept_group in kept], []))
+    distinct_sql, distinct_params = _distinct_repositories_sql(scope, accounts_ids)
+    by_group = dict(((repository.backend, repository.slug), repository) for repository in
+        Repository.for_user_list.extra(
+            where=['%s.id IN (%s)' % (Repository._meta.db_table, distinct_sql)],
+            params=distinct_params))
+
+    repositories = [by_group[kept_group] for kept_group in kept if kept_group in by_group]
+    _add_distinct_others(repositories, scope)
+    return repositories
+
+
+# fields of the search index to sort on, for each key of repository_sort_map
+repository_search_sort_map = dict(
+    name = 'slug_sort',
+    owner = 'owner_slug_sort',
+    updated = 'official_modified_sort',
+)
+
+
+def _filter_repositories(request, param, extra, search_scope):
     """
     Helper doing all sort/query stuff about repositories, for listing
-    repositories owned/followed or contributed by the user
+    repositories owned/followed or contributed by the user.
+    The `search_scope` is the field of the search index holding the
+    accounts linked to a repository by the `param` relation
     """
 
     params = {param: request.user}
@@ -303,87 +454,76 @@ def _filter_repositories(request, param, extra):
     if owner_only:
         params['owner__user'] = request.user
 
-    all_repositories = Repository.for_user_list.filter(**params).extra(select=dict(current_user_account_id=extra))
+    base_repositories = Repository.for_user_list.filter(**params).extra(select=dict(current_user_account_id=extra))
 
     hide_forks = request.GET.get('hide-forks', False) == 'y'
     if hide_forks:
-        all_repositories = all_repositories.exclude(is_fork=True)
-
-    sort = get_repository_sort(request.GET.get('sort_by', None))
-    if sort['key']:
-        all_repositories = all_repositories.order_by(sort['db_sort'])
+        base_repositories = base_repositories.exclude(is_fork=True)
 
     accounts = accounts_dict(request)
 
+    distinct = request.GET.get('distinct', False) == 'y'
+    sort = get_repository_sort(request.GET.get('sort_by', None))
+
     query = request.GET.get('q')
     if query:
+        # ask the search engine only for the repositories linked to the user's accounts
         keywords = parse_keywords(query)
-        search_queryset = make_query(RepositorySearchView.search_fields, keywords)
+        search_queryset = make_query(RepositorySearchView.search_fields, keywords, model=Repository)
         search_queryset = search_queryset.models(RepositorySearchView.model)
+        search_queryset = search_queryset.filter(**{'%s__in' % search_scope: accounts.keys() or [0]})
         if owner_only:
-            search_queryset = search_queryset.filter(owner_id__in=accounts.keys())
+            search_queryset = search_queryset.filter(owner_id__in=accounts.keys() or [0])
         if hide_forks:
             search_queryset = search_queryset.exclude(is_fork=True)
-        # It's certainly not the best way to do it but.... :(
-        sorted_ids = [r.id for r in all_repositories]
-        if sorted_ids:
-            search_queryset = search_queryset.filter(django_id__in=sorted_ids)
-            found_ids = [int(r.pk) for r in search_queryset]
-            all_repositories = [r for r in all_repositories if r.id in found_ids]
+        search_queryset = search_queryset.only('id')
+
+        # sort and paginate in the search engine, to only fetch the hits of
+        # the current page
+        if sort['key']:
+            search_queryset = search_queryset.order_by(
+                ('-' if sort['reverse'] else '') + repository_search_sort_map[sort['key']])
+        page = paginate(request, search_queryset, settings.REPOSITORIES_PER_PAGE)
+        page_ids = []
+        for result in page.object_list:
+            if int(result.pk) not in page_ids:
+                page_ids.append(int(result.pk))
+
+        if distinct:
+            page.object_list = _distinct_search_page(page_ids, search_queryset, base_repositories, accounts.keys())
+        else:
+            page.object_list = _repositories_in_order(page_ids, base_repositories)
+        return _repositories_context(page, sort, accounts, owner_only, hide_forks, distinct, query)
 
-    distinct = request.GET.get('distinct', False) == 'y'
     if distinct:
-        # try to keep one entry for each backend/slug
-        uniq = []
-        slugs = {}
-        for repository in all_repositories:
-            slug = '%s:%s' % (repository.backend, repository.slug)
-            if slug in slugs:
-                slugs[slug].append(repository)
-                continue
-            slugs[slug] = []
-            uniq.append(repository)
-        for repository in uniq:
-            slug = '%s:%s' % (repository.backend, repository.slug)
-            repository.distinct_others = slugs[slug]
-        # try to keep the first non-fork for each one
-        all_repositories = []
-        sort_lambda = lambda r:r.official_created
-        for repository in uniq:
-            if not repository.distinct_others or repository.owner_id in accounts:
-                good_repository = repository
-            else:
-                important_ones = [r for r in repository.distinct_others if not r.is_fork]
-                owned = [r for r in important_ones if r.owner_id in accounts]
-                if owned:
-                    good_repository = owned[0]  # all are from the owner, take one
-                else:
-                    if important_ones:
-                        if not repository.is_fork:
-                            important_ones + [repository,]
-                    else:
-                        important_ones = repository.distinct_others + [repository,]
-
-                    good_repository = sorted(important_ones, key=sort_lambda)[0]
-
-                if good_repository != repository:
-                    good_repository.distinct_others = [r for r in repository.distinct_others + [repository,] if r != good_repository]
-                    delattr(repository, 'distinct_others')
-
-                if hasattr(good_repository, 'distinct_others'):
-                    good_repository.distinct_others = sorted(good_repository.distinct_others, key=sort_lambda)
-
-            good_repository.current_user_account_id_list = set((good_repository.current_user_account_id,))
-            if hasattr(good_repository, 'distinct_others'):
-                for other_rep in good_repository.distinct_others:
-                    good_repository.current_user_account_id_list.add(other_rep.current_user_account_id)
-
-            all_repositories.append(good_repository)
-
-    page = paginate(request, all_repositories, settings.REPOSITORIES_PER_PAGE)
+        # keep one entry for each backend/slug, the choice is done by the database
+        distinct_sql, distinct_params = _distinct_repositories_sql(base_repositories, accounts.keys())
+        all_repositories = Repository.for_user_list.extra(
+            where=['%s.id IN (%s)' % (Repository._meta.db_table, distinct_sql)],
+            params=distinct_params)
+    else:
+        all_repositories = base_repositories
 
-    context = dict(
-        all_repositories = all_repositories,
+    if sort['key']:
+        all_repositories = all_repositories.order_by(sort['db_sort'])
+
+    # without distinct, a repository may be present many times (once for
+    # each user's account), so we cannot seek on its pk
+    # (and the template only checks if there is objects, no need for a full count)
+    page = paginate(request, all_repositories, settings.REPOSITORIES_PER_PAGE, keyset=distinct, approximate_count=1)
+
+    if distinct:
+        page.object_list = list(page.object_list)
+        _add_distinct_others(page.object_list, base_repositories)
+
+    return _repositories_context(page, sort, accounts, owner_only, hide_forks, distinct, query)
+
+
+def _repositories_context(page, sort, accounts, owner_only, hide_forks, distinct, query):
+    """
+    Return the context for the repositories lists of the user
+    """
+    return dict(
         page = page,
         sort = dict(
             key = sort['key'],
@@ -395,7 +535,6 @@ def _filter_repositories(request, param, extra):
         distinct = 'y' if distinct else False,
         query = query or "",
     )
-    return context
 
 
 @login_required
@@ -403,7 +542,7 @@ def repositories(request):
     """
     Display repositories followed/owned by the user
     """
-    context = _filter_repositories(request, param='followers__user', extra='core_account_repositories.account_id')
+    context = _filter_repositories(request, param='followers__user', extra='core_account_repositories.account_id', search_scope='followers_ids')
     return render(request, 'dashboard/repositories.html', context)
 
 
@@ -412,5 +551,5 @@ def contributing(request):
     """
     Display repositories contributed by the user
     """
-    context = _filter_repositories(request, param='contributors__user', extra='core_repository_contributors.account_id')
+    context = _filter_repositories(request, param='contributors__user', extra='core_repository_contributors.account_id', search_scope='contributors_ids')
     return render(request, 'dashboard/contributing.html', context)
@@ -7,6 +7,9 @@ from haystack.query import SQ, SearchQuerySet, EmptySearchQuerySet
 from haystack.models import SearchResult
 
 from core.models import Repository, Account
+from core.relatives import RelativesList
+from search.cache import CachedSearchResults
+from search.query import make_edismax_query
 from utils.sort import prepare_sort
 
 class CannotHandleException(Exception):
@@ -34,6 +37,11 @@ class _Filter(object):
         repository = ('id', 'backend', 'status', 'slug', 'project', 'modified'),
     )
     default_sort = None
+    # False if the result of a search with this filter cannot be cached
+    # (filters on private data, not in the search index)
+    cacheable = True
+    # True if the result depends on the current user
+    user_dependent = False
 
     def __init__(self, query_filter, search):
         """
@@ -83,6 +91,9 @@ class _Filter(object):
         if isinstance(queryset, EmptySearchQuerySet):
             return self.get_objects()
         else:
+            search_filter = self.get_search_filter()
+            if search_filter is not None:
+                return queryset.filter(search_filter)
             ids = list(self.get_ids()[:settings.SOLR_MAX_IN])
             return queryset.filter(django_id__in=ids)
 
@@ -92,6 +103,14 @@ class _Filter(object):
         """
         return Q()
 
+    def get_search_filter(self):
+        """
+        Return a SQ to filter directly in the search engine, or None if
+        the filter cannot be done without the ids from the database.
+        To be implemented in subclasses
+        """
+        return None
+
     def get_manager(self):
         """
         Return the manager to use for the filter
@@ -158,6 +177,7 @@ class _TagFilter(_Filter):
     An abstract filter for all tags
     """
     default_sort = 'name'
+    cacheable = False
 
     def original_filter(self):
         return 'tag:' + self.query_filter
@@ -243,6 +263,7 @@ class NotedFilter(_Filter):
     A filter for noted objects
     """
     default_sort = 'name'
+    cacheable = False
 
     @classmethod
     def parse_filter(cls, query_filter, search):
@@ -268,6 +289,7 @@ class TaggedFilter(_Filter):
     An abstract filter for tagged objects
     """
     default_sort = 'name'
+    cacheable = False
 
     @classmethod
     def parse_filter(cls, query_filter, search):
@@ -299,6 +321,7 @@ class UserObjectListFilter(_Filter):
     A filter for list of a loggued user
     """
     default_sort = 'name'
+    user_dependent = True
 
     # all allowed filters for each model, with the matching queryset main part
     allowed = dict(
@@ -326,6 +349,21 @@ class UserObjectListFilter(_Filter):
             raise CannotHandleException
         return query_filter
 
+    # fields of the search index for each allowed filter, to filter on the
+    # ids of the user's accounts (or on the user's id for "user_id" fields)
+    search_fields = dict(
+        account = dict(
+            following = 'followers_ids',
+            followers = 'following_ids',
+            accounts = 'user_id',
+        ),
+        repository = dict(
+            following = 'followers_ids',
+            owned = 'owner_user_id',
+            contributed = 'contributors_ids',
+        )
+    )
+
     def get_queryset_filter(self):
         """
         Return a filter on a list for the current user
@@ -333,6 +371,16 @@ class UserObjectListFilter(_Filter):
         part = self.allowed[self.search.model_name][self.query_filter]
         return Q(**{part: self.search.user})
 
+    def get_search_filter(self):
+        """
+        Return a filter on the relation fields of the search index
+        """
+        field = self.search_fields[self.search.model_name][self.query_filter]
+        if field.endswith('user_id'):
+            return SQ(**{field: self.search.user.id})
+        accounts_ids = list(self.search.user.accounts.values_list('id', flat=True))
+        return SQ(**{'%s__in' % field: accounts_ids or [0]})
+
 
 class ObjectRelativesFilter(_Filter):
     """
@@ -345,6 +393,22 @@ class ObjectRelativesFilter(_Filter):
         repository = ('followers', 'contributors', 'forks')
     )
 
+    # fields of the search index, for each allowed filter, holding the id
+    # of the base object
+    search_fields = dict(
+        account = dict(
+            following = 'followers_ids',
+            followers = 'following_ids',
+            repositories = 'followers_ids',
+            contributing = 'contributors_ids',
+        ),
+        repository = dict(
+            followers = 'repositories_ids',
+            contributors = 'contributing_ids',
+            forks = 'parent_fork_id',
+        )
+    )
+
     @classmethod
     def parse_filter(cls, query_filter, search):
         """
@@ -365,6 +429,21 @@ class ObjectRelativesFilter(_Filter):
         #if self.search.base.model_name == 'account' and self.search.model_name == 'repository'
         return queryset
 
+    def get_search_filter(self):
+        """
+        Return a filter on the relation fields of the search index
+        """
+        field = self.search_fields[self.search.base.model_name][self.query_filter]
+        return SQ(**{field: self.search.base.id})
+
+    def get_sorted_list(self, noforks=False):
+        """
+        Return the relatives sorted by score, from redis (see core.relatives),
+        loading only the objects of the displayed page
+        """
+        queryset = self.get_manager().only(*self.only[self.search.model_name])
+        return RelativesList(self.search.base, self.query_filter, queryset, noforks)
+
 
 # all valid filter, ordered
 FILTERS = (ObjectRelativesFilter, UserObjectListFilter, NotedFilter, TaggedFilter, FlagFilter, ProjectFilter, PlaceFilter, SimpleTagFilter, NoFilter)
@@ -376,7 +455,7 @@ class Search(object):
     model_name = None
     search_key = None
     search_fields = None
-    search_params = ('q', 'filter', 'order')
+    search_params = ('q', 'filter', 'order', 'tag')
     allowed_options = ()
 
     order_map = dict(db={}, solr={})
@@ -394,6 +473,7 @@ class Search(object):
         self.query = self.get_param('q')
         self.query_filter = self.get_param('filter')
         self.query_order = self.get_param('order')
+        self.query_tag = self.get_param('tag')
 
         self.model_name = self.model.model_name
 
@@ -543,10 +623,17 @@ class Search(object):
         Create the query for haystack for searching in `fields ` for documents
         with `keywords`. All keywords are ANDed, and if a keyword starts with a "-"
         all document with it will be excluded.
+        With solr, it's a single edismax query (see search.query), else one
+        clause by field and keyword.
         """
         if not keywords or not fields:
             return EmptySearchQuerySet()
 
+        # with solr, use only one edismax query
+        edismax_queryset = make_edismax_query(self.model, fields, keywords, queryset)
+        if edismax_queryset is not None:
+            return edismax_queryset
+
         if not queryset:
             queryset = SearchQuerySet()
 
@@ -603,6 +690,9 @@ class Search(object):
 
             queryset = queryset.models(self.model).only('id', 'get_absolute_url', 'modified')
 
+            # count tags of the results in the same request
+            queryset = queryset.facet('public_tags')
+
             return queryset.result_class(self.result_class)
         else:
             return EmptySearchQuerySet()
@@ -622,6 +712,16 @@ class Search(object):
         """
         return queryset
 
+    def apply_tag(self, queryset):
+        """
+        Narrow the results to the ones with the current public tag
+        """
+        if not self.query_tag or isinstance(queryset, EmptySearchQuerySet):
+            return queryset
+        if isinstance(queryset, SearchQuerySet):
+            return queryset.narrow('public_tags:"%s"' % queryset.query.clean(self.query_tag))
+        return queryset.filter(public_tags__slug=self.query_tag)
+
     def apply_order(self, queryset):
         """
         Apply the current order to the query set
@@ -630,14 +730,50 @@ class Search(object):
             return queryset.order_by(self.order['db_sort'])
         return queryset
 
+    def get_relatives_options(self):
+        """
+        Return the options to get the sorted list of relatives of the base
+        object (see `get_relatives_results`), or None if the current options
+        cannot be applied on this list
+        """
+        return {}
+
+    def get_relatives_results(self):
+        """
+        Return the relatives of the base object from the sorted lists in redis
+        if the search is the default one for a list of relatives (no query, no
+        tag, sorted by score), else None.
+        Also used for authenticated users: the lists are the same for all, the
+        private data on the objects comes from the overlay (see
+        private.overlay), and deleted objects are not in the lists, as in the
+        search index
+        """
+        if self.query or self.query_tag:
+            return None
+        if not isinstance(self.filter, ObjectRelativesFilter):
+            return None
+        if self.order['db_sort'] != self.order_map['db']['score']:
+            return None
+        options = self.get_relatives_options()
+        if options is None:
+            return None
+        return self.filter.get_sorted_list(**options)
+
     def update_results(self):
         """
         Calculate te results
         """
+        relatives_results = self.get_relatives_results()
+        if relatives_results is not None:
+            self.results = relatives_results
+            return
+
         self.results = self.apply_order(
-            self.apply_options(
-                self.apply_filter(
-                    self.get_search_queryset()
+            self.apply_tag(
+                self.apply_options(
+                    self.apply_filter(
+                        self.get_search_queryset()
+                    )
                 )
             )
         )
@@ -652,8 +788,47 @@ class Search(object):
 
         if force_update or self.results is None:
             self.update_results()
+            if self.filter.cacheable and isinstance(self.results, SearchQuerySet) \
+                    and not isinstance(self.results, EmptySearchQuerySet):
+                self.results = CachedSearchResults(self.results, self.model_name,
+                        self.get_cache_key_parts(), self.result_class)
         return self.results
 
+    def get_cache_key_parts(self):
+        """
+        Return all the data identifying the results of this search, to be used
+        to cache them
+        """
+        parts = [
+            self.model_name,
+            self.parse_keywords(self.query),
+            self.filter.__class__.__name__,
+            self.filter.original_filter(),
+            sorted(option for option, value in self.options.items() if value),
+            self.order['db_sort'],
+            self.query_tag,
+            self.base.simple_str() if self.base else None,
+            bool(self.check_user()),
+        ]
+        if self.filter.user_dependent:
+            parts.append(self.user.id)
+        return parts
+
+    def get_tag_facets(self):
+        """
+        Return the most used public tags in the results (computed by the
+        search engine with the results), as a list of dicts with slug, count
+        and a text to display
+        """
+        if not hasattr(self, '_tag_facets'):
+            self._tag_facets = []
+            results = self.get_results()
+            if hasattr(results, 'facet_counts'):
+                counts = results.facet_counts().get('fields', {}).get('public_tags', [])
+                self._tag_facets = [dict(slug=slug, count=count, display='%s (%d)' % (slug, count))
+                    for slug, count in counts if count][:settings.SEARCH_TAG_FACETS_LIMIT]
+        return self._tag_facets
+
     def check_user(self):
         """
         Return True if the user is authenticated and active, or return False
@@ -676,7 +851,7 @@ class Search(object):
         Return True if the Search is in a default status (no filter, options, order, query)
         """
 
-        if self.query:
+        if self.query or self.query_tag:
             return False
         if not self.base and self.filter.original_filter():
             return False
@@ -716,6 +891,15 @@ class RepositorySearch(Search):
         ),
     )
 
+    def get_relatives_options(self):
+        """
+        The sorted lists of relatives exist with and without forks, but
+        cannot be filtered by owner
+        """
+        if self.options.get('is_owner', False):
+            return None
+        return dict(noforks=not self.options.get('show_forks', False))
+
     def apply_options(self, queryset):
         """
         Apply the "show forks" option
@@ -3,3 +3,5 @@
 from django.conf import settings
 
 ALLOWED_MODELS = settings.NOTES_ALLOWED_MODELS
+
+import private.signals  # connect the receivers
@@ -0,0 +1,213 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import simplejson
+
+from redisco import connection
+from notes.models import Note
+
+from core.models import Account, Repository
+
+NOTE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class PrivateOverlay(object):
+    """
+    A cache, in redis, of the private data of a user, used to decorate lists
+    of objects (see the `prepare_private` template tag) without any sql query.
+    Data is split in parts, each one built from the database the first time
+    it's needed, then updated (notes and tags) or invalidated (relations)
+    when the data changes. Each part expires after PRIVATE_OVERLAY_TIMEOUT
+    seconds in case of a missed update.
+    Parts:
+        notes:account, notes:repository : hash of (rendered note, modified) by object id
+        tags:account, tags:repository : hash of list of (name, slug) by object id
+        self:account : ids of the user's accounts
+        following:account : ids of accounts followed by one of the user's accounts
+        followed:account : ids of accounts following one of the user's accounts
+        owns:repository : ids of repositories followed and owned by the user's accounts
+        follows:repository : ids of other repositories followed by the user's accounts
+        forked:repository : ids of repositories forked by one of the user's accounts
+    """
+    key_template = 'private_overlay:%d:%s'
+    timeout = getattr(settings, 'PRIVATE_OVERLAY_TIMEOUT', 60 * 60 * 24)
+
+    RELATED_PARTS = dict(
+        account = ('self:account', 'following:account', 'followed:account'),
+        repository = ('owns:repository', 'follows:repository', 'forked:repository'),
+    )
+
+    def __init__(self, user_id):
+        super(PrivateOverlay, self).__init__()
+        self.user_id = user_id
+
+    def key(self, part):
+        return self.key_template % (self.user_id, part)
+
+    def built_key(self, part):
+        return self.key('built:%s' % part)
+
+    def is_built(self, part):
+        return connection.exists(self.built_key(part))
+
+    def invalidate(self, *parts):
+        """
+        Delete the given parts, they will be rebuilt on next use
+        """
+        keys = []
+        for part in parts:
+            keys += [self.built_key(part), self.key(part)]
+        connection.delete(*keys)
+
+    def invalidate_related(self, model_name=None):
+        """
+        Invalidate all parts about relations (for the given model only if set)
+        """
+        parts = []
+        for name, model_parts in self.RELATED_PARTS.items():
+            if model_name is None or name == model_name:
+                parts += model_parts
+        self.invalidate(*parts)
+
+    def _save(self, part, data):
+        """
+        Save the data for the given part (a dict for hashes, or a list of ids
+        for sets), and mark it as built. The "built" mark expires just
+        before the data, so we never use an expired part
+        """
+        key = self.key(part)
+        pipeline = connection.pipeline()
+        pipeline.delete(key)
+        if isinstance(data, dict):
+            if data:
+                pipeline.hmset(key, data)
+        elif data:
+            pipeline.sadd(key, *data)
+        pipeline.expire(key, self.timeout)
+        pipeline.setex(self.built_key(part), 1, self.timeout - 1)
+        pipeline.execute()
+
+    def build(self, part):
+        """
+        Compute the given part from the database and save it
+        """
+        kind, model_name = part.split(':')
+
+        if kind == 'notes':
+            notes = Note.objects.filter(
+                    content_type__app_label = 'core',
+                    content_type__model = model_name,
+                    author = self.user_id,
+                ).values_list('object_id', 'rendered_content', 'modified')
+            data = dict((obj_id, self.dump_note(note, modified)) for obj_id, note, modified in notes)
+
+        elif kind == 'tags':
+            model = Account if model_name == 'account' else Repository
+            tagged_items = model.private_tags_class.objects.filter(owner=self.user_id).values_list(
+                    'content_object', 'tag__name', 'tag__slug')
+            tags = {}
+            for obj_id, name, slug in tagged_items:
+                tags.setdefault(obj_id, []).append((name, slug))
+            data = dict((obj_id, simplejson.dumps(obj_tags)) for obj_id, obj_tags in tags.items())
+
+        elif kind == 'self':
+            data = list(Account.objects.filter(user=self.user_id).values_list('id', flat=True))
+
+        elif kind == 'following':
+            data = list(Account.objects.filter(followers__user=self.user_id).values_list('id', flat=True))
+
+        elif kind == 'followed':
+            data = list(Account.objects.filter(following__user=self.user_id).values_list('id', flat=True))
+
+        elif kind in ('owns', 'follows'):
+            following = Repository.objects.filter(followers__user=self.user_id).values_list('id', 'owner__user_id')
+            owns = set(obj_id for obj_id, owner_user_id in following if owner_user_id == self.user_id)
+            self._save('owns:repository', list(owns))
+            self._save('follows:repository', list(set(obj_id for obj_id, owner_user_id in following) - owns))
+            return
+
+        elif kind == 'forked':
+            data = list(Repository.objects.filter(forks__owner__user=self.user_id).values_list('id', flat=True))
+
+        self._save(part, data)
+
+    def ensure_built(self, *parts):
+        for part in parts:
+            if not self.is_built(part):
+                self.build(part)
+
+    def members(self, part, ids):
+        """
+        Return the ones of the given ids which are in the given (set) part
+        """
+        self.ensure_built(part)
+        pipeline = connection.pipeline()
+        for obj_id in ids:
+            pipeline.sismember(self.key(part), obj_id)
+        return [obj_id for obj_id, found in zip(ids, pipeline.execute()) if found]
+
+    def values(self, part, ids):
+        """
+        Return a dict with the values of the given (hash) part for the given ids
+        """
+        self.ensure_built(part)
+        if not ids:
+            return {}
+        values = connection.hmget(self.key(part), ids)
+        return dict((obj_id, value) for obj_id, value in zip(ids, values) if value is not None)
+
+    @staticmethod
+    def dump_note(rendered_content, modified):
+        return simplejson.dumps([rendered_content, modified.strftime(NOTE_DATE_FORMAT) if modified else None])
+
+    def get_notes(self, model_name, ids):
+        """
+        Return a dict with, for each noted object in `ids`, a tuple with the
+        rendered note and its modified date
+        """
+        result = {}
+        for obj_id, value in self.values('notes:%s' % model_name, ids).items():
+            note, modified = simplejson.loads(value)
+            if modified:
+                modified = datetime.strptime(modified, NOTE_DATE_FORMAT)
+            result[obj_id] = (note, modified)
+        return result
+
+    def get_tags(self, model_name, ids):
+        """
+        Return a dict with, for each tagged object in `ids`, a list of
+        (name, slug) tuples
+        """
+        return dict((obj_id, simplejson.loads(value))
+            for obj_id, value in self.values('tags:%s' % model_name, ids).items())
+
+    def update_note(self, model_name, obj_id, rendered_content=None, modified=None):
+        """
+        Update (or remove if no content) the note of an object, if the part
+        is already built
+        """
+        part = 'notes:%s' % model_name
+        if not self.is_built(part):
+            return
+        if rendered_content is None:
+            connection.hdel(self.key(part), obj_id)
+        else:
+            connection.hset(self.key(part), obj_id, self.dump_note(rendered_content, modified))
+
+    def update_tags(self, model_name, obj_id):
+        """
+        Update the tags of an object from the database, if the part is
+        already built
+        """
+        part = 'tags:%s' % model_name
+        if not self.is_built(part):
+            return
+        model = Account if model_name == 'account' else Repository
+        tags = list(model.private_tags_class.objects.filter(owner=self.user_id, content_object=obj_id).values_list(
+                'tag__name', 'tag__slug'))
+        if tags:
+            connection.hset(self.key(part), obj_id, simplejson.dumps(tags))
+        else:
+            connection.hdel(self.key(part), obj_id)
@@ -0,0 +1,124 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from notes.models import Note
+
+from core.models import Account, Repository
+from tagging.models import PrivateTaggedAccount, PrivateTaggedRepository, private_tags_changed
+from tagging.signals import tags_set
+from private.overlay import PrivateOverlay
+
+
+def _users_of_accounts(accounts_ids):
+    """
+    Return the ids of the users linked to the given accounts
+    """
+    if not accounts_ids:
+        return []
+    return set(Account.objects.filter(id__in=accounts_ids, user__isnull=False).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=Note, dispatch_uid='private.signals.UpdateOverlayOnNoteSave')
+def UpdateOverlayOnNoteSave(sender, instance, **kwargs):
+    if instance.content_type.app_label != 'core':
+        return
+    PrivateOverlay(instance.author_id).update_note(instance.content_type.model, instance.object_id,
+        instance.rendered_content, instance.modified)
+
+
+@receiver(post_delete, sender=Note, dispatch_uid='private.signals.UpdateOverlayOnNoteDelete')
+def UpdateOverlayOnNoteDelete(sender, instance, **kwargs):
+    if instance.content_type.app_label != 'core':
+        return
+    PrivateOverlay(instance.author_id).update_note(instance.content_type.model, instance.object_id)
+
+
+@receiver(post_save, sender=PrivateTaggedAccount, dispatch_uid='private.signals.UpdateOverlayOnAccountTagSave')
+@receiver(post_delete, sender=PrivateTaggedAccount, dispatch_uid='private.signals.UpdateOverlayOnAccountTagDelete')
+def UpdateOverlayOnAccountTag(sender, instance, **kwargs):
+    PrivateOverlay(instance.owner_id).update_tags('account', instance.content_object_id)
+    private_tags_changed(instance.owner_id)
+
+
+@receiver(post_save, sender=PrivateTaggedRepository, dispatch_uid='private.signals.UpdateOverlayOnRepositoryTagSave')
+@receiver(post_delete, sender=PrivateTaggedRepository, dispatch_uid='private.signals.UpdateOverlayOnRepositoryTagDelete')
+def UpdateOverlayOnRepositoryTag(sender, instance, **kwargs):
+    PrivateOverlay(instance.owner_id).update_tags('repository', instance.content_object_id)
+    private_tags_changed(instance.owner_id)
+
+
+@receiver(tags_set, sender=PrivateTaggedAccount, dispatch_uid='private.signals.UpdateOverlayOnAccountTagsSet')
+@receiver(tags_set, sender=PrivateTaggedRepository, dispatch_uid='private.signals.UpdateOverlayOnRepositoryTagsSet')
+def UpdateOverlayOnTagsSet(sender, instance, lookup, **kwargs):
+    owner_id = lookup['owner'].pk
+    PrivateOverlay(owner_id).update_tags(instance.model_name, instance.pk)
+    private_tags_changed(owner_id)
+
+
+@receiver(post_save, sender=Account, dispatch_uid='private.signals.InvalidateOverlayOnAccountSave')
+def InvalidateOverlayOnAccountSave(sender, instance, **kwargs):
+    """
+    An account of a user may have been added
+    """
+    if instance.user_id:
+        PrivateOverlay(instance.user_id).invalidate('self:account')
+
+
+@receiver(post_save, sender=Repository, dispatch_uid='private.signals.InvalidateOverlayOnRepositorySave')
+def InvalidateOverlayOnRepositorySave(sender, instance, **kwargs):
+    """
+    The owner or the parent fork of a repository of a user may have changed
+    """
+    if not instance.owner_id:
+        return
+    for user_id in _users_of_accounts([instance.owner_id]):
+        PrivateOverlay(user_id).invalidate_related('repository')
+
+
+def _invalidate_on_m2m_change(action, instance, reverse, pk_set, model_name, accounts_ids_getter):
+    """
+    Invalidate the overlays of the users of accounts concerned by a change
+    in a many to many relation from accounts to objects of `model_name`.
+    `accounts_ids_getter` is used to get the ids of the accounts before a
+    "clear" (when `reverse`, `instance` is a `model_name` object)
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if action == 'pre_clear':
+        pk_set = set(accounts_ids_getter(instance, reverse))
+    else:
+        pk_set = set(pk_set or [])
+
+    if reverse:
+        # instance is the object on the other side, pk_set the accounts
+        accounts_ids = pk_set
+        if model_name == 'account':
+            accounts_ids.add(instance.pk)
+    else:
+        # instance is the account
+        accounts_ids = set([instance.pk])
+        if model_name == 'account':
+            accounts_ids.update(pk_set)
+
+    for user_id in _users_of_accounts(accounts_ids):
+        PrivateOverlay(user_id).invalidate_related(model_name)
+
+
+@receiver(m2m_changed, sender=Account.following.through, dispatch_uid='private.signals.InvalidateOverlayOnFollowingChange')
+def InvalidateOverlayOnFollowingChange(sender, instance, action, reverse, pk_set, **kwargs):
+    def get_ids(instance, reverse):
+        relation = instance.followers if reverse else instance.following
+        return relation.values_list('id', flat=True)
+    _invalidate_on_m2m_change(action, instance, reverse, pk_set, 'account', get_ids)
+
+
+@receiver(m2m_changed, sender=Account.repositories.through, dispatch_uid='private.signals.InvalidateOverlayOnRepositoriesChange')
+def InvalidateOverlayOnRepositoriesChange(sender, instance, action, reverse, pk_set, **kwargs):
+    def get_ids(instance, reverse):
+        if reverse:
+            return instance.followers.values_list('id', flat=True)
+        return []
+    _invalidate_on_m2m_change(action, instance, reverse, pk_set, 'repository', get_ids)
@@ -3,14 +3,13 @@
 from django import template
 from django.core.urlresolvers import reverse
 from django.utils.http import urlquote
-from django.utils import simplejson
 
 from django_globals import globals
-from notes.models import Note
 
 from private.models import ALLOWED_MODELS
+from private.overlay import PrivateOverlay
 from private.forms import NoteForm, NoteDeleteForm, TagsDeleteForm, TagsBaseForm
-from core.models import Account, Repository, get_object_from_str
+from core.models import get_object_from_str
 from utils.model_utils import get_app_and_model
 from utils.views import get_request_param
 from tagging.models import Tag
@@ -24,6 +23,7 @@ def prepare_private(objects, ignore=None):
     """
     Update each object included in the `objects` with private informations (note and tags)
     All objects must be from the same content_type
+    Informations are read from the user's PrivateOverlay, without sql queries
     `ignore` is a string where we will search for "-tags", "-notes" and "related" to avoid compute them
     if found
     """
@@ -51,16 +51,11 @@ def prepare_private(objects, ignore=None):
         if not ids:
             return ''
 
+        overlay = PrivateOverlay(user.id)
+
         # read and save notes
         if not (ignore and '-notes' in ignore):
-            notes = Note.objects.filter(
-                    content_type__app_label = app_label,
-                    content_type__model = model_name,
-                    author = user,
-                    object_id__in=ids
-                    ).values_list('object_id', 'rendered_content', 'modified')
-
-            for obj_id, note, modified in notes:
+            for obj_id, (note, modified) in overlay.get_notes(model_name, ids).items():
                 dict_objects[obj_id].current_user_has_extra = True
                 dict_objects[obj_id].current_user_has_note = True
                 dict_objects[obj_id].current_user_rendered_note = note
@@ -68,64 +63,30 @@ def prepare_private(objects, ignore=None):
 
         # read and save tags
         if not (ignore and '-tags' in ignore):
-            if model_name == 'account':
-                qs_tags = user.tagging_privatetaggedaccount_items
-            else:
-                qs_tags = user.tagging_privatetaggedrepository_items
-
-            private_tagged_items = qs_tags.filter(
-                    content_object__in=ids
-                ).values_list('content_object', 'tag__name', 'tag__slug')
-
-            for obj_id, tag, slug in private_tagged_items:
-                if not getattr(dict_objects[obj_id], 'current_user_has_tags', None):
-                    dict_objects[obj_id].current_user_has_extra = True
-                    dict_objects[obj_id].current_user_has_tags = True
-                    dict_objects[obj_id].current_user_tags = []
-                dict_objects[obj_id].current_user_tags.append(dict(name=tag, slug=slug))
-
-            for obj in dict_objects.values():
-                if not getattr(obj, 'current_user_tags', None):
-                    continue
-                obj.current_user_tags = split_tags_and_flags(obj.current_user_tags, model_name, tags_are_dict=True)
+            for obj_id, tags in overlay.get_tags(model_name, ids).items():
+                obj = dict_objects[obj_id]
+                obj.current_user_has_extra = True
+                obj.current_user_tags = split_tags_and_flags(
+                    [dict(name=tag, slug=slug) for tag, slug in tags], model_name, tags_are_dict=True)
                 obj.current_user_has_tags = (obj.current_user_tags['places'] or obj.current_user_tags['projects'] or obj.current_user_tags['tags'])
 
-
         if not (ignore and '-related' in ignore):
             if model_name == 'account':
-                # self
-                self_accounts = Account.objects.filter(id__in=ids, user=user).values_list('id', flat=True)
-                for obj_id in self_accounts:
-                    dict_objects[obj_id].current_user_has_extra = True
-                    dict_objects[obj_id].current_user_is_self = True
-
-                # follows
-                following = Account.objects.filter(id__in=ids, followers__user=user).values_list('id', flat=True)
-                for obj_id in following:
-                    dict_objects[obj_id].current_user_has_extra = True
-                    dict_objects[obj_id].current_user_follows = True
-
-                # is followed
-                followed = Account.objects.filter(id__in=ids, following__user=user).values_list('id', flat=True)
-                for obj_id in followed:
-                    dict_objects[obj_id].current_user_has_extra = True
-                    dict_objects[obj_id].current_user_followed = True
-
+                related = (
+                    ('self:account', 'current_user_is_self'),
+                    ('following:account', 'current_user_follows'),
+                    ('followed:account', 'current_user_followed'),
+                )
             else:
-                # owns or follows
-                following = Repository.objects.filter(id__in=ids, followers__user=user).values_list('id', 'owner__user_id')
-                for obj_id, owner_id in following:
-                    dict_objects[obj_id].current_user_has_extra = True
-                    if owner_id == user.id:
-                        dict_objects[obj_id].current_user_owns = True
-                    else:
-                        dict_objects[obj_id].current_user_follows = True
-
-                # fork
-                forked = Repository.objects.filter(id__in=ids, forks__owner__user=user).values_list('id', flat=True)
-                for obj_id in forked:
+                related = (
+                    ('owns:repository', 'current_user_owns'),
+                    ('follows:repository', 'current_user_follows'),
+                    ('forked:repository', 'current_user_has_fork'),
+                )
+            for part, attribute in related:
+                for obj_id in overlay.members(part, ids):
                     dict_objects[obj_id].current_user_has_extra = True
-                    dict_objects[obj_id].current_user_has_fork = True
+                    setattr(dict_objects[obj_id], attribute, True)
 
         return ''
     except:
@@ -147,15 +108,6 @@ class PrepareAllUserTagsNode(template.Node):
 def prepare_all_user_tags(parser, token):
     return PrepareAllUserTagsNode()
 
-@register.simple_tag
-def all_user_tags_json():
-    result = {}
-
-    if globals.user and globals.user.is_authenticated():
-        result = get_user_tags(globals.request)
-
-    return simplejson.dumps(result)
-
 
 @register.inclusion_tag('private/edit_private.html')
 def edit_private(object_str):
@@ -2,7 +2,7 @@
 
 from django.conf.urls.defaults import *
 
-from private.views import note_save, note_delete, tags_save, tags_delete, ajax_edit, ajax_close, toggle, tag_save
+from private.views import note_save, note_delete, tags_save, tags_delete, ajax_edit, ajax_close, toggle, tag_save, user_tags_json
 
 urlpatterns = patterns('',
     url(r'^notes/save/$', note_save, name='note_save'),
@@ -13,4 +13,5 @@ urlpatterns = patterns('',
     url(r'^close-ajax/(?P<object_key>(?:core\.)?(?:account|repository):\d+)/$', ajax_close, name='private_ajax_close'),
     url(r'^toggle/(?P<key>star|check-later)/$', toggle, name='private_toggle'),
     url(r'^tag/save/$', tag_save, name='tag_save'),
+    url(r'^tags/json/$', user_tags_json, name='private_user_tags_json'),
 )
@@ -7,7 +7,11 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.shortcuts import redirect, render
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified
+from django.core.cache import cache
+from django.utils import simplejson
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.conf import settings
 
 from notes.models import Note
 
@@ -17,7 +21,7 @@ from utils.model_utils import get_app_and_model
 from core.models import get_object_from_str
 from utils.djson.response import JSONResponse
 from utils.views import ajax_login_required
-from tagging.models import Tag
+from tagging.models import Tag, private_tags_version
 from tagging.flags import split_tags_and_flags
 
 def get_user_note_for_object(obj, user=None):
@@ -244,14 +248,20 @@ def get_user_tags(request):
     Return the tags to be used in the search form filter.
     Work is done to note if tags are only for repositories, only for people
     or both.
+    Cached for each user until its private tags change (see
+    tagging.models.private_tags_changed)
     """
-    # TODO => cache !
-
     if hasattr(request, '_all_user_tags'):
         return request._all_user_tags
 
     result = {'has': {}, 'for_only': {}}
     if request.user.is_authenticated():
+        cache_key = 'user_tags:%d:%d' % (request.user.id, private_tags_version(request.user.id))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            request._all_user_tags = cached
+            return cached
+
         tags = {}
         types = ('places', 'projects', 'tags')
         for model in ('account', 'repository'):
@@ -291,9 +301,32 @@ def get_user_tags(request):
 
             result[tag_type] = sorted(result[tag_type], key=itemgetter('name'))
 
+        cache.set(cache_key, result, settings.USER_TAGS_CACHE_TIMEOUT)
+
     request._all_user_tags = result
     return result
 
+@ajax_login_required
+@login_required
+def user_tags_json(request):
+    """
+    Return, in json, the tags of the current user (see `get_user_tags`), used
+    by the tags editor.
+    The ETag is the version of the user's private tags, so the browser gets
+    a "304 Not Modified" if they didn't change since its last request.
+    """
+    etag = '"user-tags-%d-%d"' % (request.user.id, private_tags_version(request.user.id))
+
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(simplejson.dumps(get_user_tags(request)), mimetype='application/json')
+
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, must_revalidate=True, max_age=0)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
 TOGGLABLE = {
     'star': {
         'tag': 'starred',
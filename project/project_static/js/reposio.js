@@ -330,12 +330,14 @@ $(document).ready(function() {
         },
 
         ask_for_login: function() {
+            Reposio.logged = false;
             Reposio.UserTags = null;
             Page.open_iframe(Reposio.urls.login + '?iframe=1');
             return false;
         },
 
         ask_for_logout: function() {
+            Reposio.logged = false;
             Reposio.UserTags = null;
             Page.open_iframe(Reposio.urls.logout + '?iframe=1');
             return false;
@@ -344,7 +346,8 @@ $(document).ready(function() {
         on_logged: function(data) {
             Page.close_iframe();
             Reposio.Token = data.Token;
-            Reposio.UserTags = data.UserTags;
+            Reposio.logged = true;
+            Reposio.UserTags = null;
             Page.message("You are now logged in !<br />If you've tried an action before, please do it again now.");
             $('#login-link').remove();
             var $header_links = $('#header-links'),
@@ -363,6 +366,32 @@ $(document).ready(function() {
             $header_links.prepend($user_link, ' ', $logout_link);
         },
 
+        load_user_tags: function(callback, complete) {
+            // the browser revalidates with the ETag, so the tags are only
+            // sent again by the server if they changed
+            // `complete` is called in all cases, even on errors
+            if (Reposio.UserTags) {
+                callback();
+                if (complete) { complete(); }
+                return;
+            }
+            $.getJSON(Reposio.urls.user_tags)
+                .success(function(data) {
+                    if (data.error) {
+                        Page.error(data.error, data.login_required);
+                    } else {
+                        Reposio.UserTags = data;
+                        callback();
+                    }
+                })
+                .error(function(xhr) {
+                    Page.error(xhr.responseText);
+                })
+                .complete(function() {
+                    if (complete) { complete(); }
+                });
+        },
+
         on_not_logged: function() {
             Page.close_iframe();
             Page.error('We were unable to log you in :(');
@@ -370,6 +399,7 @@ $(document).ready(function() {
 
         on_logged_out: function() {
             Page.close_iframe();
+            Reposio.logged = false;
             Reposio.UserTags = null;
             Page.message('You are now logged out !');
             $('#user-link').remove();
@@ -601,7 +631,7 @@ $(document).ready(function() {
             ev.stopImmediatePropagation();
             ev.preventDefault();
 
-            if (!Reposio.UserTags) {
+            if (!Reposio.logged) {
                 Page.error('You need to be logged for this', true);
                 return false;
             }
@@ -611,7 +641,13 @@ $(document).ready(function() {
                 return false;
             }
 
-            this.open(article);
+            var that = this;
+            $link.addClass('loading');
+            Page.load_user_tags(function() {
+                that.open(article);
+            }, function() {
+                $link.removeClass('loading');
+            });
 
             return false;
         },
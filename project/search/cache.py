@@ -0,0 +1,95 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
+
+from haystack.models import SearchResult
+
+from core.search_commit import get_index_generation
+
+
+class CachedSearchResults(object):
+    """
+    Wrap a haystack SearchQuerySet to keep in cache the total count, the
+    facet counts and the first SEARCH_RESULTS_CACHE_SIZE results (pk and some
+    stored fields), so the first pages of a search are served without a
+    query to the search engine. Other pages are still got from the search
+    engine.
+    The cache key includes the generation of the index of the model, which
+    changes at each commit, so a cached entry is never used after new data
+    is visible in the index.
+    `key_parts` must identify the search (query, filter, order, options...)
+    """
+    key_template = 'search_results:%s:%d:%s'
+
+    def __init__(self, queryset, model_name, key_parts, result_class=SearchResult,
+                 fields=('get_absolute_url', 'modified')):
+        super(CachedSearchResults, self).__init__()
+        self.queryset = queryset
+        self.model_name = model_name
+        self.result_class = result_class
+        self.fields = fields
+        self.size = getattr(settings, 'SEARCH_RESULTS_CACHE_SIZE', 200)
+        self.cache_key = self.key_template % (
+            model_name,
+            get_index_generation(model_name),
+            md5_constructor(repr(key_parts)).hexdigest(),
+        )
+        self._data = None
+
+    def get_data(self):
+        """
+        Return the cached data (a dict with `count` and `results`), computing
+        it if not in cache
+        """
+        if self._data is None:
+            self._data = cache.get(self.cache_key)
+            if self._data is None:
+                results = [(int(result.pk), dict((field, getattr(result, field, None)) for field in self.fields))
+                    for result in self.queryset[:self.size]]
+                self._data = dict(
+                    count = self.queryset.count(),
+                    results = results,
+                    # facets are computed by the same request as the results
+                    facets = self.queryset.query.get_facet_counts() if self.queryset.query.facets else {},
+                )
+                cache.set(self.cache_key, self._data, getattr(settings, 'SEARCH_RESULTS_CACHE_TIMEOUT', 900))
+        return self._data
+
+    def make_result(self, pk, fields):
+        return self.result_class('core', self.model_name, pk, None, **fields)
+
+    def count(self):
+        return self.get_data()['count']
+
+    def facet_counts(self):
+        return self.get_data()['facets']
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        for pk, fields in self.get_data()['results']:
+            yield self.make_result(pk, fields)
+        if self.count() > self.size:
+            for result in self.queryset[self.size:]:
+                yield result
+
+    def __getitem__(self, k):
+        """
+        Return results from the cache if possible, else from the search engine
+        """
+        if isinstance(k, slice):
+            if k.step is not None:
+                return list(self)[k]
+            start = k.start or 0
+            stop = k.stop if k.stop is not None else self.count()
+            if start >= 0 and stop <= self.size:
+                return [self.make_result(pk, fields) for pk, fields in self.get_data()['results'][start:stop]]
+            return self.queryset[k]
+
+        if 0 <= k < self.size:
+            pk, fields = self.get_data()['results'][k]
+            return self.make_result(pk, fields)
+        return self.queryset[k]
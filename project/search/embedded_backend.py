@@ -0,0 +1,39 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+"""
+An embedded search engine, to use instead of solr for small deployments and
+tests, with:
+    HAYSTACK_SEARCH_ENGINE = 'search.embedded'
+    HAYSTACK_WHOOSH_PATH = '/path/to/the/index/directory'
+It's the whoosh backend of haystack (pure python, index stored on disk),
+ignoring the options whoosh doesn't support (facets, list of fields to
+return), so the searches done in `front.search` and `search.views` work
+with both engines.
+Writes are committed immediately (see core.search_commit.COMMIT_NEEDED).
+"""
+
+from haystack.backends.whoosh_backend import (SearchBackend as WhooshSearchBackend,
+                                              SearchQuery as WhooshSearchQuery)
+
+
+class SearchBackend(WhooshSearchBackend):
+    """
+    The whoosh backend, without unsupported options
+    """
+    unsupported_options = ('facets', 'date_facets', 'query_facets', 'fields')
+
+    def search(self, query_string, **kwargs):
+        for option in self.unsupported_options:
+            kwargs.pop(option, None)
+        results = super(SearchBackend, self).search(query_string, **kwargs)
+        results.setdefault('facets', {})
+        return results
+
+
+class SearchQuery(WhooshSearchQuery):
+    """
+    The whoosh search query, using our backend
+    """
+
+    def __init__(self, site=None, backend=None):
+        super(SearchQuery, self).__init__(site, backend=backend or SearchBackend(site=site))
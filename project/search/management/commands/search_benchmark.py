@@ -0,0 +1,102 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from haystack import load_backend, site
+from haystack.query import SearchQuerySet
+
+from core.search_documents import SearchDocumentsBuilder
+from front.search import RepositorySearch, AccountSearch
+from search.query import EdismaxSearchQuery
+
+DEFAULT_QUERIES = (
+    'django',
+    'python web framework',
+    '"rest api"',
+    'redis -client',
+    'javascript',
+)
+
+
+class Command(BaseCommand):
+    """
+    Run the same searches (built like in `front.search`) on many search
+    engines (by default solr and the embedded one, see search.embedded_backend)
+    and display the time taken by each one to get the first page of results
+    and the count.
+    """
+    args = '[query] [query] ...'
+    help = 'Compare the speed of search engines'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--engines', dest='engines', default='solr,search.embedded',
+            help='Comma separated list of engines (default: solr,search.embedded)'),
+        make_option('--type', dest='search_type', default='repositories',
+            help='"repositories" (default) or "people"'),
+        make_option('--order', dest='order', default='',
+            help='Sort order, as in the search form (default: relevance)'),
+        make_option('--repeat', type='int', dest='repeat', default=10,
+            help='Number of runs for each query (default: 10)'),
+        make_option('--index', type='int', dest='index', default=0,
+            help='Index this number of objects in each engine before the benchmark'),
+    )
+
+    def get_engine(self, name):
+        """
+        Return the backend and an empty SearchQuerySet for the given engine
+        """
+        try:
+            module = load_backend(name)
+        except Exception, e:
+            raise CommandError('Cannot load the search engine "%s": %s' % (name, e))
+        backend = module.SearchBackend(site=site)
+        # for solr, use the edismax query, as in `front.search`
+        query_class = EdismaxSearchQuery if name == 'solr' else module.SearchQuery
+        return backend, SearchQuerySet(site=site, query=query_class(site=site, backend=backend))
+
+    def index(self, backend, model, nb):
+        """
+        Index `nb` objects of the given model with the given backend
+        """
+        builder = SearchDocumentsBuilder(model)
+        objects = builder.get_objects(limit=nb)
+        backend.update(site.get_index(model), objects, commit=True)
+        return len(objects)
+
+    def run_query(self, search, base_queryset):
+        """
+        Get the first page and the count for the given search on the given
+        engine, and return the duration in ms and the count
+        """
+        queryset = search.make_query(search.search_fields, search.parse_keywords(search.query), base_queryset)
+        queryset = search.apply_order(search.apply_options(queryset.models(search.model)))
+        start = time.time()
+        list(queryset[:20])
+        count = queryset.count()
+        return (time.time() - start) * 1000, count
+
+    def handle(self, *queries, **options):
+        search_class = AccountSearch if options['search_type'] == 'people' else RepositorySearch
+        queries = queries or DEFAULT_QUERIES
+
+        engines = []
+        for name in options['engines'].split(','):
+            backend, base_queryset = self.get_engine(name.strip())
+            if options['index']:
+                nb = self.index(backend, search_class.model, options['index'])
+                self.stdout.write('%s: %d objects indexed\n' % (name, nb))
+            engines.append((name, base_queryset))
+
+        self.stdout.write('%-30s %-20s %8s %8s %8s %8s\n' % ('query', 'engine', 'count', 'min ms', 'avg ms', 'max ms'))
+        for query in queries:
+            search = search_class(dict(q=query, order=options['order']))
+            for name, base_queryset in engines:
+                durations = []
+                for i in range(options['repeat']):
+                    duration, count = self.run_query(search, base_queryset)
+                    durations.append(duration)
+                self.stdout.write('%-30s %-20s %8d %8.1f %8.1f %8.1f\n' % (query[:30], name, count,
+                    min(durations), sum(durations) / len(durations), max(durations)))
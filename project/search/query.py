@@ -0,0 +1,110 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+"""
+Build a search as one edismax query, with fields weighted by the boosts of
+the search index, instead of one boolean clause for each field and keyword.
+Only for solr: with other engines, `make_edismax_query` returns None and the
+boolean queries must be used.
+"""
+
+from django.conf import settings
+
+from haystack import site
+from haystack.query import SearchQuerySet, EmptySearchQuerySet
+
+try:
+    from haystack.backends.solr_backend import SearchQuery as SolrSearchQuery
+except ImportError:
+    SolrSearchQuery = None
+
+
+if SolrSearchQuery is not None:
+
+    class EdismaxSearchQuery(SolrSearchQuery):
+        """
+        A solr query which can include an edismax sub-query, ANDed with the
+        other parts of the query (filters, models...).
+        Haystack doesn't allow to pass parameters to solr (as `defType` or
+        `qf`), so we use a nested query with local params:
+            _query_:"{!edismax qf='...' mm='...'}the user query"
+        """
+
+        def __init__(self, site=None, backend=None):
+            super(EdismaxSearchQuery, self).__init__(site, backend)
+            self.edismax = None
+
+        def set_edismax(self, query_string, qf, mm='100%'):
+            """
+            Use an edismax query for `query_string` (already cleaned) on the
+            `qf` fields. By default all terms must match (`mm`)
+            """
+            self.edismax = (query_string, qf, mm)
+
+        def build_query(self):
+            query = super(EdismaxSearchQuery, self).build_query()
+            if not self.edismax:
+                return query
+            query_string, qf, mm = self.edismax
+            query_string = query_string.replace('\\', '\\\\').replace('"', '\\"')
+            edismax = u'_query_:"{!edismax qf=\'%s\' mm=\'%s\'}%s"' % (qf, mm, query_string)
+            if query in ('', '*:*'):
+                return edismax
+            return u'%s AND (%s)' % (edismax, query)
+
+        def _clone(self, klass=None):
+            clone = super(EdismaxSearchQuery, self)._clone(klass)
+            clone.edismax = self.edismax
+            return clone
+
+else:
+    EdismaxSearchQuery = None
+
+
+def get_query_fields(model, fields):
+    """
+    Return the `qf` parameter for the given fields of the search index of the
+    given model, using the boosts of the fields ("project^2.5 slug^2...")
+    """
+    index_fields = site.get_index(model).fields
+    qf = []
+    for name in fields:
+        boost = getattr(index_fields.get(name), 'boost', 1.0)
+        qf.append('%s^%s' % (name, boost) if boost != 1.0 else name)
+    return ' '.join(qf)
+
+
+def make_edismax_query(model, fields, keywords, queryset=None):
+    """
+    Return a SearchQuerySet to search for `keywords` (from `parse_keywords`)
+    in `fields`, with one edismax query. All keywords must match, keywords
+    starting with a "-" exclude documents, and keywords with spaces (quoted
+    by the user) are phrases.
+    Return None if solr is not used (or if the given queryset was not created
+    with an EdismaxSearchQuery)
+    """
+    if not keywords or not fields:
+        return EmptySearchQuerySet()
+
+    if queryset is None:
+        if EdismaxSearchQuery is None or settings.HAYSTACK_SEARCH_ENGINE != 'solr':
+            return None
+        queryset = SearchQuerySet(query=EdismaxSearchQuery())
+    elif EdismaxSearchQuery is None or not isinstance(queryset.query, EdismaxSearchQuery):
+        return None
+
+    terms = []
+    for keyword in keywords:
+        prefix = ''
+        if keyword.startswith('-') and len(keyword) > 1:
+            prefix = '-'
+            keyword = keyword[1:]
+        if ' ' in keyword:
+            # phrases are already cleaned by `parse_keywords`
+            keyword = '"%s"' % keyword
+        else:
+            keyword = queryset.query.clean(keyword)
+        terms.append(prefix + keyword)
+
+    queryset = queryset._clone()
+    queryset.query.set_edismax(' '.join(terms), get_query_fields(model, fields))
+    return queryset
@@ -3,6 +3,8 @@
 from django.conf.urls.defaults import *
 from django.shortcuts import HttpResponsePermanentRedirect
 
+from search.views import autocomplete
+
 def redirect_search(request, search_type, options=None):
     if not options:
         options = ()
@@ -25,5 +27,6 @@ def redirect_search_accounts(request):
 
 urlpatterns = patterns('',
     url(r'^$', redirect_search_repositories, name='search'),
+    url(r'^autocomplete/$', autocomplete, name='search_autocomplete'),
     url(r'^users/$', redirect_search_accounts, name='search_accounts'),
 )
@@ -11,8 +11,12 @@ from saved_searches.views import SavedSearchView as BaseSearchView
 from saved_searches.models import SavedSearch
 from browsecap.browser import is_crawler
 
+from core import autocomplete as core_autocomplete
 from core.models import Account, Repository
+from search.cache import CachedSearchResults
+from search.query import make_edismax_query
 from utils.sort import prepare_sort
+from utils.djson.response import JSONResponse
 
 # monkey patch to add simple_str to haystack
 from haystack.models import SearchResult
@@ -52,15 +56,22 @@ def parse_keywords(query_string):
 
     return result
 
-def make_query(fields, keywords, queryset=None):
+def make_query(fields, keywords, queryset=None, model=None):
     """
     Create the query for haystack for searching in `fields ` for documents
     with `keywords`. All keywords are ANDed, and if a keyword starts with a "-"
     all document with it will be excluded.
+    If a `model` is given and solr is used, it's a single edismax query (see
+    search.query)
     """
     if not keywords or not fields:
         return EmptySearchQuerySet()
 
+    if model is not None:
+        edismax_queryset = make_edismax_query(model, fields, keywords, queryset)
+        if edismax_queryset is not None:
+            return edismax_queryset
+
     if not queryset:
         queryset = SearchQuerySet()
 
@@ -93,6 +104,24 @@ def make_query(fields, keywords, queryset=None):
     else:
         return queryset
 
+def autocomplete(request):
+    """
+    Return, in json, the accounts ("type=people") or repositories with a
+    word starting with the "q" parameter, using the autocomplete index in
+    redis (see core.autocomplete)
+    """
+    model_name = 'account' if request.GET.get('type') == 'people' else 'repository'
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+
+    return JSONResponse(dict(
+        q = query,
+        results = core_autocomplete.search(model_name, query, limit),
+    ))
+
 class PurePaginationSearchView(BaseSearchView):
 
     def build_page(self):
@@ -146,7 +175,7 @@ class CoreSearchView(PurePaginationSearchView):
         query = self.get_query()
         if query:
             keywords = parse_keywords(self.get_query())
-            queryset = make_query(self.search_fields, keywords)
+            queryset = make_query(self.search_fields, keywords, model=self.model)
 
             queryset = queryset.models(self.model)
 
@@ -158,6 +187,19 @@ class CoreSearchView(PurePaginationSearchView):
         else:
             return EmptySearchQuerySet()
 
+    def get_cached_results(self, queryset, *key_parts):
+        """
+        Return the results of the given queryset, using a cache if we have
+        results (see search.cache). `key_parts` are data, other than the query
+        and the sort, used to make this search unique.
+        """
+        if isinstance(queryset, EmptySearchQuerySet):
+            return queryset
+        sort = self.get_sort()
+        key_parts = (self.search_key, parse_keywords(self.get_query()), sort['db_sort'] if sort else None) + key_parts
+        return CachedSearchResults(queryset, self.model.model_name, key_parts,
+                fields=('get_absolute_url', 'modified', 'internal_score'))
+
     def extra_context(self):
         """
         Add sorting infos in context
@@ -214,6 +256,8 @@ class RepositorySearchView(CoreSearchView):
             if not show_forks:
                 result = result.exclude(is_fork=True)
 
+            result = self.get_cached_results(result, show_forks)
+
         return result
 
     def save_search(self, page):
@@ -270,3 +314,9 @@ class AccountSearchView(CoreSearchView):
         name = 'slug_sort',
     )
     search_fields = ('slug', 'slug_sort', 'name', )
+
+    def get_results(self):
+        """
+        Use the cache for results
+        """
+        return self.get_cached_results(super(AccountSearchView, self).get_results())
@@ -255,9 +255,38 @@ HAYSTACK_SITECONF = 'project.search_sites'
 HAYSTACK_SEARCH_ENGINE = 'solr'
 HAYSTACK_SEARCH_RESULTS_PER_PAGE = 20
 HAYSTACK_INCLUDE_SPELLING = True
+# to use the embedded search engine instead of solr (no server needed, but
+# slower and without tag facets), set HAYSTACK_SEARCH_ENGINE to
+# 'search.embedded' (see search/embedded_backend.py)
+HAYSTACK_WHOOSH_PATH = os.path.normpath(os.path.join(PROJECT_PATH, '..', 'whoosh_index'))
 # solr
 HAYSTACK_SOLR_URL = 'http://url/to/solr'
 SOLR_MAX_IN = 1900
+# commit when there is this number of pending writes...
+SEARCH_COMMIT_MAX_PENDING = 1000
+# ...or when the oldest pending write is older than this number of seconds
+SEARCH_COMMIT_MAX_DELAY = 10
+# use soft commits (solr 4+), faster but not persisted on disk
+SEARCH_COMMIT_SOFT = False
+# number of results of a search kept in cache (in order to serve the first
+# pages without querying solr), and for how long (in seconds)
+SEARCH_RESULTS_CACHE_SIZE = 200
+SEARCH_RESULTS_CACHE_TIMEOUT = 60 * 15
+# max number of tags to display to narrow a search
+SEARCH_TAG_FACETS_LIMIT = 20
+# max number of matching terms read in the autocomplete index (redis >= 2.8.9)
+AUTOCOMPLETE_MAX_CANDIDATES = 200
+# prefixes up to this length have their objects sorted by score in the
+# autocomplete index
+AUTOCOMPLETE_PREFIX_LENGTH = 3
+# max number of pages of AUTOCOMPLETE_MAX_CANDIDATES objects read for a long
+# prefix matching many terms
+AUTOCOMPLETE_MAX_PAGES = 5
+# max length of the digest of readmes, indexed instead of the full readmes
+README_DIGEST_MAX_LENGTH = 2000
+# how long (in seconds) the tag clouds of the dashboard are cached (they are
+# invalidated when the private tags of the user change)
+USER_TAGS_CACHE_TIMEOUT = 60 * 60 * 24 * 7
 
 # pagination
 ACCOUNTS_PER_PAGE = 50
@@ -326,9 +355,27 @@ WORKER_FETCH_FULL_ERROR_KEY = 'fetch_full_error'
 
 WORKER_UPDATE_RELATED_DATA_KEY = 'update_related_data'
 WORKER_UPDATE_RELATED_DATA_SET_KEY = 'update_related_data_set'
+WORKER_UPDATE_RELATED_DATA_STATS_KEY = 'update_related_data_stats'
+# search document only (relations changed), done by the same worker
+WORKER_UPDATE_SEARCH_INDEX_KEY = 'update_search_index'
+WORKER_UPDATE_SEARCH_INDEX_SET_KEY = 'update_search_index_set'
 
 WORKER_UPDATE_COUNT_KEY = 'update_count'
 
+WORKER_SEARCH_COMMIT_KEY = 'search_commit_pending'
+WORKER_SEARCH_COMMIT_STATS_KEY = 'search_commit_stats'
+SEARCH_INDEX_GENERATION_KEY = 'search_index_generation:%s'
+
+# official tags: generation, log of changes, and last generation removed
+# from the log (see tagging.models.all_official_tags)
+OFFICIAL_TAGS_GENERATION_KEY = 'official_tags:generation'
+OFFICIAL_TAGS_LOG_KEY = 'official_tags:log'
+OFFICIAL_TAGS_TRIMMED_KEY = 'official_tags:trimmed'
+OFFICIAL_TAGS_LOG_SIZE = 1000
+
+# version of the private tags of each user (see tagging.models.private_tags_version)
+PRIVATE_TAGS_VERSION_KEY = 'private_tags:version:%d'
+
 # sentry
 SENTRY_DSN = None
 SENTRY_PUBLIC_DSN = None
@@ -0,0 +1,274 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection as db_connection, transaction
+from django.db.models import Max, Min, Q
+
+from redisco import connection
+
+from core.models import Repository
+from tagging.managers import prepare_tag
+from tagging.models import Tag, official_tags_changed
+from tagging.words import repository_to_words, manage_synonyms, sort_words, synonyms, text_types
+
+
+def unique(values):
+    """
+    Yield the given values, without duplicates, in the same order
+    """
+    seen = set()
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            yield value
+
+
+def close_connections():
+    """
+    Close the database and redis connections of the parent process before
+    creating the processes, so they do not inherit (and share) them. The
+    parent reopens them when needed
+    """
+    db_connection.close()
+    connection.connection_pool.disconnect()
+
+
+def init_process():
+    """
+    Each process must use its own database and redis connections, not the
+    ones of the parent process. Only forget the database one if any: closing
+    it would also end the session of the parent on the server
+    """
+    db_connection.connection = None
+
+
+def spill(words, directory):
+    """
+    Write the given words, sorted, with their weight in a new file in the
+    given directory, and return its name
+    """
+    fd, filename = tempfile.mkstemp(suffix='.words', dir=directory)
+    spill_file = os.fdopen(fd, 'w')
+    try:
+        for word, weight in sorted((word.encode('utf-8'), weight) for word, weight in words.iteritems()):
+            spill_file.write('%s\t%r\n' % (word, weight))
+    finally:
+        spill_file.close()
+    return filename
+
+
+def read_spill(filename):
+    """
+    Yield the (word, weight) saved in the given file, sorted by word
+    """
+    spill_file = open(filename)
+    try:
+        for line in spill_file:
+            word, weight = line.rstrip('\n').rsplit('\t', 1)
+            yield word, float(weight)
+    finally:
+        spill_file.close()
+
+
+def count_chunk(args):
+    """
+    Map: count the words of the repositories with a pk in the range [start,
+    end[, loaded by batches of `batch_size` repositories. The words are
+    written to sorted files in `directory` each time there are more than
+    `spill_size` of them in memory.
+    Return the chunk, the number of repositories, the files, and an error (or
+    None)
+    """
+    start, end, batch_size, spill_size, directory = args
+
+    nb, files, words = 0, [], {}
+    try:
+        queryset = Repository.objects.filter(deleted=False).order_by('pk').values('pk', *text_types.keys())
+        current = start
+        while current < end:
+            repositories = list(queryset.filter(pk__gte=current, pk__lt=end)[:batch_size])
+            if not repositories:
+                break
+            for repository in repositories:
+                repository_to_words(repository, words, False, True)
+            nb += len(repositories)
+            current = repositories[-1]['pk'] + 1
+            if len(words) >= spill_size:
+                files.append(spill(words, directory))
+                words = {}
+        if words:
+            files.append(spill(words, directory))
+    except Exception, e:
+        return start, 0, files, '%s' % e
+
+    return start, nb, files, None
+
+
+class Command(BaseCommand):
+    """
+    Build the official tags from the words of all repositories, as described
+    in tagging.words, but as a map-reduce:
+        - map: the pk range of repositories is split in chunks, and many
+          processes count the words of each chunk, writing them in sorted
+          files when there are too many words in memory
+        - reduce: all files are merged, the weights of each word are summed,
+          synonyms are managed, and the words with a weight greater than
+          `--limit` are kept
+        - then tags are inserted in bulk (existing ones are set as official)
+    """
+    help = 'Create the official tags from the words of all repositories'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', type='int', dest='limit', default=2500,
+            help='Minimum weight of a word to be a tag (default: 2500)'),
+        make_option('--processes', type='int', dest='processes', default=4,
+            help='Number of processes (default: 4)'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=20000,
+            help='Number of pks by chunk, the unit of work of a process (default: 20000)'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+            help='Number of repositories loaded at once (default: 1000)'),
+        make_option('--spill-size', type='int', dest='spill_size', default=200000,
+            help='Number of words kept in memory by a process before writing them to disk (default: 200000)'),
+        make_option('--tmp-dir', dest='tmp_dir', default=None,
+            help='Directory for the temporary files (default: the system one)'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only display the tags, do not save them'),
+    )
+
+    def log(self, message):
+        sys.stderr.write('[%s] %s\n' % (datetime.utcnow(), message))
+
+    def get_chunks(self, chunk_size):
+        """
+        Return the list of chunks (start, end) of repositories pks
+        """
+        bounds = Repository.objects.aggregate(min=Min('pk'), max=Max('pk'))
+        if bounds['min'] is None:
+            return []
+        first = bounds['min'] - bounds['min'] % chunk_size
+        return [(start, start + chunk_size) for start in xrange(first, bounds['max'] + 1, chunk_size)]
+
+    def map(self, chunks, processes, batch_size, spill_size, directory):
+        """
+        Count the words of all chunks in many processes and return the list of
+        files with the counts
+        """
+        tasks = [(start, end, batch_size, spill_size, directory) for start, end in chunks]
+
+        start_time = datetime.utcnow()
+        all_files = []
+        nb_repositories = nb_chunks = nb_errors = 0
+
+        close_connections()
+        pool = Pool(processes, init_process)
+        try:
+            for start, nb, files, error in pool.imap_unordered(count_chunk, tasks):
+                nb_chunks += 1
+                all_files.extend(files)
+                if error:
+                    nb_errors += 1
+                    self.log('ERROR in chunk starting at %d: %s' % (start, error))
+                    continue
+                nb_repositories += nb
+                duration = datetime.utcnow() - start_time
+                seconds = duration.days * 86400 + duration.seconds + duration.microseconds / 1000000.0
+                self.log('chunk %d/%d done, %d repositories in %s (%.1f repositories/sec, %d files)' % (
+                    nb_chunks, len(chunks), nb_repositories, duration, nb_repositories / (seconds or 1), len(all_files)))
+        finally:
+            pool.close()
+            pool.join()
+
+        if nb_errors:
+            raise CommandError('%d chunks in error' % nb_errors)
+
+        return all_files
+
+    def reduce(self, files, limit):
+        """
+        Merge the sorted files, summing the weights of each word, and return
+        the words with a weight greater than `limit` (synonyms are always
+        kept, as they can increase the weight of another word)
+        """
+        keep_anyway = set(word.encode('utf-8') for word in set(synonyms) | set(synonyms.values()))
+
+        words = {}
+        current_word, current_weight, nb_words = None, 0, 0
+        for word, weight in heapq.merge(*[read_spill(filename) for filename in files]):
+            if word != current_word:
+                if current_word is not None and (current_weight > limit or current_word in keep_anyway):
+                    words[current_word.decode('utf-8')] = current_weight
+                current_word, current_weight = word, 0
+                nb_words += 1
+            current_weight += weight
+        if current_word is not None and (current_weight > limit or current_word in keep_anyway):
+            words[current_word.decode('utf-8')] = current_weight
+
+        self.log('%d distinct words' % nb_words)
+        manage_synonyms(words, False)
+        return sort_words(words, limit=limit, return_format='tuple')
+
+    @transaction.commit_on_success
+    def save_tags(self, tags, batch_size):
+        """
+        Set the existing tags as official, and insert the other ones in bulk.
+        As in `tagging.words.add_tags`, the word is used as name and slug
+        (not a slugified version, which could be the same for two words).
+        Return the number of updated and created tags, and the slugs of the
+        new official tags, to log once committed
+        """
+        tags = list(unique(prepare_tag(tag) for tag in tags))
+        existing = Tag.objects.filter(Q(name__in=tags) | Q(slug__in=tags))
+        existing_ids, existing_values, updated_slugs = [], set(), []
+        for tag_id, name, slug, official in existing.values_list('id', 'name', 'slug', 'official'):
+            existing_ids.append(tag_id)
+            existing_values.update((name, slug))
+            if not official:
+                updated_slugs.append(slug)
+        updated = Tag.objects.filter(id__in=existing_ids, official=False).update(official=True)
+
+        quote = db_connection.ops.quote_name
+        new_tags = [tag for tag in tags if tag not in existing_values]
+        cursor = db_connection.cursor()
+        for index in xrange(0, len(new_tags), batch_size):
+            batch = new_tags[index:index + batch_size]
+            cursor.execute('INSERT INTO %s (%s, %s, %s) VALUES %s' % (
+                quote(Tag._meta.db_table),
+                quote('name'), quote('slug'), quote('official'),
+                ', '.join(['(%s, %s, %s)'] * len(batch)),
+            ), sum([[tag, tag, True] for tag in batch], []))
+
+        return updated, len(new_tags), updated_slugs + new_tags
+
+    def handle(self, *args, **options):
+        chunks = self.get_chunks(options['chunk_size'])
+        self.log('%d chunks to count' % len(chunks))
+        if not chunks:
+            return
+
+        directory = tempfile.mkdtemp(prefix='mine_tags_', dir=options['tmp_dir'])
+        try:
+            files = self.map(chunks, options['processes'], options['batch_size'], options['spill_size'], directory)
+            self.log('merging %d files' % len(files))
+            words = self.reduce(files, options['limit'])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        self.log('%d tags found' % len(words))
+        if options['dry_run']:
+            for word, weight in words:
+                self.stdout.write('%s\t%.2f\n' % (word, weight))
+            return
+
+        updated, created, added = self.save_tags([word for word, weight in words], options['batch_size'])
+        # logged only now that they are committed, for all processes
+        official_tags_changed(added=added)
+        self.log('%d tags created, %d existing tags set as official' % (created, updated))
@@ -0,0 +1,95 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+import random
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from tagging import words
+from tagging.models import all_official_tags
+
+
+class Command(BaseCommand):
+    """
+    Compare the original tokenizer and tags finder (see tagging.words) with
+    the regex tokenizer and the TagMatcher on a synthetic corpus of
+    repositories (or on real ones), and check that the results are the same.
+    """
+    help = 'Benchmark the tokenizer and the tags finder of tagging.words'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--repositories', type='int', dest='nb_repositories', default=20000,
+            help='Number of synthetic repositories (default: 20000)'),
+        make_option('--real', action='store_true', dest='real', default=False,
+            help='Use real repositories and official tags from the database'),
+        make_option('--seed', type='int', dest='seed', default=42,
+            help='Seed of the random generator (default: 42)'),
+    )
+
+    def make_corpus(self, nb_repositories, seed):
+        """
+        Return a list of synthetic repositories (as dicts) and a set of tags.
+        Texts are made of tags, synonyms, and random words (with upper case
+        letters, digits, accents and punctuation)
+        """
+        rand = random.Random(seed)
+        alphabet = u'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 -_.,:/\xe9\xc9\xe7'
+        vocabulary = list(set(words.synonyms) | set(words.synonyms.values()))
+        tags = set(rand.sample(vocabulary, len(vocabulary) / 2))
+
+        def make_text(nb_words):
+            parts = []
+            for i in xrange(nb_words):
+                if rand.random() < 0.2:
+                    parts.append(rand.choice(vocabulary))
+                else:
+                    parts.append(u''.join(rand.choice(alphabet) for j in xrange(rand.randint(2, 12))))
+            return u' '.join(parts)
+
+        repositories = [dict(
+            slug = make_text(rand.randint(1, 3)),
+            description = make_text(rand.randint(0, 30)),
+            readme_digest = make_text(rand.randint(0, 200)),
+        ) for i in xrange(nb_repositories)]
+        return repositories, tags
+
+    def get_real_corpus(self, nb_repositories):
+        """
+        Return the first repositories (as dicts) and the official tags
+        """
+        from core.models import Repository
+        repositories = list(Repository.objects.filter(deleted=False).values(
+            *words.text_types.keys())[:nb_repositories])
+        return repositories, all_official_tags()
+
+    def timed(self, function, repositories, *args):
+        start = time.time()
+        results = [function(repository, *args) for repository in repositories]
+        return time.time() - start, results
+
+    def handle(self, *args, **options):
+        if options['real']:
+            repositories, tags = self.get_real_corpus(options['nb_repositories'])
+        else:
+            repositories, tags = self.make_corpus(options['nb_repositories'], options['seed'])
+        self.stdout.write('%d repositories, %d tags\n' % (len(repositories), len(tags)))
+
+        texts = [repository[text_type] for repository in repositories for text_type in words.text_types
+                 if repository.get(text_type)]
+        for name, function in (('loop tokenizer', words._split_into_words_loop),
+                               ('regex tokenizer', words.split_into_words)):
+            start = time.time()
+            for text in texts:
+                function(text)
+            self.stdout.write('%-20s %8.2f s\n' % (name, time.time() - start))
+
+        words.get_tag_matcher(tags)
+        duration_dict, results_dict = self.timed(words._get_tags_for_repository_dict, repositories, tags, True)
+        self.stdout.write('%-20s %8.2f s\n' % ('words dict', duration_dict))
+        duration_matcher, results_matcher = self.timed(words.get_tags_for_repository, repositories, tags, True)
+        self.stdout.write('%-20s %8.2f s\n' % ('tag matcher', duration_matcher))
+
+        differences = sum(1 for result_dict, result_matcher in zip(results_dict, results_matcher)
+                          if result_dict != result_matcher)
+        self.stdout.write('%d different results\n' % differences)
@@ -1,8 +1,12 @@
 # Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
 
+from django.db import connection, transaction
+
 from taggit.managers import TaggableManager as BaseTaggableManager, _TaggableManager as _BaseTaggableManager
 from taggit.utils import require_instance_manager
 
+from tagging.signals import tags_set
+
 class TaggableManager(BaseTaggableManager):
     """
     We must subclass it to use our own manager
@@ -30,6 +34,23 @@ def prepare_tag(tag):
     return tag.strip().lower()
 
 
+def tags_differences(existing, wanted, default_weight):
+    """
+    Return what to write to go from the `existing` tags of an object (a dict
+    with, for each tag id, a tuple with the id of the through row and the
+    weight) to the `wanted` ones (a dict with the weight for each tag id,
+    None or 0 for the default weight): the ids of the rows to delete, a dict
+    with the new weight of the rows to update, and a dict with the weight of
+    the tags to insert
+    """
+    wanted = dict((tag_id, weight or default_weight) for tag_id, weight in wanted.items())
+    to_delete = [item_id for tag_id, (item_id, weight) in existing.items() if tag_id not in wanted]
+    to_update = dict((existing[tag_id][0], weight) for tag_id, weight in wanted.items()
+        if tag_id in existing and existing[tag_id][1] != weight)
+    to_insert = dict((tag_id, weight) for tag_id, weight in wanted.items() if tag_id not in existing)
+    return to_delete, to_update, to_insert
+
+
 class _TaggableManager(_BaseTaggableManager):
     """
     Manager to use add, set... with a weight for each tag
@@ -43,16 +64,11 @@ class _TaggableManager(_BaseTaggableManager):
         result.update(filters)
         return result
 
-    @require_instance_manager
-    def add(self, tags, **filters):
+    def _prepare_tags(self, tags):
         """
-        Add a LIST of tags.
-        Each tag can be :
-        - a Tag object, eventually with a weight added field
-        - a tuple with a tag and a weight, the tag can be:
-            - a Tag object (weight will be the default one)
-            - a string
-        - a string (weight will be the default one)
+        Return a dict with, for each name, a tuple with the Tag object and the
+        weight, for the given LIST of tags (see `add`). Missing tags are
+        created.
         """
         if isinstance(tags, dict):
             tags = tags.items()
@@ -90,6 +106,21 @@ class _TaggableManager(_BaseTaggableManager):
                 weight
             )
 
+        return obj_tags
+
+    @require_instance_manager
+    def add(self, tags, **filters):
+        """
+        Add a LIST of tags.
+        Each tag can be :
+        - a Tag object, eventually with a weight added field
+        - a tuple with a tag and a weight, the tag can be:
+            - a Tag object (weight will be the default one)
+            - a string
+        - a string (weight will be the default one)
+        """
+        obj_tags = self._prepare_tags(tags)
+
         for slug, tag in obj_tags.items():
             defaults = {}
             if tag[1]:
@@ -105,8 +136,67 @@ class _TaggableManager(_BaseTaggableManager):
 
     @require_instance_manager
     def set(self, tags, **filters):
-        self.clear(**filters)
-        self.add(tags, **filters)
+        """
+        Set the LIST of tags (see `add`), replacing the existing ones, with the
+        same result as a `clear` followed by an `add` (tags without weight get
+        the default one), but only the differences are written: one query to
+        delete the removed tags, one to update the changed weights, one to
+        insert the new tags, and nothing if nothing changed.
+        No post_save/post_delete are sent for the rows, but one `tags_set`
+        signal (see `tagging.signals`) with all the changes.
+        """
+        default_weight = self.through._meta.get_field('weight').get_default()
+        wanted = dict((tag.pk, weight) for tag, weight in self._prepare_tags(tags).values())
+
+        lookup = self._lookup_kwargs(**filters)
+        existing = dict((tag_id, (item_id, weight)) for item_id, tag_id, weight in
+            self.through.objects.filter(**lookup).values_list('id', 'tag_id', 'weight'))
+
+        to_delete, to_update, to_insert = tags_differences(existing, wanted, default_weight)
+
+        if not (to_delete or to_update or to_insert):
+            return
+
+        cursor = connection.cursor()
+        table = connection.ops.quote_name(self.through._meta.db_table)
+
+        if to_delete:
+            cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+                table,
+                connection.ops.quote_name('id'),
+                ', '.join(['%s'] * len(to_delete)),
+            ), to_delete)
+
+        if to_update:
+            cursor.execute('UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (
+                table,
+                connection.ops.quote_name('weight'),
+                connection.ops.quote_name('id'),
+                ' '.join(['WHEN %s THEN %s'] * len(to_update)),
+                connection.ops.quote_name('id'),
+                ', '.join(['%s'] * len(to_update)),
+            ), sum(to_update.items(), ()) + tuple(to_update.keys()))
+
+        if to_insert:
+            fields = [field for field in self.through._meta.local_fields if not field.primary_key]
+            rows = []
+            for tag_id, weight in to_insert.items():
+                item = self.through(tag_id=tag_id, weight=weight, **lookup)
+                rows.append([field.get_db_prep_save(field.pre_save(item, True), connection=connection)
+                    for field in fields])
+            cursor.execute('INSERT INTO %s (%s) VALUES %s' % (
+                table,
+                ', '.join(connection.ops.quote_name(field.column) for field in fields),
+                ', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(rows)),
+            ), sum(rows, []))
+
+        transaction.commit_unless_managed()
+
+        items_tags = dict((item_id, tag_id) for tag_id, (item_id, weight) in existing.items())
+        tags_set.send(sender=self.through, instance=self.instance, lookup=lookup,
+            added=to_insert.keys(),
+            updated=[items_tags[item_id] for item_id in to_update],
+            removed=[items_tags[item_id] for item_id in to_delete])
 
     @require_instance_manager
     def remove(self, tags, **filters):
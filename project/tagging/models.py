@@ -1,8 +1,15 @@
 # Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
 
-from django.db import models
+from threading import local
+
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.conf import settings
 from django.contrib.auth.models import User
 
+from redisco import connection
+
 from taggit.models import ItemBase, TagBase
 
 from core.core_utils import slugify as core_slugify
@@ -21,9 +28,25 @@ class Tag(TagBase):
             slug += "_%d" % i
         return slug
 
+    def __init__(self, *args, **kwargs):
+        super(Tag, self).__init__(*args, **kwargs)
+        # a new tag was never official
+        self._was_official = self.official if self.pk else False
+
     def save(self, *args, **kwargs):
         self.name = prepare_tag(self.name)
         super(Tag, self).save(*args, **kwargs)
+        if self.official != self._was_official:
+            if self.official:
+                official_tags_changed_after_commit(added=[self.slug])
+            else:
+                official_tags_changed_after_commit(removed=[self.slug])
+            self._was_official = self.official
+
+@receiver(post_delete, sender=Tag, dispatch_uid='tagging.models.OfficialTagDeleted')
+def OfficialTagDeleted(sender, instance, **kwargs):
+    if instance.official:
+        official_tags_changed_after_commit(removed=[instance.slug])
 
 class BaseTaggedItem(ItemBase):
     weight = models.FloatField(blank=True, null=True, default=1)
@@ -68,11 +91,135 @@ class PrivateTaggedRepository(PrivateTaggedItem):
     tag = models.ForeignKey(Tag, related_name="private_repository_tags")
     content_object = models.ForeignKey('core.Repository')
 
+def private_tags_version(user_id):
+    """
+    Return the current version of the private tags of the given user, to use
+    in the keys of caches built from them
+    """
+    return int(connection.get(settings.PRIVATE_TAGS_VERSION_KEY % user_id) or 0)
+
+def private_tags_changed(user_id):
+    """
+    Change the version of the private tags of the given user, to invalidate
+    all caches built from them
+    """
+    connection.incr(settings.PRIVATE_TAGS_VERSION_KEY % user_id)
+
+# Lua script to log changes of official tags (ARGV: max size of the log,
+# then "+slug" or "-slug" for each change), with a new generation. Atomic,
+# so a generation is never visible before its changes
+LOG_OFFICIAL_TAGS_CHANGES = """
+    local generation = redis.call('INCR', KEYS[1])
+    for i = 2, #ARGV do
+        redis.call('ZADD', KEYS[2], generation, ARGV[i])
+    end
+    local to_remove = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[1])
+    if to_remove > 0 then
+        local removed = redis.call('ZRANGE', KEYS[2], to_remove - 1, to_remove - 1, 'WITHSCORES')
+        redis.call('SET', KEYS[3], removed[2])
+        redis.call('ZREMRANGEBYRANK', KEYS[2], 0, to_remove - 1)
+    end
+    return generation
+"""
+
+def official_tags_changed(added=(), removed=()):
+    """
+    Log that the given slugs were added to/removed from the official tags,
+    so all processes will update their vocabulary (see `all_official_tags`)
+    """
+    changes = ['+%s' % slug for slug in added] + ['-%s' % slug for slug in removed]
+    if not changes:
+        return
+    connection.eval(LOG_OFFICIAL_TAGS_CHANGES, 3,
+        settings.OFFICIAL_TAGS_GENERATION_KEY,
+        settings.OFFICIAL_TAGS_LOG_KEY,
+        settings.OFFICIAL_TAGS_TRIMMED_KEY,
+        settings.OFFICIAL_TAGS_LOG_SIZE,
+        *changes)
+
+# changes of official tags done in a managed transaction, for each thread,
+# logged once it's committed (see `official_tags_changed_after_commit`)
+_pending_official_tags_changes = local()
+
+def official_tags_changed_after_commit(added=(), removed=()):
+    """
+    Call `official_tags_changed` now if not in a managed transaction (the
+    changes are already committed), else keep the changes until the
+    transaction is committed (or rolled back), so other processes never load
+    the official tags without them (see `_log_pending_after`)
+    """
+    if not transaction.is_managed():
+        official_tags_changed(added, removed)
+        return
+    if not hasattr(_pending_official_tags_changes, 'changes'):
+        _pending_official_tags_changes.changes = []
+    _pending_official_tags_changes.changes.append((added, removed))
+
+def log_pending_official_tags_changes(discard=False):
+    """
+    Log (or discard if the transaction was rolled back) the changes kept by
+    `official_tags_changed_after_commit`, in the same order
+    """
+    changes = getattr(_pending_official_tags_changes, 'changes', None)
+    _pending_official_tags_changes.changes = []
+    if changes and not discard:
+        for added, removed in changes:
+            official_tags_changed(added, removed)
+
+def _log_pending_after(function, discard=False):
+    """
+    Wrap a function ending a transaction (`commit` or `rollback`) to log (or
+    discard) the pending changes of official tags once it's done
+    """
+    def wrapper(*args, **kwargs):
+        result = function(*args, **kwargs)
+        log_pending_official_tags_changes(discard=discard)
+        return result
+    wrapper.logs_official_tags = True
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+# monkey patch the transaction functions, also used by the transaction
+# decorators, to log the pending changes when the transaction ends, in
+# requests as in workers or commands
+if not getattr(transaction.commit, 'logs_official_tags', False):
+    transaction.commit = _log_pending_after(transaction.commit)
+    transaction.rollback = _log_pending_after(transaction.rollback, discard=True)
+
+def official_tags_generation():
+    """
+    Return the current generation of the official tags (see
+    `official_tags_changed`)
+    """
+    return int(connection.get(settings.OFFICIAL_TAGS_GENERATION_KEY) or 0)
+
 def all_official_tags():
     """
     Return (and cache) the list of all official tags (as a set of slugs)
+    The cache is shared by all calls in the process, with the generation of
+    the vocabulary when it was loaded. At each call, the current generation
+    is read in redis, and if it changed, the logged changes since the
+    cached generation are applied (or, if they are not in the log anymore,
+    all tags are loaded again).
+    A new set is returned after a change (see `tagging.words.get_tag_matcher`)
     """
-    if not all_official_tags._cache:
-        all_official_tags._cache = set(Tag.objects.filter(official=True).values_list('slug', flat=True))
-    return all_official_tags._cache
+    generation = official_tags_generation()
+    cache = all_official_tags._cache
+    if cache is not None and cache[0] == generation:
+        return cache[1]
+
+    if cache is not None and cache[0] >= int(connection.get(settings.OFFICIAL_TAGS_TRIMMED_KEY) or 0):
+        tags = set(cache[1])
+        changes = connection.zrangebyscore(settings.OFFICIAL_TAGS_LOG_KEY, '(%d' % cache[0], '+inf', withscores=True)
+        for change, change_generation in changes:
+            if change[0] == '+':
+                tags.add(change[1:])
+            else:
+                tags.discard(change[1:])
+            generation = max(generation, int(change_generation))
+    else:
+        tags = set(Tag.objects.filter(official=True).values_list('slug', flat=True))
+
+    all_official_tags._cache = (generation, tags)
+    return tags
 all_official_tags._cache = None
@@ -0,0 +1,10 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+from django.dispatch import Signal
+
+# Sent by `tagging.managers._TaggableManager.set`, with the through model as
+# sender, once the differences are written (without post_save/post_delete
+# for each row). `instance` is the tagged object, `lookup` the filters of its
+# rows (with the owner for private tags), and `added`, `updated` and
+# `removed` the ids of the tags concerned by each change
+tags_set = Signal(providing_args=['instance', 'lookup', 'added', 'updated', 'removed'])
@@ -0,0 +1,6 @@
+-- Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+-- Indexes for hot queries on private tags, installed by syncdb (or "manage.py sqlcustom tagging")
+
+-- tags of a user for a list of objects (prepare_private), and objects of a user with a tag
+CREATE INDEX tagging_privatetaggedaccount_owner_object ON tagging_privatetaggedaccount (owner_id, content_object_id);
+CREATE INDEX tagging_privatetaggedaccount_owner_tag ON tagging_privatetaggedaccount (owner_id, tag_id);
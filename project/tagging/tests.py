@@ -1,16 +1,107 @@
-"""
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
+# -*- coding: utf-8 -*-
 
-Replace this with more appropriate tests for your application.
-"""
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
 
-from django.test import TestCase
+import random
 
+from django.utils import unittest
 
-class SimpleTest(TestCase):
-    def test_basic_addition(self):
-        """
-        Tests that 1 + 1 always equals 2.
-        """
-        self.assertEqual(1 + 1, 2)
+from tagging import words
+from tagging.managers import tags_differences
+
+
+class WordsTest(unittest.TestCase):
+    """
+    Check that the regex tokenizer and the tag matcher give exactly the same
+    results as the original implementations, on a synthetic corpus
+    """
+    alphabet = u'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 -_.,:/éÉçÀΣσǅ'
+    extra_words = ('django', 'python', 'Django', 'ExtJs', 'HTTPServer', 'jQuery', 'lang', 'language', 'app')
+
+    def setUp(self):
+        self.random = random.Random(42)
+        self.vocabulary = list(words.synonyms) + list(set(words.synonyms.values())) + list(self.extra_words)
+
+    def make_text(self, nb_words, as_unicode=True):
+        parts = []
+        for i in range(nb_words):
+            if self.random.random() < 0.5:
+                parts.append(self.random.choice(self.vocabulary))
+            else:
+                parts.append(u''.join(self.random.choice(self.alphabet) for j in range(self.random.randint(1, 10))))
+        text = u' '.join(parts)
+        if not as_unicode:
+            text = text.encode('utf-8')
+        return text
+
+    def make_repository(self, as_unicode=True):
+        return dict(
+            slug = self.make_text(3, as_unicode),
+            description = self.make_text(20, as_unicode),
+            readme_digest = self.make_text(60, as_unicode),
+        )
+
+    def test_split_examples(self):
+        self.assertEqual(words.split_into_words('some ExtJs addons'), ['ext', 'js', 'addons'])
+        self.assertEqual(words.split_into_words(u'HTTPServer 2 JSON-rpc'), ['server', 'rpc'])
+        self.assertEqual(words.split_into_words(u'ÉtéCool'), [u'ét', u'cool'])
+
+    def test_split_is_identical(self):
+        for i in range(2000):
+            text = self.make_text(self.random.randint(0, 30), as_unicode=i % 2 == 0)
+            self.assertEqual(words.split_into_words(text), words._split_into_words_loop(text), text)
+
+    def test_tags_are_identical(self):
+        tags = set(self.random.sample(self.vocabulary, 80))
+        for i in range(1000):
+            repository = self.make_repository(as_unicode=i % 2 == 0)
+            self.assertEqual(
+                words.get_tags_for_repository(repository, tags, repository_is_dict=True),
+                words._get_tags_for_repository_dict(repository, tags, repository_is_dict=True),
+            )
+
+    def test_synonyms_chains(self):
+        # "notifications" => "notification" => "notify": the result must not
+        # depend on the order of the words in the dicts
+        repository = dict(description='notification notifications adpoi eexxedsy mqui snippet python eujqzhd')
+        for tags in (set(['notification']), set(['notify']), set(['notification', 'notify', 'python'])):
+            result = words.get_tags_for_repository(repository, tags, repository_is_dict=True)
+            self.assertEqual(result, words._get_tags_for_repository_dict(repository, tags, repository_is_dict=True))
+        self.assertEqual(words.get_tags_for_repository(repository, set(['notification']), True), {})
+        self.assertEqual(words.get_tags_for_repository(repository, set(['notify']), True), dict(notify=0.2))
+
+    def test_matcher_cache(self):
+        tags = set(['django', 'python'])
+        matcher = words.get_tag_matcher(tags)
+        self.assertTrue(words.get_tag_matcher(tags) is matcher)
+        tags.add('app')
+        self.assertFalse(words.get_tag_matcher(tags) is matcher)
+        self.assertEqual(words.get_tags_for_repository(dict(slug='my-apps'), tags, True), dict(app=20))
+
+
+class SetDifferencesTest(unittest.TestCase):
+    """
+    Check what `_TaggableManager.set` writes (see `tags_differences`):
+    existing tags are {tag id: (row id, weight)}, wanted ones {tag id: weight}
+    """
+    existing = {1: (10, 3), 2: (20, 1)}
+
+    def test_nothing_changed(self):
+        self.assertEqual(tags_differences(self.existing, {1: 3, 2: 1}, 1), ([], {}, {}))
+
+    def test_insert(self):
+        self.assertEqual(tags_differences(self.existing, {1: 3, 2: 1, 3: 2}, 1), ([], {}, {3: 2}))
+        self.assertEqual(tags_differences({}, {1: 3}, 1), ([], {}, {1: 3}))
+
+    def test_update_weight(self):
+        self.assertEqual(tags_differences(self.existing, {1: 5, 2: 1}, 1), ([], {10: 5}, {}))
+
+    def test_delete(self):
+        self.assertEqual(tags_differences(self.existing, {1: 3}, 1), ([20], {}, {}))
+        self.assertEqual(sorted(tags_differences(self.existing, {}, 1)[0]), [10, 20])
+
+    def test_default_weight(self):
+        # a tag without weight has the default one, as with `add`
+        self.assertEqual(tags_differences(self.existing, {1: 3, 2: None}, 1), ([], {}, {}))
+        self.assertEqual(tags_differences(self.existing, {1: None, 2: None, 3: None}, 1),
+            ([], {10: 1}, {3: 1}))
@@ -11,6 +11,7 @@ Usage:
 """
 
 import string
+import sys
 import re
 
 
@@ -298,11 +299,61 @@ synonyms = {
     'wrapping': 'wrap',
 }
 
+def _resolve_synonym(word):
+    """
+    Follow the chain of synonyms (like "notifications" => "notification" =>
+    "notify") and return the last word
+    """
+    seen = set()
+    while word in synonyms and word not in seen:
+        seen.add(word)
+        word = synonyms[word]
+    return word
+
+# each synonym with the word it finally means
+final_synonyms = dict((word, _resolve_synonym(word)) for word in synonyms)
+
+RE_WORDS = re.compile(r'[A-Z][a-z]+|[a-z]{2,}')
+
+def get_unicode_words_regex():
+    """
+    When needed, compute/cache and return the regex used to split unicode
+    texts: same as RE_WORDS, but with all the unicode upper case letters
+    """
+    if get_unicode_words_regex._cache is None:
+        ranges, start, previous = [], None, None
+        for code in xrange(sys.maxunicode + 1):
+            if unichr(code).isupper():
+                if start is None:
+                    start = code
+                previous = code
+            elif start is not None:
+                ranges.append(u'%s-%s' % (unichr(start), unichr(previous)) if previous > start else unichr(start))
+                start = None
+        if start is not None:
+            ranges.append(u'%s-%s' % (unichr(start), unichr(previous)))
+        get_unicode_words_regex._cache = re.compile(u'[%s][a-z]+|[a-z]{2,}' % u''.join(ranges))
+    return get_unicode_words_regex._cache
+get_unicode_words_regex._cache = None
+
 def split_into_words(text):
     """
     Split a text into words. Split words with spaces and capital letters.
     Ignore some predefined words.
     Ex: "some ExtJs addons" => some, ext, js, addons
+    A word is an upper case letter followed by lower case ascii letters, or
+    many lower case ascii letters (all other characters are separators),
+    exactly as the loop in `_split_into_words_loop`, but with a regex.
+    """
+    regex = get_unicode_words_regex() if isinstance(text, unicode) else RE_WORDS
+    ignore_words = get_ignore_words()
+    return [word for word in (word.lower() for word in regex.findall(text)) if word not in ignore_words]
+
+def _split_into_words_loop(text):
+    """
+    The original (slow) version of `split_into_words`, walking the text one
+    character at a time. Kept to check the regex version (see tests and the
+    `words_benchmark` command)
     """
     # TODO : if many upper letter, consider as a whole word
     words, word = [], []
@@ -332,9 +383,9 @@ def split_into_words(text):
         add_word(word)
     return words
 
-text_types = dict(slug=20, description=0.1)
+text_types = dict(slug=20, description=0.1, readme_digest=0.05)
 
-def repository_to_words(repository, words=None, return_words=True, repository_is_dict=False):
+def repository_to_words(repository, words=None, return_words=True, repository_is_dict=False, split=split_into_words):
     """
     Get some text in a repository and get all words (a dict with each word
     with its weight)
@@ -348,7 +399,7 @@ def repository_to_words(repository, words=None, return_words=True, repository_is
             text = getattr(repository, text_type, None)
         if not text:
             continue
-        text_words = set(split_into_words(text))
+        text_words = set(split(text))
         for word in text_words:
             if word not in words:
                 words[word] = 0
@@ -358,20 +409,16 @@ def repository_to_words(repository, words=None, return_words=True, repository_is
 
 def manage_synonyms(words=None, return_words=True):
     """
-    Take a list of words and return it after removing synonyms
+    Take a list of words and return it after removing synonyms.
+    Chains of synonyms are followed to the end (see `final_synonyms`), and
+    synonyms are merged in alphabetical order, so the result doesn't depend
+    on the order of the words in the dict
     """
     if words is None:
         words = {}
-    syns = {}
-    for word, count in words.iteritems():
-        if word in synonyms:
-            syns[word] = count
-    for syn, count in syns.iteritems():
-        good = synonyms[syn]
-        if good not in words:
-            words[good] = 0
-        words[good] += count
-        del words[syn]
+    for syn in sorted(word for word in words if word in final_synonyms):
+        good = final_synonyms[syn]
+        words[good] = words.get(good, 0) + words.pop(syn)
     if return_words:
         return words
 
@@ -382,7 +429,7 @@ def repositories_to_words(queryset, words=None, return_words=True):
     """
     if words is None:
         words = {}
-    qs = queryset.values('slug', 'description', 'readme')
+    qs = queryset.values('slug', 'description', 'readme_digest')
     for repository in qs:
         repository_to_words(repository, words, False, True)
     manage_synonyms(words, False)
@@ -402,6 +449,57 @@ def sort_words(words, limit=1000, return_format=None):
         return sorted_words
     return dict(sorted_words)
 
+class TagMatcher(object):
+    """
+    Find the given tags in texts: only the words which are a tag or a
+    synonym (see `synonyms`) are kept and weighted, the other ones are
+    ignored without building the whole dict of words
+    """
+
+    def __init__(self, tags):
+        super(TagMatcher, self).__init__()
+        self.tags = tags
+        self.nb_tags = len(tags)
+        self.words = frozenset(tags).union(synonyms)
+
+    def is_for(self, tags):
+        """
+        Return True if this matcher can be used for the given tags
+        """
+        return tags is self.tags and len(tags) == self.nb_tags
+
+    def get_tags(self, repository, repository_is_dict=False):
+        """
+        Return a dict with the tags found in the repository, with their
+        weight, like `repository_to_words` + `manage_synonyms`, keeping only
+        the tags
+        """
+        words = {}
+        for text_type, text_weight in text_types.items():
+            if repository_is_dict:
+                text = repository.get(text_type, None)
+            else:
+                text = getattr(repository, text_type, None)
+            if not text:
+                continue
+            for word in self.words.intersection(split_into_words(text)):
+                words[word] = words.get(word, 0) + text_weight
+        manage_synonyms(words, False)
+        for word in words.keys():
+            if word not in self.tags:
+                del words[word]
+        return words
+
+def get_tag_matcher(tags):
+    """
+    Return (and cache) a TagMatcher for the given tags. The cached one is
+    used while the same set of tags is given (see `all_official_tags`)
+    """
+    if get_tag_matcher._cache is None or not get_tag_matcher._cache.is_for(tags):
+        get_tag_matcher._cache = TagMatcher(tags)
+    return get_tag_matcher._cache
+get_tag_matcher._cache = None
+
 def get_tags_for_repository(repository, all_tags, repository_is_dict=False):
     """
     Given a list of tags, check for them in a repository and return the found
@@ -410,7 +508,15 @@ def get_tags_for_repository(repository, all_tags, repository_is_dict=False):
     "description" in a dict (using values in your queryset instead of a whole
     one)
     """
-    tags_dict = manage_synonyms(repository_to_words(repository, repository_is_dict=repository_is_dict))
+    return get_tag_matcher(all_tags).get_tags(repository, repository_is_dict)
+
+def _get_tags_for_repository_dict(repository, all_tags, repository_is_dict=False):
+    """
+    The original version of `get_tags_for_repository`, building the dict of
+    all words of the repository (with the original tokenizer). Kept to check
+    the TagMatcher (see tests and the `words_benchmark` command)
+    """
+    tags_dict = manage_synonyms(repository_to_words(repository, repository_is_dict=repository_is_dict, split=_split_into_words_loop))
     tags_ok = all_tags.intersection(set(tags_dict.keys()))
     for tag in tags_dict.keys():
         if tag not in tags_ok:
@@ -0,0 +1,240 @@
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.template.loader import render_to_string
+from django.utils import simplejson
+
+# fields on which we can seek, with the pk as tie-breaker
+KEYSET_FIELDS = ('slug_sort', 'score', 'official_modified', 'project_sort')
+
+CURSOR_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPaginator(object):
+    """
+    A paginator which, instead of using an OFFSET, get the objects after (or
+    before) the sort value and pk of the last (or first) object of the previous
+    page (the "cursor"), so deep pages are as fast as the first one.
+    Works only on querysets ordered by one of the KEYSET_FIELDS.
+    If `approximate_count` is set, the count will stop at this number (and
+    `count_is_approximate` will be True if there is more objects)
+    """
+
+    def __init__(self, object_list, per_page, request=None, approximate_count=None):
+        super(KeysetPaginator, self).__init__()
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.request = request
+        self.approximate_count = approximate_count
+        self.field, self.reverse = self.get_order(object_list)
+        self._count = None
+        self.count_is_approximate = False
+
+    @staticmethod
+    def get_order(object_list):
+        """
+        Return the field used to sort the given queryset, and True if the order
+        is descending. Field is None if the queryset cannot be used for seeking.
+        """
+        if not isinstance(object_list, QuerySet):
+            return None, False
+        order_by = object_list.query.order_by
+        if len(order_by) != 1:
+            return None, False
+        field = order_by[0]
+        reverse = field.startswith('-')
+        if reverse:
+            field = field[1:]
+        if field not in KEYSET_FIELDS:
+            return None, False
+        return field, reverse
+
+    @classmethod
+    def supports(cls, object_list):
+        """
+        Return True if the given object list can be paginated by this paginator
+        """
+        return cls.get_order(object_list)[0] is not None
+
+    def _get_count(self):
+        """
+        Return the number of objects, stopping at `approximate_count` if defined
+        """
+        if self._count is None:
+            if self.approximate_count:
+                # count() ignores the limits of the queryset (they are only
+                # applied to its result), so we fetch at most the needed pks
+                self._count = len(self.object_list.order_by().values_list('pk', flat=True)[:self.approximate_count + 1])
+                if self._count > self.approximate_count:
+                    self._count = self.approximate_count
+                    self.count_is_approximate = True
+            else:
+                self._count = self.object_list.count()
+        return self._count
+    count = property(_get_count)
+
+    def encode_cursor(self, obj):
+        """
+        Return a string to use in urls, with the sort value and the pk of the
+        given object
+        """
+        value = getattr(obj, self.field)
+        if isinstance(value, datetime):
+            value = value.strftime(CURSOR_DATE_FORMAT)
+        return urlsafe_b64encode(simplejson.dumps([value, obj.pk]))
+
+    def decode_cursor(self, cursor):
+        """
+        Return the sort value and the pk saved in the given cursor string
+        """
+        try:
+            value, pk = simplejson.loads(urlsafe_b64decode(str(cursor)))
+            if value is not None and self.field == 'official_modified':
+                value = datetime.strptime(value, CURSOR_DATE_FORMAT)
+            return value, int(pk)
+        except Exception:
+            raise InvalidCursor
+
+    def seek(self, value, pk, descending):
+        """
+        Return a Q object to get objects after the given sort value and pk,
+        following the given order.
+        Null values are at the end in ascending order, and at the start in
+        descending order (like postgresql does)
+        """
+        operator = 'lt' if descending else 'gt'
+        if value is None:
+            q = Q(**{'%s__isnull' % self.field: True, 'pk__%s' % operator: pk})
+            if descending:
+                q = q | Q(**{'%s__isnull' % self.field: False})
+        else:
+            q = Q(**{'%s__%s' % (self.field, operator): value}) | Q(**{
+                self.field: value, 'pk__%s' % operator: pk})
+            if not descending:
+                q = q | Q(**{'%s__isnull' % self.field: True})
+        return q
+
+    def ordered(self, descending):
+        """
+        Return the object list ordered by the field and the pk
+        """
+        prefix = '-' if descending else ''
+        return self.object_list.order_by(prefix + self.field, prefix + 'pk')
+
+    def page(self, after=None, before=None, number=1):
+        """
+        Return the page of objects after the `after` cursor, or before the
+        `before` one. Without cursor, the `number` is used to get the page
+        with an offset (only useful for old urls)
+        """
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+
+        if before:
+            # get the objects in the reverse order, then reorder them
+            value, pk = self.decode_cursor(before)
+            descending = not self.reverse
+            queryset = self.ordered(descending).filter(self.seek(value, pk, descending))
+            objects = list(queryset[:self.per_page + 1])
+            has_previous = len(objects) > self.per_page
+            objects = objects[:self.per_page]
+            objects.reverse()
+            return KeysetPage(objects, self, number, has_next=True, has_previous=has_previous)
+
+        queryset = self.ordered(self.reverse)
+        if after:
+            value, pk = self.decode_cursor(after)
+            queryset = queryset.filter(self.seek(value, pk, self.reverse))
+            start = 0
+        else:
+            start = (number - 1) * self.per_page
+
+        objects = list(queryset[start:start + self.per_page + 1])
+        has_next = len(objects) > self.per_page
+        return KeysetPage(objects[:self.per_page], self, number, has_next=has_next, has_previous=number > 1)
+
+
+class KeysetPage(object):
+    """
+    A page of a KeysetPaginator, with the same main attributes as the
+    pure_pagination pages
+    """
+
+    def __init__(self, object_list, paginator, number, has_next, has_previous):
+        super(KeysetPage, self).__init__()
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous and bool(object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _querystring(self, **params):
+        """
+        Return the querystring of the current request, updated with the
+        given params (a None value remove the param)
+        """
+        querydict = self.paginator.request.GET.copy() if self.paginator.request else {}
+        for name in ('page', 'after', 'before', 'querystring_key'):
+            querydict.pop(name, None)
+        for name, value in params.items():
+            if value is not None:
+                querydict[name] = value
+        if hasattr(querydict, 'urlencode'):
+            return querydict.urlencode()
+        return '&'.join('%s=%s' % item for item in querydict.items())
+
+    def next_querystring(self):
+        """
+        Querystring to get the next page
+        """
+        if not self.has_next():
+            return ''
+        return self._querystring(page=self.number + 1,
+                                 after=self.paginator.encode_cursor(self.object_list[-1]))
+
+    def previous_querystring(self):
+        """
+        Querystring to get the previous page
+        """
+        if not self.has_previous():
+            return ''
+        if self.number <= 2:
+            return self._querystring()
+        return self._querystring(page=self.number - 1,
+                                 before=self.paginator.encode_cursor(self.object_list[0]))
+
+    def render(self):
+        """
+        Render the navigation links
+        """
+        return render_to_string('pure_pagination/keyset_pagination.html', {
+            'current_page': self,
+        })
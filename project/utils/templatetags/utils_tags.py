@@ -4,6 +4,9 @@ from uuid import uuid4
 
 from django.utils.safestring import mark_safe
 from django import template
+
+from endless_pagination.settings import PER_PAGE
+from utils.pagination import KeysetPaginator, InvalidCursor
 register = template.Library()
 
 @register.filter
@@ -112,3 +115,66 @@ def do_uuid(parser, token):
 
 do_uuid = register.tag('uuid', do_uuid)
 
+
+
+class KeysetPaginateNode(template.Node):
+    """
+    Replace the objects in the context by the objects of the current page
+    of a KeysetPaginator, and save this page in `keyset_page` (None if
+    the objects cannot be paginated this way)
+    """
+    def __init__(self, objects, per_page):
+        self.objects = template.Variable(objects)
+        self.objects_name = objects
+        self.per_page = template.Variable(per_page) if per_page else None
+
+    def render(self, context):
+        objects = self.objects.resolve(context)
+        context['keyset_page'] = None
+        if not KeysetPaginator.supports(objects):
+            return ''
+
+        per_page = self.per_page.resolve(context) if self.per_page else PER_PAGE
+        request = context['request']
+
+        paginator = KeysetPaginator(objects, per_page, request=request)
+        try:
+            page = paginator.page(request.GET.get('after'), request.GET.get('before'), request.GET.get('page', 1))
+        except InvalidCursor:
+            page = paginator.page()
+
+        context[self.objects_name] = page.object_list
+        context['keyset_page'] = page
+        return ''
+
+@register.tag
+def keyset_paginate(parser, token):
+    """
+    Paginate objects with a KeysetPaginator, to be used with
+    `keyset_show_more`, like the `lazy_paginate` tag of endless_pagination.
+    Usage: {% keyset_paginate objects %} or {% keyset_paginate per_page objects %}
+    """
+    bits = token.split_contents()
+    if len(bits) == 2:
+        return KeysetPaginateNode(bits[1], None)
+    elif len(bits) == 3:
+        return KeysetPaginateNode(bits[2], bits[1])
+    raise template.TemplateSyntaxError, "%r tag requires one or two arguments" % bits[0]
+
+@register.inclusion_tag('endless/show_more.html', takes_context=True)
+def keyset_show_more(context, label=None, loading=None):
+    """
+    Display a "show more" link for the page saved by `keyset_paginate`,
+    using the endless_pagination template
+    """
+    page = context['keyset_page']
+    querystring = ''
+    if page and page.has_next():
+        querystring = '?' + page.next_querystring()
+    return dict(
+        path = context['request'].path,
+        querystring = querystring,
+        querystring_key = 'page',
+        label = label,
+        loading = loading,
+    )
@@ -3,12 +3,23 @@
 from django.http import Http404
 from pure_pagination import Paginator, InvalidPage
 from utils.djson.response import JSONResponse
+from utils.pagination import KeysetPaginator, InvalidCursor
 
-def paginate(request, objects, per_page):
+def paginate(request, objects, per_page, keyset=False, approximate_count=None):
     """
     Paginate the given `objects` list, with `per_page` entries per page,
-    using the `page` GET parameter from the request
+    using the `page` GET parameter from the request.
+    If `keyset` is True and the objects are a queryset sorted on a field
+    allowing it, use the `after` and `before` GET parameters to seek
+    pages instead of using an offset (see KeysetPaginator)
     """
+    if keyset and KeysetPaginator.supports(objects):
+        paginator = KeysetPaginator(objects, per_page, request=request, approximate_count=approximate_count)
+        try:
+            return paginator.page(request.GET.get('after'), request.GET.get('before'), request.GET.get('page', 1))
+        except InvalidCursor:
+            raise Http404
+
     paginator = Paginator(objects, per_page, request=request)
     try:
         page = paginator.page(request.GET.get('page', 1))
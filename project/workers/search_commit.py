@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
+
+"""
+Commit the search index when there is enough pending writes, or when the
+oldest one is too old (see core.search_commit)
+Only one process of this worker must run.
+"""
+
+from workers_tools import init_django, stop_signal
+init_django()
+
+import sys
+import time
+import traceback
+from datetime import datetime
+
+from django.conf import settings
+
+from haystack import site
+
+from core.models import Account
+from core.search_commit import (get_pending_writes, take_pending_writes, add_pending_writes,
+                                commit_needed, save_stats, bump_index_generation, COMMIT_NEEDED)
+
+run_ok = True
+
+# max time to wait between two checks, in seconds
+MAX_SLEEP = 1
+
+
+def commit(backend, soft):
+    """
+    Commit the search engine, using a soft commit if asked
+    """
+    if soft:
+        backend.conn._update('<commit softCommit="true" />', commit=False)
+    else:
+        backend.conn.commit()
+
+
+def main():
+    """
+    Main function to run forever...
+    """
+    global run_ok
+
+    if not COMMIT_NEEDED:
+        sys.stderr.write("The search engine commits on each write, this worker is not needed\n")
+        return
+
+    backend = site.get_index(Account).backend
+    soft = getattr(settings, 'SEARCH_COMMIT_SOFT', False)
+
+    nb = 0
+    while run_ok:
+        count, first, models = get_pending_writes()
+
+        if not commit_needed(count, first):
+            if first:
+                wait = first + settings.SEARCH_COMMIT_MAX_DELAY - time.time()
+            else:
+                wait = MAX_SLEEP
+            time.sleep(max(0.05, min(wait, MAX_SLEEP)))
+            continue
+
+        count, first, models = take_pending_writes()
+        if not count:
+            continue
+
+        nb += 1
+        d = datetime.utcnow()
+        sys.stderr.write("[%s  #%d] commit %d documents" % (d, nb, count))
+
+        start = time.time()
+        try:
+            commit(backend, soft)
+        except Exception, e:
+            # put back pending writes to retry later
+            for model_name, nb_writes in models.items():
+                add_pending_writes(model_name, nb_writes, first)
+            sys.stderr.write(" => ERROR : %s (see below)\n" % e)
+            sys.stderr.write("====================================================================\n")
+            sys.stderr.write('\n'.join(traceback.format_exception(*sys.exc_info())))
+            sys.stderr.write("====================================================================\n")
+            time.sleep(MAX_SLEEP)
+        else:
+            end = time.time()
+            # invalidate the cached search results
+            bump_index_generation(*models.keys())
+            save_stats(count, end - first, end - start, soft)
+            sys.stderr.write(" in %.3fs, lag=%.3fs\n" % (end - start, end - first))
+
+
+def signal_handler(signum, frame):
+    global run_ok
+    run_ok = False
+
+if __name__ == "__main__":
+    stop_signal(signal_handler)
+    main()
@@ -3,7 +3,8 @@
 # Repos.io / Copyright Stephane Angel / Creative Commons BY-NC-SA license
 
 """
-Update related data (score, haystack, tags) for objects (core.models.SyncableModel.update_related_data)
+Update related data (score, haystack, tags) for objects (core.models.SyncableModel.update_related_data),
+or only their search document (core.models.SyncableModel.update_search_index)
 """
 
 from workers_tools import init_django, stop_signal
@@ -20,21 +21,24 @@ from haystack import site
 import redis
 
 from core.models import Account, Repository
+from core.search_documents import SearchDocumentsBuilder
 
 run_ok = True
 
 @transaction.commit_manually
 def run_one(obj):
     """
-    Update related for `obj`, in its own transaction
+    Update related for `obj`, in its own transaction.
+    Return True if the public tags were computed
     """
     try:
-        obj.update_related_data(async=False)
+        tags_computed = obj.update_related_data(async=False)
     except (IntegrityError, DatabaseError), e:
         transaction.rollback()
         raise e
     else:
         transaction.commit()
+    return tags_computed
 
 def main():
     """
@@ -48,18 +52,32 @@ def main():
         'core.account': (Account, ()),
         'core.repository': (Repository, ('owner',)),
     }
+    builders = dict((model_name, SearchDocumentsBuilder(model)) for model_name, (model, select_related) in models.items())
 
     nb = 0
     max_nb = 2500
+    # public tags computed or skipped (inputs not changed)
+    tags_stats = dict(computed=0, skipped=0)
     while run_ok:
-        list_name, obj_str = redis_instance.blpop(settings.WORKER_UPDATE_RELATED_DATA_KEY)
-        redis_instance.srem(settings.WORKER_UPDATE_RELATED_DATA_SET_KEY, obj_str)
+        # full updates first: they also update the search documents
+        list_name, obj_str = redis_instance.blpop([settings.WORKER_UPDATE_RELATED_DATA_KEY,
+                                                   settings.WORKER_UPDATE_SEARCH_INDEX_KEY])
+        index_only = list_name == settings.WORKER_UPDATE_SEARCH_INDEX_KEY
+        if index_only:
+            redis_instance.srem(settings.WORKER_UPDATE_SEARCH_INDEX_SET_KEY, obj_str)
+            if redis_instance.sismember(settings.WORKER_UPDATE_RELATED_DATA_SET_KEY, obj_str):
+                # a full update is queued for this object
+                continue
+        else:
+            redis_instance.srem(settings.WORKER_UPDATE_RELATED_DATA_SET_KEY, obj_str)
 
         nb += 1
-        len_to_update = redis_instance.scard(settings.WORKER_UPDATE_RELATED_DATA_SET_KEY)
+        len_to_update = redis_instance.scard(settings.WORKER_UPDATE_RELATED_DATA_SET_KEY) \
+                      + redis_instance.scard(settings.WORKER_UPDATE_SEARCH_INDEX_SET_KEY)
 
         d = datetime.utcnow()
-        sys.stderr.write("[%s  #%d | left : %d] %s" % (d, nb, len_to_update, obj_str))
+        sys.stderr.write("[%s  #%d | left : %d] %s%s" % (d, nb, len_to_update, obj_str,
+                                                          ' (search index only)' if index_only else ''))
 
         try:
             # find the object
@@ -72,10 +90,16 @@ def main():
                 obj = obj.select_related(*select_related)
             obj = obj.get(pk=id)
 
+            # fetch data needed for the search index in a few queries
+            builders[model_name].prefetch([obj])
+
             sys.stderr.write(' (%s)' % obj)
 
             # if still here, update the object
-            run_one(obj)
+            if index_only:
+                obj.update_search_index()
+            else:
+                tags_computed = run_one(obj)
 
         except Exception, e:
             sys.stderr.write(" => ERROR : %s (see below)\n" % e)
@@ -84,7 +108,16 @@ def main():
             sys.stderr.write("====================================================================\n")
 
         else:
-            sys.stderr.write(" in %s =>  score=%d, tags=(%s)\n" % (datetime.utcnow()-d, obj.score, ', '.join(obj.all_public_tags().values_list('slug', flat=True))))
+            if index_only:
+                sys.stderr.write(" in %s\n" % (datetime.utcnow()-d))
+            else:
+                tags_status = 'computed' if tags_computed else 'skipped'
+                tags_stats[tags_status] += 1
+                redis_instance.hincrby(settings.WORKER_UPDATE_RELATED_DATA_STATS_KEY, 'tags_%s' % tags_status, 1)
+                skip_rate = 100.0 * tags_stats['skipped'] / (tags_stats['computed'] + tags_stats['skipped'])
+
+                sys.stderr.write(" in %s =>  score=%d, tags=(%s) %s (%.1f%% skipped)\n" % (datetime.utcnow()-d, obj.score,
+                    ', '.join(tag.slug for tag in obj.all_public_tags()), tags_status, skip_rate))
 
         if nb >= max_nb:
             run_ok = False